@@ -1,78 +1,172 @@
 from django.contrib import admin
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
 from .models import (UserProfile, Team, TeamMembership, Project, Document,
                      Version, PullRequest, Review, WorkItem, Comment, Activity)
+from .utils.changelist import EstimatedCountPaginator, csv_rows
+from .utils.export import aiterate
+from .utils.purge import purger
+
+
+@admin.action(description='Export selected %(verbose_name_plural)s as CSV', permissions=['export'])
+def export_csv(modeladmin, request, queryset):
+    # Only the columns a ModelAdmin lists in csv_fields are ever exported.
+    rows = csv_rows(queryset.select_related(None).prefetch_related(None), modeladmin.csv_fields)
+    if isinstance(request, ASGIRequest):
+        rows = aiterate(rows)
+    response = StreamingHttpResponse(rows, content_type='text/csv')
+    filename = slugify(queryset.model._meta.verbose_name_plural)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist for tables too big to count exactly or to sort on an unindexed
+    column, with a streaming CSV export of the ``csv_fields`` columns for
+    users holding the model's ``export_<model>`` permission.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+    actions = [export_csv]
+    csv_fields = ['id']
+
+    def has_export_permission(self, request):
+        # Actions pass with any one of their permissions, so view is checked here.
+        permission = f'{self.opts.app_label}.export_{self.opts.model_name}'
+        return self.has_view_permission(request) and request.user.has_perm(permission)
 
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'role', 'created_at']
     list_filter = ['role']
+    list_select_related = ['user']
     search_fields = ['user__username', 'user__email']
+    autocomplete_fields = ['user']
 
 
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
     list_display = ['name', 'created_by', 'created_at']
+    list_select_related = ['created_by']
     search_fields = ['name']
+    autocomplete_fields = ['created_by']
 
 
 @admin.register(TeamMembership)
 class TeamMembershipAdmin(admin.ModelAdmin):
     list_display = ['user', 'team', 'role', 'joined_at']
     list_filter = ['role']
+    list_select_related = ['user', 'team']
+    autocomplete_fields = ['user', 'team']
 
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ['name', 'owner', 'status', 'is_public', 'created_at']
     list_filter = ['status', 'is_public']
+    list_select_related = ['owner']
     search_fields = ['name', 'description']
+    autocomplete_fields = ['owner', 'team', 'collaborators']
+
+    # Mark and purge in the background instead of cascading in the request,
+    # and don't collect every related row for the confirmation page either.
+    def get_deleted_objects(self, objs, request):
+        projects = [str(obj) for obj in objs]
+        return projects, {Project._meta.verbose_name_plural: len(projects)}, set(), []
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Project.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        for project in queryset:
+            if project.mark_deleted():
+                transaction.on_commit(lambda pk=project.pk: purger.purge_later(pk))
 
 
 @admin.register(Document)
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(LargeTableAdmin):
     list_display = ['name', 'project', 'file_type', 'created_by', 'created_at']
     list_filter = ['file_type']
+    list_select_related = ['project', 'created_by']
     search_fields = ['name', 'description']
+    autocomplete_fields = ['project', 'created_by']
+    csv_fields = ['id', 'name', 'project_id', 'file_type', 'status', 'created_by_id', 'created_at', 'updated_at']
 
 
 @admin.register(Version)
-class VersionAdmin(admin.ModelAdmin):
+class VersionAdmin(LargeTableAdmin):
     list_display = ['document', 'version_number', 'uploaded_by', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['document', 'uploaded_by']
+    raw_id_fields = ['document']
+    autocomplete_fields = ['uploaded_by']
+    csv_fields = ['id', 'document_id', 'version_number', 'file_size', 'content_hash', 'uploaded_by_id', 'created_at']
 
 
 @admin.register(PullRequest)
-class PullRequestAdmin(admin.ModelAdmin):
+class PullRequestAdmin(LargeTableAdmin):
     list_display = ['title', 'project', 'status', 'created_by', 'created_at']
     list_filter = ['status']
+    list_select_related = ['project', 'created_by']
     search_fields = ['title', 'description']
+    raw_id_fields = ['document', 'source_version', 'target_version']
+    autocomplete_fields = ['project', 'created_by', 'merged_by', 'reviewers']
+    csv_fields = [
+        'id', 'title', 'project_id', 'document_id', 'source_version_id', 'target_version_id', 'status',
+        'created_by_id', 'created_at', 'merged_at', 'merged_by_id',
+    ]
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ['pull_request', 'reviewer', 'status', 'created_at']
     list_filter = ['status']
+    list_select_related = ['pull_request', 'reviewer']
+    raw_id_fields = ['pull_request']
+    autocomplete_fields = ['reviewer']
+    csv_fields = ['id', 'pull_request_id', 'reviewer_id', 'status', 'created_at']
 
 
 @admin.register(WorkItem)
-class WorkItemAdmin(admin.ModelAdmin):
+class WorkItemAdmin(LargeTableAdmin):
     list_display = [
         'title', 'project', 'item_type', 'priority', 'status', 'assigned_to'
     ]
     list_filter = ['item_type', 'priority', 'status']
+    list_select_related = ['project', 'assigned_to']
     search_fields = ['title', 'description']
+    raw_id_fields = ['document']
+    autocomplete_fields = ['project', 'assigned_to', 'created_by']
+    csv_fields = [
+        'id', 'title', 'item_type', 'priority', 'status', 'project_id', 'document_id', 'assigned_to_id',
+        'created_by_id', 'due_date', 'created_at', 'updated_at',
+    ]
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ['author', 'content', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['author']
+    raw_id_fields = ['document', 'pull_request', 'work_item', 'parent', 'root']
+    autocomplete_fields = ['author']
+    csv_fields = [
+        'id', 'author_id', 'document_id', 'pull_request_id', 'work_item_id', 'parent_id', 'root_id', 'content',
+        'created_at',
+    ]
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(LargeTableAdmin):
     list_display = [
         'user', 'action', 'target_type', 'target_name', 'created_at'
     ]
     list_filter = ['action', 'target_type']
+    list_select_related = ['user']
+    autocomplete_fields = ['user', 'project']
+    csv_fields = ['id', 'user_id', 'action', 'target_type', 'target_id', 'target_name', 'project_id', 'created_at']
@@ -0,0 +1,606 @@
+"""
+JSON API over projects, documents, versions, pull requests, work items,
+comments and activity, for integrations that would otherwise scrape pages.
+
+    GET    /api/<resource>/         newest first, cursor-paginated
+    GET    /api/<resource>/<id>/
+    POST   /api/<resource>/         create, where the resource allows it
+    PATCH  /api/<resource>/<id>/    update, where the resource allows it
+    DELETE /api/<resource>/<id>/    delete, where the resource allows it
+    POST   /api/batch/              several of the above in one transaction
+
+``fields=a,b`` returns (and loads, through ``.only()``) just those fields.
+``include=rel,...`` sideloads related objects into ``included`` with
+``prefetch_related``; ``fields[rel]=`` trims those the same way. Lists take
+``limit``, ``cursor`` and the equality filters each resource names.
+
+Requests are authenticated by the session cookie, and writes need the CSRF
+token like any other POST. Visibility and write access follow the HTML views.
+"""
+import base64
+import json
+import logging
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.db.models.fields.files import FileField
+from django.forms import modelform_factory
+from django.forms.models import model_to_dict
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict
+from django.urls import Resolver404, resolve
+from django.views.decorators.http import require_POST
+
+from .forms import ProjectForm, WorkItemForm, CommentForm
+from .models import Project, Document, Version, PullRequest, WorkItem, Comment, Activity
+from .utils.purge import purger
+
+logger = logging.getLogger('doctrack.api')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.payload = {'error': message, **extra}
+
+
+def client_error(exc):
+    """The ``ApiError`` for an exception caused by the request rather than a bug, else None."""
+    if isinstance(exc, ApiError):
+        return exc
+    if isinstance(exc, (Http404, ObjectDoesNotExist)):
+        return ApiError(404, str(exc) or 'Not found')
+    if isinstance(exc, PermissionDenied):
+        return ApiError(403, str(exc) or 'Permission denied')
+    if isinstance(exc, (ValueError, OverflowError, ValidationError)):
+        return ApiError(400, f'Invalid request: {exc}')
+    return None
+
+
+def page_size(query):
+    default = getattr(settings, 'DOCTRACK_API_PAGE_SIZE', 50)
+    try:
+        limit = int(query.get('limit', default))
+    except ValueError:
+        raise ApiError(400, 'limit must be an integer')
+    return max(1, min(limit, getattr(settings, 'DOCTRACK_API_MAX_PAGE_SIZE', 200)))
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApiError(400, 'Invalid cursor')
+
+
+def _split(value):
+    return [part for part in (value or '').split(',') if part]
+
+
+def visible_projects(user):
+    return Project.objects.filter(Q(is_public=True) | Q(owner=user) | Q(collaborators=user)).values('pk')
+
+
+def writable_projects(user):
+    return Project.objects.filter(Q(owner=user) | Q(collaborators=user)).values('pk')
+
+
+class Resource:
+    model = None
+    fields = ()
+    filters = ()
+    # include name -> resource name of the related objects
+    relations = {}
+    # lookup from the model to its project
+    project_path = 'project'
+    form_class = None
+    creatable = False
+    updatable = False
+    deletable = False
+    activity_type = None
+
+    # Access
+
+    def scope(self, projects):
+        return Q(**{f'{self.project_path}__in': projects})
+
+    def visible(self, user):
+        return self.model.objects.filter(self.scope(visible_projects(user)))
+
+    def can_write(self, user, obj):
+        return self.model.objects.filter(self.scope(writable_projects(user)), pk=obj.pk).exists()
+
+    # Reading
+
+    def selected_fields(self, query, key='fields'):
+        names = _split(query.get(key)) or list(self.fields)
+        unknown = set(names) - set(self.fields) - {'id'}
+        if unknown:
+            raise ApiError(400, f'Unknown fields for {self.name}: {", ".join(sorted(unknown))}')
+        return ['id'] + [name for name in names if name != 'id']
+
+    def only(self, names, extra=()):
+        """Column names for ``.only()``: the requested fields plus any foreign keys a prefetch needs."""
+        return list(dict.fromkeys(['id', *names, *extra]))
+
+    def queryset(self, user, query):
+        rows = self.visible(user)
+        fields = self.selected_fields(query)
+        includes = _split(query.get('include'))
+        needed = []
+        for include in includes:
+            if include not in self.relations:
+                raise ApiError(400, f'{self.name} has no relation {include}')
+            field = self.model._meta.get_field(include)
+            related = RESOURCES[self.relations[include]]
+            related_fields = related.selected_fields(query, f'fields[{include}]')
+            if field.many_to_one:
+                # Forward FK: the prefetch joins on our column.
+                needed.append(field.name)
+                related_only = related.only(related_fields)
+            else:
+                # Reverse FK: it joins on theirs.
+                related_only = related.only(related_fields, [field.field.name])
+            rows = rows.prefetch_related(
+                Prefetch(include, queryset=related.model.objects.only(*related_only))
+            )
+        return rows.only(*self.only(fields, needed)), fields, includes
+
+    def serialize(self, obj, fields):
+        data = {}
+        for name in fields:
+            field = self.model._meta.get_field(name)
+            if field.many_to_one:
+                data[name] = getattr(obj, field.attname)
+            elif isinstance(field, FileField):
+                value = getattr(obj, name)
+                data[name] = value.url if value else None
+            else:
+                data[name] = getattr(obj, name)
+        return data
+
+    def render(self, objects, fields, includes, query):
+        data = []
+        included = {}
+        for obj in objects:
+            row = self.serialize(obj, fields)
+            for include in includes:
+                related = RESOURCES[self.relations[include]]
+                related_fields = related.selected_fields(query, f'fields[{include}]')
+                field = self.model._meta.get_field(include)
+                targets = [getattr(obj, include)] if field.many_to_one else list(getattr(obj, include).all())
+                targets = [target for target in targets if target is not None]
+                bucket = included.setdefault(include, {})
+                for target in targets:
+                    bucket.setdefault(target.pk, related.serialize(target, related_fields))
+                ids = [target.pk for target in targets]
+                row[include] = ids if not field.many_to_one else (ids[0] if ids else None)
+            data.append(row)
+        return data, {name: list(rows.values()) for name, rows in included.items()}
+
+    def list(self, user, query):
+        rows, fields, includes = self.queryset(user, query)
+        if query.get('cursor'):
+            rows = rows.filter(pk__lt=decode_cursor(query['cursor']))
+        limit = page_size(query)
+        try:
+            for name in self.filters:
+                if name in query:
+                    rows = rows.filter(**{name: query[name]})
+            # One extra row says whether there is another page.
+            objects = list(rows.order_by('-pk')[:limit + 1])
+        except (ValueError, ValidationError) as e:
+            raise ApiError(400, f'Invalid filter value: {e}')
+        more = len(objects) > limit
+        objects = objects[:limit]
+        data, included = self.render(objects, fields, includes, query)
+        payload = {'data': data, 'next_cursor': encode_cursor(objects[-1].pk) if more else None}
+        if includes:
+            payload['included'] = included
+        return payload
+
+    def get_object(self, user, pk, query=None):
+        rows, fields, includes = self.queryset(user, query or QueryDict())
+        obj = rows.filter(pk=pk).first()
+        if obj is None:
+            raise ApiError(404, f'No {self.name} with id {pk}')
+        return obj, fields, includes
+
+    def detail(self, user, pk, query):
+        obj, fields, includes = self.get_object(user, pk, query)
+        data, included = self.render([obj], fields, includes, query)
+        payload = {'data': data[0]}
+        if includes:
+            payload['included'] = included
+        return payload
+
+    # Writing
+
+    def get_form(self, user, data, instance=None):
+        return self.form_class(data, instance=instance)
+
+    def prepare(self, user, obj, data):
+        """Set the fields a new object takes from the request rather than the payload."""
+
+    def validate(self, user, obj, creating):
+        if not self.can_write(user, obj):
+            raise ApiError(403, f'You cannot change this {self.name}')
+
+    def save(self, user, data, instance=None):
+        creating = instance is None
+        if instance is not None:
+            data = {**model_to_dict(instance, fields=self.form_class._meta.fields), **data}
+        else:
+            # Omitted fields take the model's defaults, as they would in the ORM.
+            defaults = {
+                name: self.model._meta.get_field(name).get_default()
+                for name in self.form_class._meta.fields
+                if self.model._meta.get_field(name).has_default()
+            }
+            data = {**defaults, **data}
+        form = self.get_form(user, data, instance)
+        if not form.is_valid():
+            raise ApiError(400, 'Invalid data', fields=form.errors.get_json_data())
+        obj = form.save(commit=False)
+        if creating:
+            self.prepare(user, obj, data)
+        with transaction.atomic():
+            obj.save()
+            form.save_m2m()
+            self.validate(user, obj, creating)
+            if creating and self.activity_type:
+                Activity.objects.create(
+                    user=user, action='created', target_type=self.activity_type,
+                    target_id=obj.pk, target_name=str(obj)[:255], project=self.project_of(obj),
+                )
+        return obj
+
+    def project_of(self, obj):
+        return obj.project
+
+    def create(self, user, data):
+        if not self.creatable:
+            raise ApiError(405, f'{self.name} cannot be created through the API')
+        obj = self.save(user, data)
+        return self.detail(user, obj.pk, QueryDict())
+
+    def update(self, user, pk, data):
+        if not self.updatable:
+            raise ApiError(405, f'{self.name} cannot be changed through the API')
+        obj = self.visible(user).filter(pk=pk).first()
+        if obj is None:
+            raise ApiError(404, f'No {self.name} with id {pk}')
+        self.validate(user, obj, False)
+        self.save(user, data, obj)
+        return self.detail(user, pk, QueryDict())
+
+    def delete(self, user, pk):
+        if not self.deletable:
+            raise ApiError(405, f'{self.name} cannot be deleted through the API')
+        obj = self.visible(user).filter(pk=pk).first()
+        if obj is None:
+            raise ApiError(404, f'No {self.name} with id {pk}')
+        self.validate(user, obj, False)
+        self.remove(user, obj)
+
+    def remove(self, user, obj):
+        obj.delete()
+
+
+class ProjectResource(Resource):
+    name = 'projects'
+    model = Project
+    fields = ('name', 'description', 'team', 'owner', 'status', 'is_public', 'created_at', 'updated_at')
+    filters = ('status', 'owner', 'team', 'is_public')
+    relations = {'documents': 'documents', 'pull_requests': 'pull_requests', 'work_items': 'work_items'}
+    form_class = ProjectForm
+    creatable = updatable = deletable = True
+    activity_type = 'Project'
+
+    def scope(self, projects):
+        return Q(pk__in=projects)
+
+    def can_write(self, user, obj):
+        # Settings are the owner's, as in the project settings page.
+        return obj.owner_id == user.pk
+
+    def get_form(self, user, data, instance=None):
+        return ProjectForm(data, instance=instance, user=user)
+
+    def prepare(self, user, obj, data):
+        obj.owner = user
+
+    def remove(self, user, obj):
+        # Hidden now, purged in the background; see utils.purge.
+        if obj.mark_deleted():
+            transaction.on_commit(lambda: purger.purge_later(obj.pk))
+
+    def project_of(self, obj):
+        return obj
+
+
+class DocumentResource(Resource):
+    name = 'documents'
+    model = Document
+    fields = ('name', 'project', 'file_type', 'status', 'description', 'created_by', 'created_at', 'updated_at')
+    filters = ('project', 'file_type', 'status', 'created_by')
+    relations = {
+        'project': 'projects', 'versions': 'versions', 'pull_requests': 'pull_requests',
+        'work_items': 'work_items', 'comments': 'comments',
+    }
+    # Files are uploaded through the upload pages.
+    form_class = modelform_factory(Document, fields=('name', 'description', 'status'))
+    updatable = True
+
+
+class VersionResource(Resource):
+    name = 'versions'
+    model = Version
+    fields = (
+        'document', 'version_number', 'file', 'file_size', 'content_hash',
+        'change_summary', 'uploaded_by', 'created_at',
+    )
+    filters = ('document', 'uploaded_by')
+    relations = {'document': 'documents'}
+    project_path = 'document__project'
+
+
+class PullRequestResource(Resource):
+    name = 'pull_requests'
+    model = PullRequest
+    fields = (
+        'title', 'description', 'project', 'document', 'source_version', 'target_version',
+        'status', 'created_by', 'created_at', 'updated_at', 'merged_at', 'merged_by',
+    )
+    filters = ('project', 'document', 'status', 'created_by')
+    relations = {
+        'project': 'projects', 'document': 'documents', 'source_version': 'versions',
+        'target_version': 'versions', 'comments': 'comments',
+    }
+    # Status changes go through review and merge, which have their own rules.
+    form_class = modelform_factory(PullRequest, fields=('title', 'description'))
+    updatable = True
+
+
+class WorkItemResource(Resource):
+    name = 'work_items'
+    model = WorkItem
+    fields = (
+        'title', 'description', 'item_type', 'priority', 'status', 'project', 'document',
+        'assigned_to', 'created_by', 'due_date', 'created_at', 'updated_at',
+    )
+    filters = ('project', 'document', 'item_type', 'priority', 'status', 'assigned_to', 'created_by')
+    relations = {'project': 'projects', 'document': 'documents', 'comments': 'comments'}
+    form_class = WorkItemForm
+    creatable = updatable = deletable = True
+    activity_type = 'WorkItem'
+
+    def _project(self, user, data, instance):
+        if instance is not None:
+            return instance.project
+        project = Project.objects.filter(pk=data.get('project'), pk__in=writable_projects(user)).first()
+        if project is None:
+            raise ApiError(403, 'project must be a project you can add work items to')
+        return project
+
+    def get_form(self, user, data, instance=None):
+        return WorkItemForm(data, instance=instance, project=self._project(user, data, instance))
+
+    def save(self, user, data, instance=None):
+        if instance is None:
+            data = dict(data)
+            project = self._project(user, data, None)
+            document = data.get('document')
+            if document is not None and not project.documents.filter(pk=document).exists():
+                raise ApiError(400, 'Invalid data', fields={'document': [{'message': 'Not a document in this project.'}]})
+        return super().save(user, data, instance)
+
+    def prepare(self, user, obj, data):
+        obj.project_id = data['project']
+        obj.document_id = data.get('document')
+        obj.created_by = user
+
+
+class CommentResource(Resource):
+    name = 'comments'
+    model = Comment
+    fields = (
+        'content', 'author', 'document', 'pull_request', 'work_item', 'parent', 'root',
+        'reply_count', 'created_at', 'updated_at',
+    )
+    filters = ('document', 'pull_request', 'work_item', 'parent', 'root', 'author')
+    relations = {
+        'document': 'documents', 'pull_request': 'pull_requests', 'work_item': 'work_items',
+        'parent': 'comments', 'root': 'comments',
+    }
+    form_class = CommentForm
+    creatable = updatable = deletable = True
+
+    TARGETS = ('document', 'pull_request', 'work_item')
+
+    def scope(self, projects):
+        return (
+            Q(document__project__in=projects) | Q(pull_request__project__in=projects)
+            | Q(work_item__project__in=projects)
+        )
+
+    def can_write(self, user, obj):
+        # Anyone who can see a thread can reply; only authors edit or delete.
+        return obj.author_id == user.pk
+
+    def save(self, user, data, instance=None):
+        if instance is None:
+            return self.create_comment(user, data)
+        return super().save(user, {'content': data.get('content', instance.content)}, instance)
+
+    def create_comment(self, user, data):
+        form = CommentForm(data)
+        if not form.is_valid():
+            raise ApiError(400, 'Invalid data', fields=form.errors.get_json_data())
+        comment = form.save(commit=False)
+        comment.author = user
+
+        targets = [name for name in self.TARGETS if data.get(name) is not None]
+        if len(targets) != 1:
+            raise ApiError(400, 'A comment needs exactly one of document, pull_request or work_item')
+        target = RESOURCES[f'{targets[0]}s'].visible(user).filter(pk=data[targets[0]]).first()
+        if target is None:
+            raise ApiError(404, f'No {targets[0]} with id {data[targets[0]]}')
+        setattr(comment, targets[0], target)
+        if data.get('parent') is not None:
+            comment.parent = Comment.objects.filter(pk=data['parent'], **{targets[0]: target}).first()
+            if comment.parent is None:
+                raise ApiError(400, 'parent must be a comment on the same target')
+
+        with transaction.atomic():
+            comment.save()
+            Activity.objects.create(
+                user=user, action='commented', target_type='Comment', target_id=comment.pk,
+                target_name=comment.content[:50], project=target.project,
+            )
+        return comment
+
+
+class ActivityResource(Resource):
+    name = 'activity'
+    model = Activity
+    fields = ('user', 'action', 'target_type', 'target_id', 'target_name', 'project', 'created_at')
+    filters = ('project', 'user', 'action', 'target_type')
+    relations = {'project': 'projects'}
+
+
+RESOURCES = {
+    resource.name: resource for resource in (
+        ProjectResource(), DocumentResource(), VersionResource(), PullRequestResource(),
+        WorkItemResource(), CommentResource(), ActivityResource(),
+    )
+}
+
+
+def dispatch(user, method, name, pk=None, query=None, body=None):
+    """Run one API call; returns ``(status, payload)`` or raises ``ApiError``."""
+    resource = RESOURCES.get(name)
+    if resource is None:
+        raise ApiError(404, f'Unknown resource {name}')
+    query = query if query is not None else QueryDict()
+    if pk is None:
+        if method == 'GET':
+            return 200, resource.list(user, query)
+        if method == 'POST':
+            return 201, resource.create(user, body or {})
+    elif method == 'GET':
+        return 200, resource.detail(user, pk, query)
+    elif method == 'PATCH':
+        return 200, resource.update(user, pk, body or {})
+    elif method == 'DELETE':
+        resource.delete(user, pk)
+        return 204, None
+    raise ApiError(405, f'{method} is not allowed here')
+
+
+def _body(request):
+    if not request.body:
+        return {}
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        raise ApiError(400, 'Request body must be JSON')
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Request body must be a JSON object')
+    return body
+
+
+def _respond(request, call):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        status, payload = call()
+    except Exception as e:
+        error = client_error(e)
+        if error is None:
+            raise
+        return JsonResponse(error.payload, status=error.status)
+    if payload is None:
+        return HttpResponse(status=status)
+    if payload.get('next_cursor'):
+        query = request.GET.copy()
+        query['cursor'] = payload['next_cursor']
+        payload['next'] = f'{request.path}?{query.urlencode()}'
+    return JsonResponse(payload, status=status)
+
+
+def api_collection(request, resource):
+    return _respond(request, lambda: dispatch(
+        request.user, request.method, resource, query=request.GET,
+        body=_body(request) if request.method == 'POST' else None,
+    ))
+
+
+def api_item(request, resource, pk):
+    return _respond(request, lambda: dispatch(
+        request.user, request.method, resource, pk, query=request.GET,
+        body=_body(request) if request.method == 'PATCH' else None,
+    ))
+
+
+@require_POST
+def api_batch(request):
+    """
+    Run ``{"requests": [{"method", "path", "body"}, ...]}`` in order inside one
+    transaction. The first failure rolls everything back and stops the batch;
+    every sub-request, the failed one included, gets its own status.
+    """
+    def run():
+        requests = _body(request).get('requests')
+        if not isinstance(requests, list) or not requests:
+            raise ApiError(400, 'requests must be a non-empty list')
+        limit = getattr(settings, 'DOCTRACK_API_BATCH_LIMIT', 50)
+        if len(requests) > limit:
+            raise ApiError(400, f'At most {limit} requests per batch')
+
+        responses = []
+        with transaction.atomic():
+            for sub in requests:
+                status, payload = _run_sub_request(request.user, sub)
+                responses.append({'status': status, 'body': payload})
+                if status >= 400:
+                    transaction.set_rollback(True)
+                    return 400, {'committed': False, 'responses': responses}
+        return 200, {'committed': True, 'responses': responses}
+
+    return _respond(request, run)
+
+
+def _run_sub_request(user, sub):
+    if not isinstance(sub, dict):
+        return 400, {'error': 'Each request must be an object'}
+    method = str(sub.get('method', 'GET')).upper()
+    parts = urlsplit(str(sub.get('path', '')))
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        match = None
+    if match is None or match.url_name not in ('api_collection', 'api_item'):
+        return 404, {'error': f'Not an API path: {parts.path}'}
+    body = sub.get('body')
+    if body is not None and not isinstance(body, dict):
+        return 400, {'error': 'body must be a JSON object'}
+    try:
+        return dispatch(
+            user, method, match.kwargs['resource'], match.kwargs.get('pk'),
+            query=QueryDict(parts.query), body=body,
+        )
+    except Exception as e:
+        # One bad sub-request fails the batch, not the whole response.
+        error = client_error(e)
+        if error is None:
+            logger.exception('Batch request %s %s failed', method, parts.path)
+            error = ApiError(500, 'Internal error')
+        return error.status, error.payload
@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class DoctrackConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'doctrack'
+    
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+        from .models import UserProfile, Version, Comment, version_deleted, comment_deleted
+        from .utils.usercache import user_saved
+        from .utils.instrumentation import install_query_dispatcher
+        
+        connection_created.connect(install_query_dispatcher)
+        post_delete.connect(version_deleted, sender=Version)
+        post_delete.connect(comment_deleted, sender=Comment)
+        for model in (User, UserProfile):
+            post_save.connect(user_saved, sender=model)
+            post_delete.connect(user_saved, sender=model)
+        # Connections opened before the app registry was ready.
+        for conn in connections.all(initialized_only=True):
+            install_query_dispatcher(sender=None, connection=conn)
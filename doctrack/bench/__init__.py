@@ -0,0 +1 @@
+# Benchmark and synthetic data tooling
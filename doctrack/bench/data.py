@@ -0,0 +1,261 @@
+"""
+Synthetic dataset generator used by the ``seed_bench`` management command.
+"""
+import os
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from ..models import (
+    UserProfile, Team, TeamMembership, Project, Document, Version,
+    PullRequest, Review, WorkItem, Comment, Activity, adjust_storage_usage
+)
+from .synthetic import make_lines, mutate_lines, make_file, make_sentence
+
+USERNAME_PREFIX = 'bench_user_'
+BENCH_PASSWORD = 'bench-password'
+
+SCALES = {
+    'small': {'users': 10, 'teams': 2, 'projects': 4, 'documents': 60, 'versions': 3, 'lines': 120},
+    'medium': {'users': 50, 'teams': 5, 'projects': 20, 'documents': 2000, 'versions': 4, 'lines': 300},
+    'large': {'users': 200, 'teams': 20, 'projects': 100, 'documents': 10000, 'versions': 5, 'lines': 600},
+}
+
+BATCH_SIZE = 500
+
+
+def clear_bench_data():
+    """Delete every user created by a previous seed run (cascades to their data)."""
+    return User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+class Seeder:
+    def __init__(self, users, teams, projects, documents, versions, lines, seed=0, log=None):
+        self.counts = {
+            'users': users, 'teams': teams, 'projects': projects,
+            'documents': documents, 'versions': versions, 'lines': lines,
+        }
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+
+    def run(self):
+        with transaction.atomic():
+            users = self.create_users()
+            teams = self.create_teams(users)
+            projects = self.create_projects(users, teams)
+        documents = self.create_documents(users, projects)
+        with transaction.atomic():
+            prs = self.create_pull_requests(users, documents)
+            work_items = self.create_work_items(users, documents)
+            self.create_comments(users, documents, prs, work_items)
+            self.create_activities(users, documents)
+
+    def create_users(self):
+        password = make_password(BENCH_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'{USERNAME_PREFIX}{i}', email=f'bench{i}@example.com', password=password)
+            for i in range(self.counts['users'])
+        ])
+        roles = [role for role, _ in UserProfile.ROLE_CHOICES]
+        UserProfile.objects.bulk_create([
+            UserProfile(user=user, role='admin' if i == 0 else self.rng.choice(roles))
+            for i, user in enumerate(users)
+        ])
+        self.log(f'Created {len(users)} users')
+        return users
+
+    def create_teams(self, users):
+        teams = Team.objects.bulk_create([
+            Team(name=f'Bench team {i}', created_by=self.rng.choice(users))
+            for i in range(self.counts['teams'])
+        ])
+        memberships = []
+        for team in teams:
+            members = {team.created_by} | set(self.rng.sample(users, min(len(users), 8)))
+            for user in members:
+                role = 'owner' if user == team.created_by else 'member'
+                memberships.append(TeamMembership(user=user, team=team, role=role))
+        TeamMembership.objects.bulk_create(memberships)
+        self.log(f'Created {len(teams)} teams')
+        return teams
+
+    def create_projects(self, users, teams):
+        projects = Project.objects.bulk_create([
+            Project(
+                name=f'Bench project {i}',
+                description=make_sentence(self.rng),
+                team=self.rng.choice(teams) if teams else None,
+                # The first user owns a share of every workload so views have data.
+                owner=users[0] if i % 3 == 0 else self.rng.choice(users),
+                is_public=self.rng.random() < 0.2,
+            )
+            for i in range(self.counts['projects'])
+        ])
+        through = Project.collaborators.through
+        links = []
+        for project in projects:
+            collaborators = set(self.rng.sample(users, min(len(users), 5))) - {project.owner}
+            collaborators.add(users[0])
+            collaborators.discard(project.owner)
+            links.extend(through(project_id=project.id, user_id=user.id) for user in collaborators)
+        through.objects.bulk_create(links)
+        self.log(f'Created {len(projects)} projects')
+        return projects
+
+    def _store_file(self, document, file_type, lines):
+        ext, content = make_file(file_type, lines)
+        path = os.path.join('versions', str(document.project_id), str(document.id), f'{uuid.uuid4().hex}.{ext}')
+        name = default_storage.save(path, ContentFile(content))
+        return name, len(content)
+
+    def create_documents(self, users, projects):
+        created = []
+        total = self.counts['documents']
+        for start in range(0, total, BATCH_SIZE):
+            with transaction.atomic():
+                batch = Document.objects.bulk_create([
+                    Document(
+                        name=f'Bench document {i}',
+                        project=self.rng.choice(projects),
+                        file_type=self.rng.choice(['pdf', 'pdf', 'word']),
+                        status=self.rng.choice([s for s, _ in Document.STATUS_CHOICES]),
+                        description=make_sentence(self.rng),
+                        created_by=self.rng.choice(users),
+                    )
+                    for i in range(start, min(start + BATCH_SIZE, total))
+                ])
+                versions = []
+                for document in batch:
+                    lines = make_lines(self.rng, self.counts['lines'])
+                    document.version_counter = self.rng.randint(1, self.counts['versions'])
+                    for number in range(1, document.version_counter + 1):
+                        if number > 1:
+                            lines = mutate_lines(self.rng, lines, 0.05)
+                        name, size = self._store_file(document, document.file_type, lines)
+                        versions.append(Version(
+                            document=document,
+                            version_number=number,
+                            file=name,
+                            file_size=size,
+                            change_summary=make_sentence(self.rng, 3, 8),
+                            uploaded_by=self.rng.choice(users),
+                        ))
+                Version.objects.bulk_create(versions)
+                Document.objects.bulk_update(batch, ['version_counter'])
+                usage = {}
+                for version in versions:
+                    usage[version.document.project_id] = usage.get(version.document.project_id, 0) + version.file_size
+                for project_id, size in usage.items():
+                    adjust_storage_usage(project_id, size)
+            created.extend(batch)
+            self.log(f'Created {len(created)}/{total} documents')
+        return created
+
+    def create_pull_requests(self, users, documents):
+        versions_by_doc = {}
+        versions = Version.objects.filter(
+            document__created_by__username__startswith=USERNAME_PREFIX
+        ).order_by('version_number')
+        for version in versions:
+            versions_by_doc.setdefault(version.document_id, []).append(version)
+        prs = []
+        for document in documents:
+            versions = versions_by_doc.get(document.id, [])
+            if len(versions) < 2 or self.rng.random() > 0.4:
+                continue
+            prs.append(PullRequest(
+                title=f'Update {document.name}',
+                description=make_sentence(self.rng),
+                project_id=document.project_id,
+                document=document,
+                source_version=versions[-1],
+                target_version=versions[-2],
+                status=self.rng.choice(['open', 'open', 'approved', 'merged', 'rejected']),
+                created_by=self.rng.choice(users),
+            ))
+        prs = PullRequest.objects.bulk_create(prs, batch_size=BATCH_SIZE)
+        through = PullRequest.reviewers.through
+        through.objects.bulk_create([
+            through(pullrequest_id=pr.id, user_id=user.id)
+            for pr in prs for user in set(self.rng.sample(users, min(len(users), 2)))
+        ], batch_size=BATCH_SIZE)
+        Review.objects.bulk_create([
+            Review(
+                pull_request=pr,
+                reviewer=self.rng.choice(users),
+                status=self.rng.choice([s for s, _ in Review.STATUS_CHOICES]),
+                comment=make_sentence(self.rng),
+            )
+            for pr in prs for _ in range(self.rng.randint(0, 3))
+        ], batch_size=BATCH_SIZE)
+        self.log(f'Created {len(prs)} pull requests')
+        return prs
+
+    def create_work_items(self, users, documents):
+        items = WorkItem.objects.bulk_create([
+            WorkItem(
+                title=make_sentence(self.rng, 3, 6),
+                description=make_sentence(self.rng),
+                item_type=self.rng.choice([t for t, _ in WorkItem.TYPE_CHOICES]),
+                priority=self.rng.choice([p for p, _ in WorkItem.PRIORITY_CHOICES]),
+                status=self.rng.choice([s for s, _ in WorkItem.STATUS_CHOICES]),
+                project_id=document.project_id,
+                document=document,
+                assigned_to=self.rng.choice(users),
+                created_by=self.rng.choice(users),
+            )
+            for document in self.rng.sample(documents, len(documents) // 4)
+        ], batch_size=BATCH_SIZE)
+        self.log(f'Created {len(items)} work items')
+        return items
+
+    def create_comments(self, users, documents, prs, work_items):
+        targets = (
+            [('document', d) for d in documents]
+            + [('pull_request', pr) for pr in prs]
+            + [('work_item', item) for item in work_items]
+        )
+        top_level = Comment.objects.bulk_create([
+            Comment(content=make_sentence(self.rng), author=self.rng.choice(users), **{field: target})
+            for field, target in targets for _ in range(self.rng.randint(0, 4))
+        ], batch_size=BATCH_SIZE)
+        replies = Comment.objects.bulk_create([
+            Comment(
+                content=make_sentence(self.rng),
+                author=self.rng.choice(users),
+                document_id=parent.document_id,
+                pull_request_id=parent.pull_request_id,
+                work_item_id=parent.work_item_id,
+                parent=parent,
+                root=parent,
+            )
+            for parent in top_level for _ in range(self.rng.randint(0, 2))
+        ], batch_size=BATCH_SIZE)
+        # bulk_create skips Comment.save(), which maintains reply_count.
+        counts = {}
+        for reply in replies:
+            counts[reply.root_id] = counts.get(reply.root_id, 0) + 1
+        for comment in top_level:
+            comment.reply_count = counts.get(comment.pk, 0)
+        Comment.objects.bulk_update(top_level, ['reply_count'], batch_size=BATCH_SIZE)
+        self.log(f'Created {len(top_level) + len(replies)} comments')
+
+    def create_activities(self, users, documents):
+        actions = [a for a, _ in Activity.ACTION_CHOICES]
+        activities = Activity.objects.bulk_create([
+            Activity(
+                user=self.rng.choice(users),
+                action=self.rng.choice(actions),
+                target_type='Document',
+                target_id=document.id,
+                target_name=document.name,
+                project_id=document.project_id,
+            )
+            for document in documents for _ in range(self.rng.randint(1, 4))
+        ], batch_size=BATCH_SIZE)
+        self.log(f'Created {len(activities)} activities')
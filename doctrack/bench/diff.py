@@ -0,0 +1,223 @@
+"""
+Micro-benchmark and correctness harness for ``doctrack.utils.comparison``.
+
+Cases are generated text pairs with controlled edit rates and sizes plus
+pathological inputs. Every diff function is timed, its peak memory measured
+with ``tracemalloc``, and its output checked against invariants and (when a
+golden file or candidate engine is supplied) against reference results, so a
+faster replacement engine can be validated against today's behavior.
+"""
+import hashlib
+import importlib
+import json
+import multiprocessing
+import random
+import statistics
+import time
+import tracemalloc
+
+from ..utils import comparison as reference_engine
+from ..utils.instrumentation import percentile
+from .synthetic import make_lines, mutate_lines, make_sentence
+
+FUNCTIONS = ('text_diff', 'side_by_side_diff', 'html_diff', 'unified_diff', 'get_diff_stats')
+DEFAULT_SIZES = (10, 100, 1000)
+ALL_SIZES = (10, 100, 1000, 10000, 50000, 200000)
+EDIT_RATES = (0.0, 0.01, 0.1, 0.5)
+
+
+def generate_cases(sizes=DEFAULT_SIZES, edit_rates=EDIT_RATES, seed=0):
+    """Return a list of (name, text1, text2) pairs."""
+    rng = random.Random(seed)
+    cases = []
+    for size in sizes:
+        base = make_lines(rng, size)
+        for rate in edit_rates:
+            cases.append((f'edit{rate:g}_{size}', '\n'.join(base), '\n'.join(mutate_lines(rng, base, rate))))
+
+        repeated = ['The same line repeated.'] * size
+        repeated_edit = list(repeated)
+        for i in range(0, size, max(1, size // 10)):
+            repeated_edit[i] = 'A different line.'
+        cases.append((f'repeated_{size}', '\n'.join(repeated), '\n'.join(repeated_edit)))
+
+        alternating = ['alpha', 'beta'] * (size // 2)
+        cases.append((f'alternating_{size}', '\n'.join(alternating), '\n'.join(alternating[1:] + ['gamma'])))
+
+        whitespace = [line + ('  ' if i % 3 == 0 else '') for i, line in enumerate(base)]
+        cases.append((f'whitespace_{size}', '\n'.join(base), '\n'.join(whitespace)))
+
+        unrelated = [make_sentence(rng) for _ in range(size)]
+        cases.append((f'unrelated_{size}', '\n'.join(base), '\n'.join(unrelated)))
+
+    cases.append(('empty_both', '', ''))
+    cases.append(('empty_left', '', 'one\ntwo\nthree'))
+    cases.append(('empty_right', 'one\ntwo\nthree', ''))
+    cases.append(('no_trailing_newline', 'a\nb\nc', 'a\nb\nc\n'))
+    return cases
+
+
+def _call(engine, name, text1, text2):
+    """Run one diff function, turning an exception into an ``{'error': ...}`` result."""
+    try:
+        return getattr(engine, name)(text1, text2)
+    except Exception as e:
+        return {'error': type(e).__name__}
+
+
+def _is_error(output):
+    return isinstance(output, dict) and set(output) == {'error'}
+
+
+def measure(func, repeat=3):
+    """Time ``func`` ``repeat`` times, then run it once under tracemalloc for peak memory."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = {
+        'median_ms': round(statistics.median(timings), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'min_ms': round(min(timings), 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+    return stats, result
+
+
+def _measure_worker(conn, engine_path, name, text1, text2, repeat):
+    engine = importlib.import_module(engine_path)
+    conn.send(measure(lambda: _call(engine, name, text1, text2), repeat))
+    conn.close()
+
+
+def measure_isolated(engine, name, text1, text2, repeat=3, timeout=None):
+    """
+    Like ``measure`` but runs in a forked child that is killed after ``timeout``
+    seconds, so pathological inputs cannot stall the whole harness.
+    """
+    if not timeout:
+        return measure(lambda: _call(engine, name, text1, text2), repeat)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(
+        target=_measure_worker, args=(sender, engine.__name__, name, text1, text2, repeat)
+    )
+    process.start()
+    sender.close()
+    try:
+        if receiver.poll(timeout):
+            return receiver.recv()
+    except EOFError:
+        return {'error': 'Crashed'}, {'error': 'Crashed'}
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    return {'error': 'Timeout', 'timeout_s': timeout}, {'error': 'Timeout'}
+
+
+def fingerprint(output):
+    """Stable digest of a diff function's output."""
+    encoded = json.dumps(output, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def check_invariants(text1, text2, outputs):
+    """Return a list of invariant violations across the diff function outputs."""
+    problems = []
+    outputs = {name: output for name, output in outputs.items() if not _is_error(output)}
+    lines1 = text1.splitlines() if text1 else []
+    lines2 = text2.splitlines() if text2 else []
+
+    if 'text_diff' in outputs:
+        rows = outputs['text_diff']
+        left = ''.join(r['content'] for r in rows if r['type'] != 'added')
+        right = ''.join(r['content'] for r in rows if r['type'] != 'removed')
+        if left != text1 or right != text2:
+            problems.append('text_diff does not reconstruct both inputs')
+
+    if 'side_by_side_diff' in outputs:
+        rows = outputs['side_by_side_diff']
+        left = [r['left']['content'] for r in rows if r['left']]
+        right = [r['right']['content'] for r in rows if r['right']]
+        if left != lines1 or right != lines2:
+            problems.append('side_by_side_diff does not reconstruct both inputs')
+        if 'get_diff_stats' in outputs:
+            stats = outputs['get_diff_stats']
+            inserts = sum(1 for r in rows if r['type'] == 'insert')
+            deletes = sum(1 for r in rows if r['type'] == 'delete')
+            changes = sum(1 for r in rows if r['type'] == 'change')
+            if (inserts, deletes, changes) != (stats['lines_added'], stats['lines_removed'], stats['lines_changed']):
+                problems.append('get_diff_stats disagrees with side_by_side_diff row counts')
+
+    if 'get_diff_stats' in outputs:
+        stats = outputs['get_diff_stats']
+        if (stats['total_lines_v1'], stats['total_lines_v2']) != (len(lines1), len(lines2)):
+            problems.append('get_diff_stats reports wrong line totals')
+        if text1 == text2 and stats['similarity_percent'] != 100.0 and lines1:
+            problems.append('identical inputs are not 100% similar')
+
+    if 'unified_diff' in outputs:
+        if (text1 == text2) != (outputs['unified_diff'] == ''):
+            problems.append('unified_diff emptiness does not match input equality')
+    return problems
+
+
+def load_engine(path):
+    """Import a candidate engine module by dotted path."""
+    module = importlib.import_module(path)
+    missing = [name for name in FUNCTIONS if not hasattr(module, name)]
+    if missing:
+        raise ImportError(f'{path} is missing {", ".join(missing)}')
+    return module
+
+
+def run(cases, functions=FUNCTIONS, repeat=3, engine=None, golden=None, timeout=None, log=None):
+    """
+    Benchmark ``functions`` over ``cases``.
+
+    ``engine`` is the module under test (defaults to the reference engine); when
+    it differs from the reference, outputs are compared to the reference's.
+    ``golden`` is a {case: {function: digest}} mapping from a previous run.
+    Functions that raise, or exceed ``timeout`` seconds, are reported under
+    ``errors`` rather than failing the run.
+    """
+    engine = engine or reference_engine
+    log = log or (lambda message: None)
+    results, digests, failures, errors = {}, {}, [], []
+
+    for case_name, text1, text2 in cases:
+        outputs = {}
+        digests[case_name] = {}
+        for name in functions:
+            stats, output = measure_isolated(engine, name, text1, text2, repeat, timeout)
+            results[f'{name}.{case_name}'] = stats
+            outputs[name] = output
+            digest = digests[case_name][name] = fingerprint(output)
+            if _is_error(output):
+                stats['error'] = output['error']
+                errors.append(f'{name}.{case_name}: {output["error"]}')
+
+            if engine is not reference_engine:
+                _, expected = measure_isolated(reference_engine, name, text1, text2, 1, timeout)
+                # A candidate may fix inputs the reference engine cannot handle.
+                if not _is_error(expected) and output != expected:
+                    failures.append(f'{name}.{case_name}: output differs from reference engine')
+            if golden and golden.get(case_name, {}).get(name) not in (None, digest):
+                failures.append(f'{name}.{case_name}: output differs from golden digest')
+            if 'median_ms' in stats:
+                log(f'{name}.{case_name}: {stats["median_ms"]} ms, {stats["peak_kb"]} KiB peak')
+
+        failures.extend(f'{case_name}: {problem}' for problem in check_invariants(text1, text2, outputs))
+
+    return {'results': results, 'digests': digests, 'failures': failures, 'errors': errors}
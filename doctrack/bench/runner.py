@@ -0,0 +1,278 @@
+"""
+Benchmark runner: times views and utility functions and compares the results
+against a stored JSON baseline.
+"""
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Project, Document, PullRequest
+from ..utils import comparison, file_handlers
+from ..utils.instrumentation import QueryRecorder, percentile, record_queries
+from ..utils.scheduler import result_cache, scheduler
+from .data import USERNAME_PREFIX
+from .synthetic import make_lines, mutate_lines, make_file
+
+
+def time_callable(func, iterations=5, warmup=1, before=None):
+    """
+    Run ``func`` repeatedly and return timing and query-count statistics.
+    ``before``, if given, runs untimed ahead of every call.
+    """
+    for _ in range(warmup):
+        if before:
+            before()
+        func()
+    timings = []
+    recorder = QueryRecorder()
+    with record_queries(recorder):
+        for _ in range(iterations):
+            if before:
+                before()
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'iterations': iterations,
+        'median_ms': round(statistics.median(timings), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': recorder.count // iterations,
+    }
+
+
+class ViewTargets:
+    """Objects from the seeded dataset that the view benchmarks request."""
+
+    def __init__(self):
+        self.user = User.objects.filter(username=f'{USERNAME_PREFIX}0').first()
+        if self.user is None:
+            raise LookupError('No benchmark data found; run "manage.py seed_bench" first.')
+        visible = Q(owner=self.user) | Q(collaborators=self.user)
+        self.project = (
+            Project.objects.filter(visible).distinct()
+            .annotate(doc_count=Count('documents')).order_by('-doc_count').first()
+        )
+        self.document = (
+            Document.objects.filter(project__owner=self.user)
+            .annotate(version_count=Count('versions')).filter(version_count__gte=2)
+            .order_by('-version_count').first()
+        )
+        self.pull_request = (
+            PullRequest.objects.filter(project__owner=self.user, target_version__isnull=False)
+            .order_by('pk').first()
+        )
+
+    def requests(self):
+        """
+        Return (name, url, comparison key) triples for every view that can be
+        benchmarked. The key is set for views that compare two versions.
+        """
+        pairs = [
+            ('dashboard', reverse('dashboard'), None),
+            ('project_list', reverse('project_list'), None),
+            ('search', reverse('search') + '?q=agreement', None),
+        ]
+        if self.project:
+            pairs.append(('project_detail', reverse('project_detail', args=[self.project.pk]), None))
+        if self.document:
+            versions = list(self.document.versions.order_by('version_number')[:2])
+            pairs.append(('document_detail', reverse('document_detail', args=[self.document.pk]), None))
+            pairs.append((
+                'document_compare',
+                reverse('document_compare', args=[self.document.pk])
+                + f'?v1={versions[0].pk}&v2={versions[1].pk}',
+                (versions[0].pk, versions[1].pk),
+            ))
+        if self.pull_request:
+            pairs.append((
+                'pull_request_detail',
+                reverse('pull_request_detail', args=[self.pull_request.pk]),
+                (self.pull_request.target_version_id, self.pull_request.source_version_id),
+            ))
+        return pairs
+
+
+def run_view_benchmarks(iterations, only=None):
+    targets = ViewTargets()
+    client = Client()
+    client.force_login(targets.user)
+    results = {}
+    for name, url, comparison_key in targets.requests():
+        if only and only not in name:
+            continue
+
+        def fetch(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} returned {response.status_code}')
+
+        if comparison_key is None:
+            results[f'view.{name}'] = time_callable(fetch, iterations)
+            continue
+
+        # Comparison views are timed with the result cache emptied before each
+        # request, so they measure the diff itself, and separately once cached.
+        def forget(key=scheduler.cache_key(comparison_key)):
+            result_cache().delete(key)
+
+        results[f'view.{name}'] = time_callable(fetch, iterations, before=forget)
+        results[f'view.{name}.cached'] = time_callable(fetch, iterations)
+    return results
+
+
+def _write_pair(directory, file_type, lines1, lines2):
+    paths = []
+    for index, lines in enumerate((lines1, lines2)):
+        ext, content = make_file(file_type, lines)
+        path = os.path.join(directory, f'{file_type}_{index}.{ext}')
+        with open(path, 'wb') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+def run_function_benchmarks(iterations, only=None, lines=1000, seed=0):
+    rng = random.Random(seed)
+    lines1 = make_lines(rng, lines)
+    lines2 = mutate_lines(rng, lines1, 0.05)
+    text1, text2 = '\n'.join(lines1), '\n'.join(lines2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pdf1, pdf2 = _write_pair(directory, 'pdf', lines1, lines2)
+        docx1, _ = _write_pair(directory, 'word', lines1, lines2)
+        cases = {
+            'comparison.text_diff': lambda: comparison.text_diff(text1, text2),
+            'comparison.side_by_side_diff': lambda: comparison.side_by_side_diff(text1, text2),
+            'comparison.html_diff': lambda: comparison.html_diff(text1, text2),
+            'comparison.unified_diff': lambda: comparison.unified_diff(text1, text2),
+            'comparison.get_diff_stats': lambda: comparison.get_diff_stats(text1, text2),
+            'comparison.compare_documents': lambda: comparison.compare_documents(pdf1, pdf2, 'pdf'),
+            'file_handlers.extract_pdf_text': lambda: file_handlers.extract_pdf_text(pdf1),
+            'file_handlers.extract_docx_text': lambda: file_handlers.extract_docx_text(docx1),
+            'file_handlers.get_pdf_page_count': lambda: file_handlers.get_pdf_page_count(pdf1),
+            'file_handlers.get_docx_page_count': lambda: file_handlers.get_docx_page_count(docx1),
+            'file_handlers.get_file_info': lambda: file_handlers.get_file_info(pdf1, 'pdf'),
+        }
+        results = {}
+        for name, func in cases.items():
+            if only and only not in name:
+                continue
+            results[f'func.{name}'] = time_callable(func, iterations)
+    return results
+
+
+# Libraries that only format handlers should import, on first use.
+HEAVY_MODULES = ('PIL', 'PyPDF2', 'docx', 'numpy')
+
+STARTUP_SCRIPT = (
+    'import django; django.setup(); '
+    'from importlib import import_module; import_module({urlconf!r})'
+)
+
+
+def parse_importtime(output):
+    """Parse ``python -X importtime`` output into ``{module: (self_us, cumulative_us)}``."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_cold_start():
+    """Import Django and the URLconf (and so every view) in a fresh interpreter."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+        'DJANGO_SETTINGS_MODULE', 'doctrack_project.settings'))
+    script = STARTUP_SCRIPT.format(urlconf=settings.ROOT_URLCONF)
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    return wall_ms, parse_importtime(completed.stderr)
+
+
+def run_startup_benchmark(iterations, target_ms=None):
+    """
+    Cold-start cost of a worker boot: wall time of a fresh interpreter that
+    sets up Django and imports the URLconf, plus the ``-X importtime`` totals.
+    """
+    timings = []
+    import_totals = []
+    modules = {}
+    for _ in range(iterations):
+        wall_ms, modules = measure_cold_start()
+        timings.append(wall_ms)
+        import_totals.append(sum(self_us for self_us, _ in modules.values()) / 1000)
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:15]
+    result = {
+        'iterations': iterations,
+        'median_ms': round(statistics.median(timings), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'import_ms': round(statistics.median(import_totals), 3),
+        'modules': len(modules),
+        'heavy_modules': sorted(name for name in modules if name in HEAVY_MODULES),
+        'slowest_imports': [
+            {'module': name, 'self_ms': round(self_us / 1000, 3), 'cumulative_ms': round(cum_us / 1000, 3)}
+            for name, (self_us, cum_us) in slowest
+        ],
+    }
+    if target_ms:
+        result['target_ms'] = target_ms
+        result['within_target'] = result['median_ms'] <= target_ms
+    return {'startup.cold_import': result}
+
+
+def environment():
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+    }
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Return regressions where the median is slower than the baseline median by
+    more than ``threshold`` (a fraction, e.g. 0.2 for 20%) or issues more queries.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        more_queries = current.get('queries', 0) > previous.get('queries', 0)
+        if ratio > 1 + threshold or more_queries:
+            regressions.append({
+                'name': name,
+                'baseline_ms': previous['median_ms'],
+                'current_ms': current['median_ms'],
+                'ratio': round(ratio, 3),
+                'baseline_queries': previous.get('queries', 0),
+                'current_queries': current.get('queries', 0),
+            })
+    return regressions
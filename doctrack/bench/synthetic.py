@@ -0,0 +1,143 @@
+"""
+Synthetic document content for benchmarks: text, minimal PDFs and DOCX files.
+"""
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+WORDS = (
+    'agreement amendment annex approval article assessment audit budget clause '
+    'compliance contract contractor credit customer data deadline delivery department '
+    'deposit description document employee equipment estimate evaluation exhibit '
+    'facility fee finance guarantee handover hardware implementation incident invoice '
+    'liability license maintenance manager material milestone notice obligation '
+    'operation order owner party payment penalty performance period personnel plan '
+    'policy premises price procedure process procurement project property proposal '
+    'provider quality quotation record renewal report requirement resource review '
+    'risk schedule scope section security service signature software specification '
+    'staff standard statement subcontractor supplier support system tax term test '
+    'the of and to in for with shall be by on under this that any all each such '
+    'within between upon from as may will must not are is its their other'
+).split()
+
+
+def make_sentence(rng, min_words=6, max_words=18):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_lines(rng, count):
+    """Generate ``count`` lines of document-like text."""
+    lines = []
+    section = 1
+    for i in range(count):
+        if i % 25 == 0:
+            lines.append(f'Section {section}. {make_sentence(rng, 2, 5)}')
+            section += 1
+        else:
+            lines.append(make_sentence(rng))
+    return lines
+
+
+def mutate_lines(rng, lines, edit_rate):
+    """Return a copy of ``lines`` with roughly ``edit_rate`` of them edited."""
+    result = []
+    for line in lines:
+        if rng.random() >= edit_rate:
+            result.append(line)
+            continue
+        action = rng.random()
+        if action < 0.5:
+            result.append(make_sentence(rng))
+        elif action < 0.75:
+            result.append(line)
+            result.append(make_sentence(rng))
+        # Otherwise the line is deleted.
+    return result
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(lines, lines_per_page=50):
+    """Build a minimal text PDF (Helvetica, one line per text row)."""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_ids = []
+    for page_lines in pages:
+        rows = ''.join(f'({_pdf_escape(line[:110])}) Tj T* ' for line in page_lines)
+        stream = f'BT /F1 9 Tf 14 TL 40 760 Td {rows}ET'.encode('latin-1', 'replace')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_id
+        )
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{pid} 0 R' for pid in page_ids).encode()
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids))
+
+    out = BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" Type='
+    '"http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+
+def make_docx(lines):
+    """Build a minimal DOCX with one paragraph per line; "Section" lines are headings."""
+    paragraphs = []
+    for line in lines:
+        style = '<w:pPr><w:pStyle w:val="Heading2"/></w:pPr>' if line.startswith('Section ') else ''
+        paragraphs.append(f'<w:p>{style}<w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>')
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + ''.join(paragraphs)
+        + '</w:body></w:document>'
+    )
+    out = BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', DOCX_RELS)
+        archive.writestr('word/document.xml', document)
+    return out.getvalue()
+
+
+def make_file(file_type, lines):
+    """Return (extension, bytes) for a synthetic file of the given type."""
+    if file_type == 'pdf':
+        return 'pdf', make_pdf(lines)
+    if file_type == 'word':
+        return 'docx', make_docx(lines)
+    return 'txt', '\n'.join(lines).encode('utf-8')
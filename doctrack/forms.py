@@ -5,6 +5,8 @@ from .models import (
     UserProfile, Team, Project, Document, Version, 
     PullRequest, WorkItem, Comment
 )
+from .utils.handlers import supported_extensions
+from .utils.quotas import quota_error
 
 
 class UserRegistrationForm(UserCreationForm):
@@ -74,17 +76,25 @@ class DocumentForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 2}),
         }
     
+    def __init__(self, *args, project=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.project = project
+    
     def clean_file(self):
         file = self.cleaned_data.get('file')
         if file:
             ext = file.name.split('.')[-1].lower()
-            allowed_extensions = ['pdf', 'doc', 'docx', 'png', 'jpg', 'jpeg', 'gif', 'bmp']
+            allowed_extensions = supported_extensions()
             if ext not in allowed_extensions:
                 raise forms.ValidationError(
                     f'File type .{ext} is not supported. Allowed types: {", ".join(allowed_extensions)}'
                 )
             if file.size > 52428800:
                 raise forms.ValidationError('File size must be less than 50MB.')
+            if self.project:
+                error = quota_error(self.project, file.size)
+                if error:
+                    raise forms.ValidationError(error)
         return file
 
 
@@ -96,17 +106,25 @@ class VersionUploadForm(forms.Form):
         help_text='Describe what changed in this version'
     )
     
+    def __init__(self, *args, project=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.project = project
+    
     def clean_file(self):
         file = self.cleaned_data.get('file')
         if file:
             ext = file.name.split('.')[-1].lower()
-            allowed_extensions = ['pdf', 'doc', 'docx', 'png', 'jpg', 'jpeg', 'gif', 'bmp']
+            allowed_extensions = supported_extensions()
             if ext not in allowed_extensions:
                 raise forms.ValidationError(
                     f'File type .{ext} is not supported. Allowed types: {", ".join(allowed_extensions)}'
                 )
             if file.size > 52428800:
                 raise forms.ValidationError('File size must be less than 50MB.')
+            if self.project:
+                error = quota_error(self.project, file.size)
+                if error:
+                    raise forms.ValidationError(error)
         return file
 
 
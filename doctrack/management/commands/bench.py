@@ -0,0 +1,70 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from doctrack.bench.runner import (
+    run_view_benchmarks, run_function_benchmarks, run_startup_benchmark,
+    environment, compare_to_baseline
+)
+
+
+class Command(BaseCommand):
+    help = 'Time the key views and comparison/file handling functions and report JSON results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--only', help='Only run benchmarks whose name contains this string.')
+        parser.add_argument('--skip-views', action='store_true', help='Skip view benchmarks (no seeded data needed).')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--baseline', help='Compare against a JSON results file from a previous run.')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to the --baseline path.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown over the baseline median before failing (default 0.2 = 20%%).')
+        parser.add_argument('--cold-start-target', type=float,
+                            default=getattr(settings, 'DOCTRACK_COLD_START_TARGET_MS', None),
+                            help='Fail if the median cold-start import time exceeds this many milliseconds.')
+
+    def handle(self, *args, **options):
+        results = {}
+        if not options['skip_views']:
+            try:
+                results.update(run_view_benchmarks(options['iterations'], options['only']))
+            except LookupError as e:
+                raise CommandError(str(e))
+        results.update(run_function_benchmarks(options['iterations'], options['only']))
+        if not options['only'] or options['only'] in 'startup.cold_import':
+            results.update(run_startup_benchmark(options['iterations'], options['cold_start_target']))
+
+        report = {'environment': environment(), 'results': results}
+
+        baseline_path = options['baseline']
+        if baseline_path and not options['save_baseline']:
+            try:
+                with open(baseline_path, encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except FileNotFoundError:
+                raise CommandError(f'Baseline file {baseline_path} does not exist.')
+            report['regressions'] = compare_to_baseline(results, baseline, options['threshold'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if baseline_path and options['save_baseline']:
+            with open(baseline_path, 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stderr.write(f'Baseline saved to {baseline_path}')
+
+        if report.get('regressions'):
+            names = ', '.join(r['name'] for r in report['regressions'])
+            raise CommandError(f'Performance regressions against baseline: {names}')
+
+        startup = results.get('startup.cold_import')
+        if startup and startup.get('within_target') is False:
+            raise CommandError(
+                f'Cold start took {startup["median_ms"]} ms, over the {startup["target_ms"]} ms target.'
+            )
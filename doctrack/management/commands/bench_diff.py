@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from doctrack.bench import diff
+from doctrack.bench.runner import environment, compare_to_baseline
+
+
+class Command(BaseCommand):
+    help = 'Benchmark and cross-check the diff functions in doctrack.utils.comparison.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(diff.DEFAULT_SIZES),
+                            help=f'Line counts to generate (all available: {" ".join(map(str, diff.ALL_SIZES))}).')
+        parser.add_argument('--edit-rates', type=float, nargs='+', default=list(diff.EDIT_RATES))
+        parser.add_argument('--functions', nargs='+', choices=diff.FUNCTIONS, default=list(diff.FUNCTIONS))
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--timeout', type=float, default=60,
+                            help='Seconds allowed per function and case before it is recorded as a timeout (0 disables).')
+        parser.add_argument('--engine', help='Dotted path of a candidate module to validate against the reference engine.')
+        parser.add_argument('--record-golden', help='Write output digests for every case to this file.')
+        parser.add_argument('--verify-golden', help='Fail if outputs differ from the digests in this file.')
+        parser.add_argument('--baseline', help='Compare timings against a previous JSON report.')
+        parser.add_argument('--threshold', type=float, default=0.2)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        engine = None
+        if options['engine']:
+            try:
+                engine = diff.load_engine(options['engine'])
+            except ImportError as e:
+                raise CommandError(str(e))
+
+        golden = None
+        if options['verify_golden']:
+            with open(options['verify_golden'], encoding='utf-8') as f:
+                golden = json.load(f)
+
+        cases = diff.generate_cases(options['sizes'], options['edit_rates'], options['seed'])
+        outcome = diff.run(
+            cases, options['functions'], options['repeat'],
+            engine=engine, golden=golden, timeout=options['timeout'], log=self.stderr.write
+        )
+
+        if options['record_golden']:
+            with open(options['record_golden'], 'w', encoding='utf-8') as f:
+                json.dump(outcome['digests'], f, indent=2, sort_keys=True)
+
+        report = {
+            'environment': environment(),
+            'engine': options['engine'] or 'doctrack.utils.comparison',
+            'results': outcome['results'],
+            'failures': outcome['failures'],
+            'errors': outcome['errors'],
+        }
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                report['regressions'] = compare_to_baseline(outcome['results'], json.load(f), options['threshold'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if outcome['failures']:
+            raise CommandError(f'{len(outcome["failures"])} correctness check(s) failed')
+        if report.get('regressions'):
+            raise CommandError(f'{len(report["regressions"])} timing regression(s) against baseline')
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from doctrack.models import Project
+from doctrack.utils.export import export_project
+from doctrack.utils.file_handlers import format_file_size
+
+
+class Command(BaseCommand):
+    help = 'Write a zip archive of a project: every version, a JSONL manifest and optionally extracted text.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project', help='Project id or exact name.')
+        parser.add_argument('--output', '-o',
+                            help='Archive path, or - for stdout (default: <project>-export.zip).')
+        parser.add_argument('--text', action='store_true', help='Include the extracted text of each version.')
+
+    def handle(self, *args, **options):
+        value = options['project']
+        project = (Project.objects.filter(pk=value).first() if value.isdigit() else None) \
+            or Project.objects.filter(name=value).first()
+        if project is None:
+            raise CommandError(f'No project with id or name {value}')
+
+        output = options['output'] or f'{slugify(project.name) or "project"}-export.zip'
+        written = 0
+        out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        try:
+            for chunk in export_project(project, include_text=options['text']):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        self.stderr.write(f'Wrote {format_file_size(written)} to {output}')
@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+
+from doctrack.models import Version, VersionSignature, SignatureBand
+from doctrack.utils.file_handlers import format_file_size
+from doctrack.utils.similarity import index_versions, estimate_similarity, default_threshold
+
+
+class Command(BaseCommand):
+    help = 'Index document text with MinHash signatures and report groups of near-duplicate documents.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append',
+                            help='Only consider documents in this project (repeatable).')
+        parser.add_argument('--all-versions', action='store_true',
+                            help='Consider every version, not just the latest of each document.')
+        parser.add_argument('--reindex', action='store_true',
+                            help='Recompute signatures that already exist, e.g. after changing the settings.')
+        parser.add_argument('--threshold', type=float,
+                            help='Minimum estimated similarity, 0-1 (default DOCTRACK_SIMILARITY_THRESHOLD).')
+
+    def handle(self, *args, **options):
+        versions = Version.objects.select_related('document__project')
+        if options['project']:
+            versions = versions.filter(document__project__in=options['project'])
+        if not options['all_versions']:
+            latest = Version.objects.filter(document=OuterRef('document')).order_by('-version_number')
+            versions = versions.filter(pk=Subquery(latest.values('pk')[:1]))
+
+        to_index = versions if options['reindex'] else versions.filter(signature__isnull=True)
+        indexed = skipped = 0
+        for version, stored in index_versions(list(to_index)):
+            indexed += stored
+            skipped += not stored
+        self.stderr.write(f'Indexed {indexed} versions ({skipped} without enough text)')
+
+        threshold = options['threshold'] if options['threshold'] is not None else default_threshold()
+        groups = self.find_groups(versions, threshold)
+        if not groups:
+            self.stdout.write('No near-duplicate documents found.')
+            return
+
+        wasted = 0
+        for members in groups:
+            members.sort(key=lambda item: (-item[0], item[1].pk))
+            self.stdout.write('')
+            for score, version in members:
+                document = version.document
+                self.stdout.write(
+                    f'  {score * 100:5.1f}%  {document.name} v{version.version_number} '
+                    f'[{document.project.name}] {format_file_size(version.file_size)}'
+                )
+            # Everything but one copy per group is redundant.
+            wasted += sum(version.file_size for _, version in members[1:])
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(groups)} groups of near-duplicates; {format_file_size(wasted)} in redundant copies.'
+        ))
+
+    def find_groups(self, versions, threshold):
+        """
+        Groups of versions of different documents linked by an estimated
+        similarity of at least ``threshold``. Only signatures that share an LSH
+        bucket are ever compared.
+        """
+        signatures = VersionSignature.objects.filter(version__in=versions.values('pk'))
+        shared = (
+            SignatureBand.objects.filter(signature__in=signatures)
+            .values('bucket').annotate(n=Count('id')).filter(n__gt=1).values('bucket')
+        )
+        buckets = defaultdict(list)
+        for bucket, signature_id in SignatureBand.objects.filter(
+            signature__in=signatures, bucket__in=shared
+        ).values_list('bucket', 'signature_id'):
+            buckets[bucket].append(signature_id)
+
+        candidate_ids = {sid for members in buckets.values() for sid in members}
+        stored = {
+            s.pk: s for s in VersionSignature.objects.filter(pk__in=candidate_ids)
+            .select_related('version__document__project')
+        }
+
+        # Union-find over signatures joined by a confirmed similar pair.
+        parent = {}
+
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        best = defaultdict(float)
+        checked = set()
+        for members in buckets.values():
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    pair = (min(first, second), max(first, second))
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    a, b = stored[first], stored[second]
+                    if a.version.document_id == b.version.document_id:
+                        continue
+                    score = estimate_similarity(a.signature, b.signature)
+                    if score >= threshold:
+                        parent[find(first)] = find(second)
+                        best[first] = max(best[first], score)
+                        best[second] = max(best[second], score)
+
+        groups = defaultdict(list)
+        for signature_id in best:
+            groups[find(signature_id)].append((best[signature_id], stored[signature_id].version))
+        return list(groups.values())
@@ -0,0 +1,80 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from doctrack.models import Project
+from doctrack.utils.file_handlers import format_file_size
+from doctrack.utils.importer import DocumentImporter, QuotaExceeded, batch_size
+
+
+class Command(BaseCommand):
+    help = (
+        'Import every supported file in a directory tree or zip archive into a project. '
+        'Files named like "report_v2.pdf" become versions of one document.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('project', help='Project id or exact name.')
+        parser.add_argument('source', help='Directory or zip archive to import.')
+        parser.add_argument('--user', help='Username recorded as uploader (default: the project owner).')
+        parser.add_argument('--batch-size', type=int, default=batch_size(),
+                            help='Documents written per transaction (default DOCTRACK_IMPORT_BATCH_SIZE).')
+        parser.add_argument('--checkpoint',
+                            help='Progress file used to resume an interrupted import '
+                                 '(default: <source>.import-checkpoint next to the source).')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start over.')
+        parser.add_argument('--no-index', action='store_true',
+                            help="Don't compute near-duplicate signatures for the imported versions.")
+        parser.add_argument('--force', action='store_true',
+                            help='Import even if it takes the project or its team over its storage quota.')
+
+    def handle(self, *args, **options):
+        project = self.get_project(options['project'])
+        user = project.owner
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']}")
+
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f'{source} does not exist')
+        checkpoint = options['checkpoint'] or f"{os.path.abspath(source).rstrip(os.sep)}.import-checkpoint"
+        if options['restart'] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        importer = DocumentImporter(
+            project, user, source,
+            batch=options['batch_size'],
+            checkpoint=checkpoint,
+            index=not options['no_index'],
+            log=self.stderr.write,
+            enforce_quota=not options['force'],
+        )
+        try:
+            stats = importer.run()
+        except QuotaExceeded as e:
+            raise CommandError(f'{e} Rerun with --force to import past the quota.')
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if stats['resumed']:
+            self.stdout.write(f"Skipped {stats['resumed']} files imported by an earlier run")
+        if stats['unsupported']:
+            self.stdout.write(f"Skipped {stats['unsupported']} files of unsupported types")
+        if stats['failed']:
+            self.stdout.write(self.style.WARNING(f"{stats['failed']} files could not be read"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['versions']} versions ({format_file_size(stats['bytes'])}) "
+            f"into {stats['documents']} new documents in {project.name}; "
+            f"{stats['duplicates']} duplicate files skipped."
+        ))
+
+    def get_project(self, value):
+        projects = Project.objects.filter(pk=value) if value.isdigit() else Project.objects.none()
+        project = projects.first() or Project.objects.filter(name=value).first()
+        if project is None:
+            raise CommandError(f'No project with id or name {value}')
+        return project
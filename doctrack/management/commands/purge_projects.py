@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from doctrack.utils.purge import batch_size, pending_projects, purge_project
+
+
+class Command(BaseCommand):
+    help = (
+        'Purge projects that were deleted but not yet removed, e.g. because the '
+        'server restarted while purging them in the background.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=batch_size(),
+                            help='Rows deleted per statement (default DOCTRACK_PURGE_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        projects = list(pending_projects().values_list('pk', 'name'))
+        if not projects:
+            self.stdout.write('No deleted projects to purge.')
+            return
+        for pk, name in projects:
+            self.stdout.write(f'Purging {name} (#{pk})')
+            deleted = purge_project(pk, batch=options['batch_size'], log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f'Purged {name}: {sum(deleted.values())} rows'))
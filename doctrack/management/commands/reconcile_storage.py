@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from doctrack.models import Project, Team, Version
+from doctrack.utils.file_handlers import format_file_size
+
+
+class Command(BaseCommand):
+    help = (
+        'Check the per-project and per-team storage counters against the version files on disk. '
+        'With --fix, correct recorded file sizes and recompute the counters.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[],
+                            help='Project id or exact name; repeat for several (default: all projects).')
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'DOCTRACK_RECONCILE_BATCH_SIZE', 1000),
+                            help='Versions read per query (default DOCTRACK_RECONCILE_BATCH_SIZE).')
+        parser.add_argument('--fix', action='store_true',
+                            help='Write the sizes found on disk back and recompute the counters.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['project']:
+            projects = projects.filter(pk__in=[self.get_project(value).pk for value in options['project']])
+        counters = dict(projects.values_list('pk', 'storage_bytes'))
+        if not counters:
+            self.stdout.write('No projects to check.')
+            return
+
+        recorded = dict.fromkeys(counters, 0)
+        on_disk = dict.fromkeys(counters, 0)
+        missing = mismatched = 0
+        for batch in self.version_batches(counters, options['batch_size']):
+            corrections = []
+            for pk, name, file_size, project_id in batch:
+                recorded[project_id] += file_size
+                try:
+                    size = default_storage.size(name) if name else None
+                except OSError:
+                    size = None
+                if size is None:
+                    missing += 1
+                    self.stderr.write(f'Version {pk}: {name or "no file"} is missing')
+                    continue
+                on_disk[project_id] += size
+                if size != file_size:
+                    mismatched += 1
+                    self.stderr.write(f'Version {pk}: {name} is {size} bytes, recorded as {file_size}')
+                    corrections.append(Version(pk=pk, file_size=size))
+            if options['fix'] and corrections:
+                Version.objects.bulk_update(corrections, ['file_size'])
+
+        drifted = [pk for pk in counters if counters[pk] != recorded[pk]]
+        for project in Project.objects.filter(pk__in=counters).order_by('pk').only('name'):
+            pk = project.pk
+            line = (
+                f'{project.name}: counter {format_file_size(counters[pk])}, '
+                f'versions {format_file_size(recorded[pk])}, on disk {format_file_size(on_disk[pk])}'
+            )
+            if pk in drifted or recorded[pk] != on_disk[pk]:
+                self.stdout.write(self.style.WARNING(line))
+            elif options['verbosity'] > 1:
+                self.stdout.write(line)
+
+        if options['fix']:
+            self.recompute(list(counters))
+            self.stdout.write(self.style.SUCCESS(
+                f'Recomputed counters for {len(counters)} projects; corrected {mismatched} file sizes.'
+            ))
+        summary = (
+            f'Checked {len(counters)} projects: {len(drifted)} counters out of date, '
+            f'{mismatched} size mismatches, {missing} missing files.'
+        )
+        self.stdout.write(self.style.SUCCESS(summary) if not (drifted or mismatched or missing) else summary)
+
+    def version_batches(self, project_ids, size):
+        """Yield ``(pk, file, file_size, project_id)`` rows in pk order, ``size`` at a time."""
+        versions = Version.objects.filter(document__project__in=project_ids).order_by('pk')
+        last = 0
+        while True:
+            batch = list(
+                versions.filter(pk__gt=last).values_list('pk', 'file', 'file_size', 'document__project_id')[:size]
+            )
+            if not batch:
+                return
+            yield batch
+            last = batch[-1][0]
+
+    def recompute(self, project_ids):
+        """Reset the counters from the version rows, one UPDATE each so concurrent uploads aren't lost."""
+        project_total = Version.objects.filter(document__project=OuterRef('pk')) \
+            .values('document__project').annotate(total=Sum('file_size')).values('total')
+        team_total = Project.objects.filter(team=OuterRef('pk')) \
+            .values('team').annotate(total=Sum('storage_bytes')).values('total')
+        with transaction.atomic():
+            Project.objects.filter(pk__in=project_ids).update(storage_bytes=Coalesce(Subquery(project_total), 0))
+            Team.objects.filter(projects__in=project_ids).update(storage_bytes=Coalesce(Subquery(team_total), 0))
+
+    def get_project(self, value):
+        projects = Project.objects.filter(pk=value) if value.isdigit() else Project.objects.none()
+        project = projects.first() or Project.objects.filter(name=value).first()
+        if project is None:
+            raise CommandError(f'No project with id or name {value}')
+        return project
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from doctrack.bench.data import SCALES, Seeder, clear_bench_data
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset (users, projects, documents, files, reviews) for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        for name in ('users', 'teams', 'projects', 'documents', 'versions', 'lines'):
+            parser.add_argument(f'--{name}', type=int, help=f'Override the number of {name} for the chosen scale.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help='Delete previously seeded benchmark data first.')
+
+    def handle(self, *args, **options):
+        counts = dict(SCALES[options['scale']])
+        for name in counts:
+            if options.get(name) is not None:
+                counts[name] = options[name]
+
+        if options['flush']:
+            deleted, _ = clear_bench_data()
+            self.stdout.write(f'Deleted {deleted} rows of previous benchmark data')
+
+        seeder = Seeder(seed=options['seed'], log=self.stdout.write, **counts)
+        seeder.run()
+        self.stdout.write(self.style.SUCCESS('Benchmark data created.'))
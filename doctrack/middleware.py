@@ -0,0 +1,244 @@
+import time
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+
+from .utils.instrumentation import (
+    QueryRecorder, record_queries, start_render_timer, stop_render_timer,
+    response_size, server_timing_header, log_request
+)
+from .utils.metrics import registry, REQUEST_LATENCY, DB_QUERY_TIME, DB_QUERIES
+from .utils.profiling import RequestProfile, profiling_requested, allocations_requested
+from .utils.staticfiles import StaticFileIndex
+from .utils.usercache import get_user, aget_user
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, SQL time, render time, duplicate queries and response
+    size for every request, keyed by URL name.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        token = start_render_timer()
+        start = time.perf_counter()
+        try:
+            with record_queries(recorder):
+                response = self.get_response(request)
+        finally:
+            render_time = stop_render_timer(token)
+        return self.finish(request, response, recorder, time.perf_counter() - start, render_time)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = start_render_timer()
+        start = time.perf_counter()
+        try:
+            with record_queries(recorder):
+                response = await self.get_response(request)
+        finally:
+            render_time = stop_render_timer(token)
+        return self.finish(request, response, recorder, time.perf_counter() - start, render_time)
+
+    def finish(self, request, response, recorder, total_time, render_time):
+        match = request.resolver_match
+        record = {
+            'ts': timezone.now().isoformat(),
+            'url_name': match.view_name if match else None,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total_time * 1000, 2),
+            'sql_ms': round(recorder.total_time * 1000, 2),
+            'render_ms': round(render_time * 1000, 2),
+            'queries': recorder.count,
+            'duplicates': recorder.duplicates(),
+            'bytes': response_size(response),
+        }
+        response['Server-Timing'] = server_timing_header(record)
+        log_request(record)
+
+        view = record['url_name'] or '(unresolved)'
+        REQUEST_LATENCY.observe(total_time, view=view)
+        DB_QUERY_TIME.observe(recorder.total_time, view=view)
+        DB_QUERIES.inc(recorder.count, view=view)
+        registry.flush()
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile a single request for staff users who add ``?profile=1`` (or send an
+    ``X-Profile`` header). ``?profile=pstats`` downloads the raw stats instead
+    of the HTML report, and ``profile_alloc=1`` also samples allocations.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = profiling_requested(request, request.user)
+        if mode is None:
+            return self.get_response(request)
+        profile = RequestProfile(trace_allocations=allocations_requested(request))
+        response = profile.run(self.get_response, request)
+        return self.report(request, response, profile, mode)
+
+    async def __acall__(self, request):
+        mode = profiling_requested(request, await request.auser())
+        if mode is None:
+            return await self.get_response(request)
+        profile = RequestProfile(trace_allocations=allocations_requested(request))
+        response = await profile.arun(self.get_response, request)
+        return await sync_to_async(self.report)(request, response, profile, mode)
+
+    def report(self, request, response, profile, mode):
+        match = request.resolver_match
+        view_name = match.view_name if match else 'request'
+        if mode == 'pstats':
+            download = HttpResponse(profile.pstats_bytes(), content_type='application/octet-stream')
+            download['Content-Disposition'] = f'attachment; filename="{view_name}.pstats"'
+            return download
+
+        context = {
+            'view_name': view_name,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(profile.duration * 1000, 1),
+            'sql_ms': round(profile.recorder.total_time * 1000, 1),
+            'query_count': profile.recorder.count,
+            'call_tree': profile.call_tree(),
+            'top_cumulative': profile.top_functions('cumulative'),
+            'top_own': profile.top_functions('own'),
+            'hot_paths': profile.hot_paths(),
+            'offloaded_jobs': profile.offloaded_jobs(),
+            'sql_timeline': profile.sql_timeline(),
+            'allocations': profile.allocation_rows(),
+            'peak_memory': profile.peak_memory,
+        }
+        report = render(request, 'profiling/report.html', context)
+        report['Cache-Control'] = 'no-store'
+        return report
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    ``AuthenticationMiddleware`` that loads ``request.user`` lazily through
+    the user cache, with its profile preloaded so ``request.user.profile``
+    needs no query either.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(_auser, request)
+
+
+async def _auser(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await aget_user(request)
+    return request._acached_user
+
+
+class StaticFilesMiddleware:
+    """
+    Serve collected static files before the rest of the stack runs. Hashed
+    names from the manifest storage are cached for a year as immutable;
+    anything else for ``DOCTRACK_STATIC_MAX_AGE`` seconds. Precompressed
+    ``.br``/``.gz`` variants are sent to clients that accept them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.index = StaticFileIndex()
+        self.max_age = getattr(settings, 'DOCTRACK_STATIC_MAX_AGE', 60)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not self.index.files:
+            return None
+        static_file = self.index.find(request.path_info)
+        if static_file is None:
+            return None
+
+        if static_file.immutable:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = f'public, max-age={self.max_age}'
+        path, size, encoding = static_file.path, static_file.size, None
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        for name, (variant_path, variant_size) in static_file.variants.items():
+            if name in accepted:
+                path, size, encoding = variant_path, variant_size, name
+                break
+        etag = static_file.etags[encoding]
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            # If-None-Match uses the weak comparison: a W/ prefix still matches.
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            not_modified = '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        else:
+            not_modified = request.META.get('HTTP_IF_MODIFIED_SINCE') == static_file.last_modified
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=static_file.content_type)
+            else:
+                response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+                del response['Content-Disposition']
+            response['Content-Length'] = size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = static_file.last_modified
+        response['Cache-Control'] = cache_control
+        if static_file.variants:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.strip().lower())
+    return encodings
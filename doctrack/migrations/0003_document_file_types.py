@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0002_document_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='file_type',
+            field=models.CharField(choices=[('pdf', 'PDF Document'), ('word', 'Word Document'), ('image', 'Image'), ('spreadsheet', 'Spreadsheet'), ('odt', 'OpenDocument Text'), ('text', 'Text'), ('markdown', 'Markdown'), ('csv', 'CSV'), ('json', 'JSON'), ('html', 'HTML'), ('other', 'Other')], default='other', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0003_document_file_types'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
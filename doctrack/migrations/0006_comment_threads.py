@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_threads(apps, schema_editor):
+    Comment = apps.get_model('doctrack', 'Comment')
+    parents = dict(Comment.objects.values_list('pk', 'parent_id'))
+
+    def root_of(pk):
+        while parents[pk] is not None:
+            pk = parents[pk]
+        return pk
+
+    counts = {}
+    for pk, parent_id in parents.items():
+        if parent_id is None:
+            continue
+        root_id = root_of(pk)
+        Comment.objects.filter(pk=pk).update(root_id=root_id)
+        counts[root_id] = counts.get(root_id, 0) + 1
+    for root_id, count in counts.items():
+        Comment.objects.filter(pk=root_id).update(reply_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0005_version_signatures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='doctrack.comment'),
+        ),
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+    ]
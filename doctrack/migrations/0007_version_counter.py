@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:36
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_counters(apps, schema_editor):
+    Document = apps.get_model('doctrack', 'Document')
+    for document in Document.objects.annotate(highest=Max('versions__version_number')).filter(highest__isnull=False):
+        Document.objects.filter(pk=document.pk).update(version_counter=document.highest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0006_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='version_counter',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='version',
+            name='version_number',
+            field=models.PositiveIntegerField(blank=True),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:39
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_usage(apps, schema_editor):
+    Project = apps.get_model('doctrack', 'Project')
+    Team = apps.get_model('doctrack', 'Team')
+    for project in Project.objects.annotate(used=Sum('documents__versions__file_size')).filter(used__isnull=False):
+        Project.objects.filter(pk=project.pk).update(storage_bytes=project.used)
+    for team in Team.objects.annotate(used=Sum('projects__storage_bytes')).filter(used__isnull=False):
+        Team.objects.filter(pk=team.pk).update(storage_bytes=team.used)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0007_version_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='storage_quota',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='storage_quota',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctrack', '0009_project_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='activity',
+            options={'ordering': ['-created_at'], 'permissions': [('export_activity', 'Can export activity as CSV')], 'verbose_name_plural': 'Activities'},
+        ),
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['created_at'], 'permissions': [('export_comment', 'Can export comments as CSV')]},
+        ),
+        migrations.AlterModelOptions(
+            name='document',
+            options={'permissions': [('export_document', 'Can export documents as CSV')]},
+        ),
+        migrations.AlterModelOptions(
+            name='pullrequest',
+            options={'permissions': [('export_pullrequest', 'Can export pull requests as CSV')]},
+        ),
+        migrations.AlterModelOptions(
+            name='review',
+            options={'permissions': [('export_review', 'Can export reviews as CSV')]},
+        ),
+        migrations.AlterModelOptions(
+            name='version',
+            options={'ordering': ['-version_number'], 'permissions': [('export_version', 'Can export versions as CSV')]},
+        ),
+        migrations.AlterModelOptions(
+            name='workitem',
+            options={'permissions': [('export_workitem', 'Can export work items as CSV')]},
+        ),
+    ]
@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import models, transaction, connection, IntegrityError, OperationalError
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.utils import timezone
 import os
+import random
+import time
 import uuid
 
+from .utils.file_handlers import file_digest
+from .utils.metrics import UPLOAD_BYTES
+
 
 class UserProfile(models.Model):
     ROLE_CHOICES = [
@@ -44,10 +50,18 @@ class Team(models.Model):
     description = models.TextField(blank=True)
     members = models.ManyToManyField(User, through='TeamMembership', related_name='teams')
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_teams')
+    # Bytes of every version in the team's projects; see adjust_storage_usage().
+    storage_bytes = models.BigIntegerField(default=0)
+    # Overrides DOCTRACK_TEAM_QUOTA_BYTES when set.
+    storage_quota = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        _exclude_counters(self, kwargs)
+        super().save(*args, **kwargs)
 
 
 class TeamMembership(models.Model):
@@ -66,6 +80,20 @@ class TeamMembership(models.Model):
         unique_together = ['user', 'team']
 
 
+class ProjectManager(models.Manager):
+    """Default manager for projects; hides projects waiting to be purged."""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class ProjectContentManager(models.Manager):
+    """Default manager for rows that belong to a project; hides those of deleted projects."""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(project__deleted_at__isnull=True)
+
+
 class Project(models.Model):
     STATUS_CHOICES = [
         ('active', 'Active'),
@@ -80,12 +108,46 @@ class Project(models.Model):
     collaborators = models.ManyToManyField(User, related_name='collaborated_projects', blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     is_public = models.BooleanField(default=False)
+    # Bytes of every version in the project; see adjust_storage_usage().
+    storage_bytes = models.BigIntegerField(default=0)
+    # Overrides DOCTRACK_PROJECT_QUOTA_BYTES when set.
+    storage_quota = models.BigIntegerField(null=True, blank=True)
+    # Set by mark_deleted(); the rows are removed later by utils.purge.
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProjectManager()
+    all_objects = models.Manager()
+    
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        _exclude_counters(self, kwargs)
+        with transaction.atomic():
+            if not adding:
+                previous_team = Project.all_objects.filter(pk=self.pk).values_list('team_id', flat=True).first()
+            super().save(*args, **kwargs)
+            if not adding and previous_team != self.team_id:
+                # The project's usage moves with it to the new team.
+                used = Project.all_objects.values_list('storage_bytes', flat=True).get(pk=self.pk)
+                Team.objects.filter(pk=previous_team).update(storage_bytes=models.F('storage_bytes') - used)
+                Team.objects.filter(pk=self.team_id).update(storage_bytes=models.F('storage_bytes') + used)
+    
+    def mark_deleted(self):
+        """
+        Hide the project at once and release its storage from the team's
+        quota. Its rows and files stay until ``utils.purge`` removes them.
+        """
+        with transaction.atomic():
+            marked = Project.objects.filter(pk=self.pk).update(deleted_at=timezone.now())
+            if marked:
+                used = Project.all_objects.values_list('storage_bytes', flat=True).get(pk=self.pk)
+                Team.objects.filter(projects=self.pk).update(storage_bytes=models.F('storage_bytes') - used)
+        return bool(marked)
+    
     def get_document_count(self):
         return self.documents.count()
     
@@ -104,6 +166,13 @@ class Document(models.Model):
         ('pdf', 'PDF Document'),
         ('word', 'Word Document'),
         ('image', 'Image'),
+        ('spreadsheet', 'Spreadsheet'),
+        ('odt', 'OpenDocument Text'),
+        ('text', 'Text'),
+        ('markdown', 'Markdown'),
+        ('csv', 'CSV'),
+        ('json', 'JSON'),
+        ('html', 'HTML'),
         ('other', 'Other'),
     ]
     
@@ -120,12 +189,46 @@ class Document(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploaded')
     description = models.TextField(blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_documents')
+    # Last version number handed out; see allocate_version_numbers().
+    version_counter = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProjectContentManager()
+    all_objects = models.Manager()
+    
+    class Meta:
+        permissions = [('export_document', 'Can export documents as CSV')]
+    
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        _exclude_counters(self, kwargs)
+        super().save(*args, **kwargs)
+    
+    def allocate_version_numbers(self, count=1):
+        """
+        Reserve ``count`` consecutive version numbers and return the first.
+        
+        The F() increment locks the document row until the surrounding
+        transaction ends, so concurrent uploads queue up instead of reading the
+        same latest number, and an upload that rolls back returns its number.
+        Call it inside ``transaction.atomic`` together with the insert.
+        """
+        if not transaction.get_connection().in_atomic_block:
+            raise RuntimeError('Version numbers must be allocated inside a transaction.')
+        Document.objects.filter(pk=self.pk).update(version_counter=models.F('version_counter') + count)
+        self.version_counter = Document.objects.values_list('version_counter', flat=True).get(pk=self.pk)
+        return self.version_counter - count + 1
+    
+    def sync_version_counter(self):
+        """Raise the counter to the highest existing version, for rows inserted without allocating."""
+        highest = Version.objects.filter(document=self).order_by('-version_number').values('version_number')[:1]
+        Document.objects.filter(pk=self.pk).update(
+            version_counter=Greatest(models.F('version_counter'), Coalesce(models.Subquery(highest), 0))
+        )
+    
     def get_latest_version(self):
         return self.versions.order_by('-version_number').first()
     
@@ -150,9 +253,11 @@ def version_upload_path(instance, filename):
 
 class Version(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
-    version_number = models.PositiveIntegerField(default=1)
+    # Left empty, the next number is allocated from the document's counter.
+    version_number = models.PositiveIntegerField(blank=True)
     file = models.FileField(upload_to=version_upload_path)
     file_size = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=32, blank=True)
     change_summary = models.TextField(blank=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_versions')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -160,17 +265,119 @@ class Version(models.Model):
     class Meta:
         ordering = ['-version_number']
         unique_together = ['document', 'version_number']
+        permissions = [('export_version', 'Can export versions as CSV')]
     
     def __str__(self):
         return f"{self.document.name} v{self.version_number}"
     
+    # Attempts at inserting an allocated version before giving up; only SQLite,
+    # which reports lock contention as errors, should ever need more than one.
+    SAVE_ATTEMPTS = 30
+    
     def save(self, *args, **kwargs):
-        if not self.version_number:
-            last_version = Version.objects.filter(document=self.document).order_by('-version_number').first()
-            self.version_number = (last_version.version_number + 1) if last_version else 1
+        is_new = self._state.adding
         if self.file:
             self.file_size = self.file.size
-        super().save(*args, **kwargs)
+            # An uncommitted file was just assigned; renditions and heatmaps
+            # are keyed by the hash, so it must follow a replaced file.
+            if not self.content_hash or not self.file._committed:
+                self.content_hash = file_digest(self.file)
+        if is_new and self.version_number is None:
+            self._insert_allocated(*args, **kwargs)
+        elif is_new:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Document.objects.filter(pk=self.document_id, version_counter__lt=self.version_number) \
+                    .update(version_counter=self.version_number)
+                adjust_storage_usage(self.document.project_id, self.file_size)
+        else:
+            super().save(*args, **kwargs)
+        if is_new:
+            UPLOAD_BYTES.inc(self.file_size, file_type=self.document.file_type)
+    
+    def _insert_allocated(self, *args, **kwargs):
+        # Inside a caller's transaction a lock error can't be waited out: the
+        # transaction keeps its own locks while sleeping, and SQLite may not
+        # let it write at all until it rolls back. Only the caller can retry.
+        retry_locks = not connection.in_atomic_block
+        for attempt in range(self.SAVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    self.version_number = self.document.allocate_version_numbers()
+                    super().save(*args, **kwargs)
+                    adjust_storage_usage(self.document.project_id, self.file_size)
+                return
+            except IntegrityError:
+                taken = Version.objects.filter(document=self.document_id, version_number=self.version_number).exists()
+                self.version_number = None
+                if not taken or attempt == self.SAVE_ATTEMPTS - 1:
+                    raise
+                # Versions inserted without allocating left the counter behind.
+                self.document.sync_version_counter()
+            except OperationalError as e:
+                self.version_number = None
+                # SQLite fails a writer that can't get the database lock
+                # instead of queueing it like a row lock would.
+                if not retry_locks or connection.vendor != 'sqlite' or 'locked' not in str(e) \
+                        or attempt == self.SAVE_ATTEMPTS - 1:
+                    raise
+            time.sleep(random.uniform(0, min(0.2, 0.005 * 2 ** attempt)))
+
+
+def version_deleted(sender, instance, **kwargs):
+    """``post_delete`` receiver for Version, cascades included."""
+    if instance.file_size:
+        delta = models.F('storage_bytes') - instance.file_size
+        Project.objects.filter(documents=instance.document_id).update(storage_bytes=delta)
+        Team.objects.filter(projects__documents=instance.document_id).update(storage_bytes=delta)
+
+
+def comment_deleted(sender, instance, **kwargs):
+    """``post_delete`` receiver for Comment; a cascade sends it once per reply."""
+    if instance.root_id:
+        Comment.objects.filter(pk=instance.root_id, reply_count__gt=0) \
+            .update(reply_count=models.F('reply_count') - 1)
+
+
+def adjust_storage_usage(project_id, delta):
+    """Add ``delta`` bytes to a project's and its team's usage counters."""
+    if delta:
+        Project.objects.filter(pk=project_id).update(storage_bytes=models.F('storage_bytes') + delta)
+        Team.objects.filter(projects=project_id).update(storage_bytes=models.F('storage_bytes') + delta)
+
+
+# Counters and the deletion mark only change through update().
+COUNTER_FIELDS = ('storage_bytes', 'deleted_at', 'version_counter', 'reply_count')
+
+
+def _exclude_counters(instance, kwargs):
+    # Saving an instance loaded earlier must not write its stale copy of a
+    # counter back.
+    if not instance._state.adding and kwargs.get('update_fields') is None:
+        kwargs['update_fields'] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in COUNTER_FIELDS
+        ]
+
+
+class VersionSignature(models.Model):
+    """
+    MinHash signature of a version's extracted text: ``num_perm`` unsigned
+    32-bit ints packed into ``signature``. See ``doctrack.utils.similarity``.
+    """
+    version = models.OneToOneField(Version, on_delete=models.CASCADE, related_name='signature')
+    signature = models.BinaryField()
+    shingle_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Signature of {self.version}"
+
+
+class SignatureBand(models.Model):
+    """One LSH band of a signature; versions sharing a bucket are candidate near-duplicates."""
+    signature = models.ForeignKey(VersionSignature, on_delete=models.CASCADE, related_name='bands')
+    bucket = models.BigIntegerField(db_index=True)
 
 
 class PullRequest(models.Model):
@@ -196,6 +403,12 @@ class PullRequest(models.Model):
     merged_at = models.DateTimeField(null=True, blank=True)
     merged_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='merged_prs')
     
+    objects = ProjectContentManager()
+    all_objects = models.Manager()
+    
+    class Meta:
+        permissions = [('export_pullrequest', 'Can export pull requests as CSV')]
+    
     def __str__(self):
         return self.title
     
@@ -240,6 +453,9 @@ class Review(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        permissions = [('export_review', 'Can export reviews as CSV')]
+    
     def __str__(self):
         return f"Review by {self.reviewer.username} on {self.pull_request.title}"
 
@@ -280,6 +496,12 @@ class WorkItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProjectContentManager()
+    all_objects = models.Manager()
+    
+    class Meta:
+        permissions = [('export_workitem', 'Can export work items as CSV')]
+    
     def __str__(self):
         return self.title
 
@@ -291,14 +513,29 @@ class Comment(models.Model):
     pull_request = models.ForeignKey(PullRequest, on_delete=models.CASCADE, related_name='comments', null=True, blank=True)
     work_item = models.ForeignKey(WorkItem, on_delete=models.CASCADE, related_name='comments', null=True, blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Top-level comment of the thread (null for top-level comments), so a
+    # whole thread loads with one query whatever its depth.
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='thread_replies')
+    # On top-level comments: replies anywhere in the thread.
+    reply_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['created_at']
+        permissions = [('export_comment', 'Can export comments as CSV')]
     
     def __str__(self):
         return f"Comment by {self.author.username}"
+    
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        if self.parent_id and not self.root_id:
+            self.root_id = self.parent.root_id or self.parent_id
+        _exclude_counters(self, kwargs)
+        super().save(*args, **kwargs)
+        if is_new and self.root_id:
+            Comment.objects.filter(pk=self.root_id).update(reply_count=models.F('reply_count') + 1)
 
 
 class Activity(models.Model):
@@ -321,9 +558,13 @@ class Activity(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='activities', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ProjectContentManager()
+    all_objects = models.Manager()
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Activities'
+        permissions = [('export_activity', 'Can export activity as CSV')]
     
     def __str__(self):
         return f"{self.user.username} {self.action} {self.target_name}"
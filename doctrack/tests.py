@@ -1,3 +1,2092 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import gzip
+import json
+import os
+import pstats
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import brotli
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from PIL import Image
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.db import OperationalError, connection, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .admin import DocumentAdmin
+from .bench.runner import HEAVY_MODULES
+from .bench.synthetic import make_file
+from .middleware import StaticFilesMiddleware
+from .models import (
+    Activity, Project, Document, Version, Comment, PullRequest, Team, UserProfile, VersionSignature
+)
+from .utils.changelist import EstimatedCountPaginator, csv_rows
+from .utils.comments import comment_threads
+from .utils.comparison import align_pages, diff_pages_budgeted, diff_texts_budgeted
+from .utils.handlers import detect_file_type, get_handler, pdf
+from .utils.image_diff import compare_images
+from .utils.importer import Checkpoint, DocumentImporter, group_entries, parse_entry
+from .utils.instrumentation import QueryRecorder, fingerprint_sql, record_queries, summarize_requests
+from .utils.metrics import CACHE_REQUESTS, COMPARISONS, RETIRED_SNAPSHOT, merge_snapshots, retire_dead_snapshots
+from .utils.profiling import RequestProfile, is_hot_path
+from .utils.purge import purge_project
+from .utils.renditions import RenditionCache, RenditionService, renditions
+from .utils.scheduler import ComparisonScheduler, scheduler
+from .utils.similarity import (
+    band_buckets, estimate_similarity, minhash, save_signature, shingles, similar_documents
+)
+from .utils.staticfiles import compress
+from .utils.usercache import get_user, user_cache
+from .utils.workers import (
+    cpu_time_limit, get_process_pool, result_within, submit_to_process, terminate_process_pool, CPUBudgetExceeded,
+    JobTimeout,
+)
+
+
+class VersionNumberingTests(TransactionTestCase):
+    UPLOADERS = 50
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('uploader', password='pw')
+        project = Project.objects.create(name='Stress', owner=self.user)
+        self.document = Document.objects.create(
+            name='Spec', project=project, file_type='text', created_by=self.user
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload_concurrently(self, count):
+        start = threading.Barrier(count)
+        errors = []
+
+        def upload(i):
+            try:
+                document = Document.objects.get(pk=self.document.pk)
+                start.wait()
+                Version.objects.create(
+                    document=document,
+                    file=ContentFile(f'revision {i}\n'.encode(), name=f'spec-{i}.txt'),
+                    uploaded_by=self.user,
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_uploads_get_consecutive_numbers(self):
+        errors = self.upload_concurrently(self.UPLOADERS)
+
+        self.assertEqual(errors, [])
+        numbers = sorted(self.document.versions.values_list('version_number', flat=True))
+        self.assertEqual(numbers, list(range(1, self.UPLOADERS + 1)))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.version_counter, self.UPLOADERS)
+
+    def test_concurrent_uploads_through_view(self):
+        # 'other' has no text extractor, so no background indexing is queued.
+        document = Document.objects.create(
+            name='Drawing', project=self.document.project, file_type='other', created_by=self.user
+        )
+        url = reverse('document_upload_version', args=[document.pk])
+        clients = []
+        for _ in range(10):
+            client = Client()
+            client.force_login(self.user)
+            clients.append(client)
+        start = threading.Barrier(len(clients))
+        statuses = []
+
+        def upload(i, client):
+            try:
+                start.wait()
+                response = client.post(url, {
+                    'file': SimpleUploadedFile(f'drawing-{i}.txt', f'revision {i}\n'.encode()),
+                    'change_summary': f'revision {i}',
+                })
+                statuses.append(response.status_code)
+            except Exception as e:
+                statuses.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload, args=(i, client)) for i, client in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [302] * len(clients))
+        numbers = sorted(document.versions.values_list('version_number', flat=True))
+        self.assertEqual(numbers, list(range(1, len(clients) + 1)))
+        document.refresh_from_db()
+        self.assertEqual(document.version_counter, len(clients))
+
+    def lock_once(self):
+        allocate = Document.allocate_version_numbers
+        calls = []
+
+        def allocate_after_a_lock_error(document, count=1):
+            calls.append(count)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return allocate(document, count)
+
+        return mock.patch.object(Document, 'allocate_version_numbers', allocate_after_a_lock_error)
+
+    def new_version(self):
+        return Version(document=self.document, file=ContentFile(b'text', name='spec.txt'), uploaded_by=self.user)
+
+    def test_lock_errors_are_retried(self):
+        with self.lock_once(), mock.patch('doctrack.models.time.sleep') as sleep:
+            self.new_version().save()
+
+        sleep.assert_called_once()
+        self.assertEqual(self.document.versions.get().version_number, 1)
+
+    def test_lock_errors_inside_a_transaction_are_left_to_the_caller(self):
+        with self.lock_once(), mock.patch('doctrack.models.time.sleep') as sleep:
+            with self.assertRaises(OperationalError), transaction.atomic():
+                self.new_version().save()
+
+        sleep.assert_not_called()
+        self.assertFalse(self.document.versions.exists())
+
+    def test_saving_a_stale_document_keeps_the_counter(self):
+        stale = Document.objects.get(pk=self.document.pk)
+        Version.objects.create(
+            document=self.document, file=ContentFile(b'first', name='spec.txt'), uploaded_by=self.user
+        )
+
+        stale.description = 'edited'
+        stale.save()
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.version_counter, 1)
+        self.assertEqual(self.document.description, 'edited')
+
+    def test_counter_catches_up_with_unallocated_versions(self):
+        Version.objects.bulk_create([
+            Version(document=self.document, version_number=n, file=f'versions/spec-{n}.txt', uploaded_by=self.user)
+            for n in (1, 2, 3)
+        ])
+
+        version = Version.objects.create(
+            document=self.document, file=ContentFile(b'next', name='spec.txt'), uploaded_by=self.user
+        )
+
+        self.assertEqual(version.version_number, 4)
+
+
+class CommentThreadingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('commenter', password='pw')
+        project = Project.objects.create(name='Threads', owner=self.user)
+        self.document = Document.objects.create(name='Spec', project=project, created_by=self.user)
+        self.root = self.comment('root')
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(content=content, author=self.user, document=self.document, parent=parent)
+
+    def reply_count(self):
+        return Comment.objects.values_list('reply_count', flat=True).get(pk=self.root.pk)
+
+    def test_replies_point_at_the_thread_root(self):
+        reply = self.comment('reply', self.root)
+        nested = self.comment('nested', reply)
+
+        self.assertEqual(reply.root_id, self.root.pk)
+        self.assertEqual(nested.root_id, self.root.pk)
+        self.assertEqual(self.reply_count(), 2)
+
+    def test_deleting_replies_decrements_the_count(self):
+        reply = self.comment('reply', self.root)
+        self.comment('nested', reply)
+        other = self.comment('other', self.root)
+
+        other.delete()
+        self.assertEqual(self.reply_count(), 2)
+        # The nested reply goes with its parent.
+        reply.delete()
+        self.assertEqual(self.reply_count(), 0)
+
+    def test_saving_a_stale_root_keeps_the_count(self):
+        stale = Comment.objects.get(pk=self.root.pk)
+        self.comment('reply', self.root)
+
+        stale.content = 'edited'
+        stale.save()
+
+        self.assertEqual(self.reply_count(), 1)
+
+    def test_threads_are_assembled_in_posting_order(self):
+        first = self.comment('first', self.root)
+        self.comment('second', self.root)
+        self.comment('nested', first)
+        self.comment('unanswered')
+
+        with self.assertNumQueries(3):
+            threads = comment_threads(self.document)
+            roots = list(threads)
+
+        self.assertEqual([c.content for c in roots], ['unanswered', 'root'])
+        thread = roots[1]
+        self.assertEqual([c.content for c in thread.children], ['first', 'second'])
+        self.assertEqual([(c.content, c.depth) for c in thread.children[0].children], [('nested', 2)])
+
+
+@override_settings(DOCTRACK_RENDITION_SIZES={'small': (16, 16), 'large': (48, 48)})
+class RenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, DOCTRACK_RENDITION_DIR=os.path.join(self.media_root, 'renditions')
+        )
+        self.settings_override.enable()
+        self.service = RenditionService()
+        self.owner = User.objects.create_user('owner', password='pw')
+        project = Project.objects.create(name='Artwork', owner=self.owner)
+        document = Document.objects.create(name='Logo', project=project, file_type='image', created_by=self.owner)
+        self.version = Version.objects.create(
+            document=document, file=ContentFile(self.png('red'), name='logo.png'), uploaded_by=self.owner
+        )
+        self.addCleanup(terminate_process_pool, 'extract')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def png(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (96, 64), color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_every_size_and_format_is_rendered_from_one_job(self):
+        with mock.patch('doctrack.utils.renditions.submit_to_process', wraps=submit_to_process) as submit:
+            path = self.service.wait(self.version, 'large', 'png', 10)
+        # The done callback stores the other renditions.
+        for _ in range(100):
+            if not self.service._inflight:
+                break
+            time.sleep(0.02)
+
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (48, 32))
+        self.assertEqual(submit.call_count, 1)
+        for size in ('small', 'large'):
+            for ext in ('png', 'webp'):
+                self.assertIsNotNone(self.service.get(self.version, size, ext))
+
+    def test_cached_renditions_are_served_without_rendering(self):
+        first = self.service.wait(self.version, 'small', 'webp', 10)
+
+        with mock.patch('doctrack.utils.renditions.submit_to_process') as submit:
+            again = self.service.wait(self.version, 'small', 'webp', 10)
+
+        self.assertEqual(again, first)
+        submit.assert_not_called()
+
+    def test_identical_content_shares_renditions(self):
+        copy = Version.objects.create(
+            document=self.version.document, file=ContentFile(self.png('red'), name='copy.png'), uploaded_by=self.owner
+        )
+
+        self.assertEqual(self.service.key(copy, 'small'), self.service.key(self.version, 'small'))
+
+    def test_replacing_a_file_gives_new_renditions(self):
+        old_key = self.service.key(self.version, 'small')
+        old = self.service.wait(self.version, 'small', 'png', 10)
+
+        self.version.file = ContentFile(self.png('blue'), name='logo.png')
+        self.version.save()
+        self.version.refresh_from_db()
+        new = self.service.wait(self.version, 'small', 'png', 10)
+
+        self.assertNotEqual(self.service.key(self.version, 'small'), old_key)
+        with Image.open(old) as before, Image.open(new) as after:
+            self.assertEqual(before.getpixel((0, 0)), (255, 0, 0))
+            self.assertEqual(after.getpixel((0, 0)), (0, 0, 255))
+
+    def test_view_serves_renditions_with_an_immutable_etag(self):
+        self.client.force_login(self.owner)
+        url = reverse('version_rendition', args=[self.version.pk, 'small', 'webp'])
+
+        with mock.patch.object(renditions, '_cache', None):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(
+                self.client.get(reverse('version_rendition', args=[self.version.pk, 'huge', 'webp'])).status_code, 404
+            )
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = RenditionCache(os.path.join(self.media_root, 'lru'), max_bytes=250)
+        paths = [cache.put(key, 'png', b'x' * 100) for key in ('aa1', 'bb2')]
+        os.utime(paths[0], (1, 1))
+        os.utime(paths[1], (2, 2))
+        cache.get('aa1', 'png')
+
+        cache.put('cc3', 'png', b'x' * 100)
+
+        self.assertIsNotNone(cache.get('aa1', 'png'))
+        self.assertIsNone(cache.get('bb2', 'png'))
+        self.assertIsNotNone(cache.get('cc3', 'png'))
+
+
+class ImageHeatmapTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.project = Project.objects.create(name='Artwork', owner=self.owner)
+        document = Document.objects.create(name='Logo', project=self.project, file_type='image', created_by=self.owner)
+        self.old = self.version(document, (0, 0))
+        self.new = self.version(document, (32, 32))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def version(self, document, square_at):
+        image = Image.new('RGB', (64, 64), 'white')
+        image.paste((200, 0, 0), square_at + (square_at[0] + 16, square_at[1] + 16))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG')
+        return Version.objects.create(
+            document=document, file=ContentFile(buffer.getvalue(), name='logo.png'), uploaded_by=self.owner
+        )
+
+    def heatmap_url(self):
+        width, height = compare_images(self.old.file.path, self.new.file.path, None)['heatmap']
+        return reverse('version_heatmap', args=[self.new.pk, self.old.pk, width, height])
+
+    def test_heatmap_is_served_to_users_who_can_see_the_document(self):
+        url = self.heatmap_url()
+        self.client.force_login(self.owner)
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_heatmap_is_hidden_from_other_users(self):
+        url = self.heatmap_url()
+        self.client.force_login(User.objects.create_user('outsider', password='pw'))
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_anonymous_requests_are_sent_to_login(self):
+        url = self.heatmap_url()
+        Project.objects.filter(pk=self.project.pk).update(is_public=True)
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+
+@override_settings(DOCTRACK_COMPARE_CACHE='default', DOCTRACK_COMPARE_MAX_INFLIGHT=2,
+                   DOCTRACK_COMPARE_MAX_PER_USER=1, DOCTRACK_COMPARE_WAIT=5)
+class ComparisonSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.release = threading.Event()
+        self.calls = []
+        patcher = mock.patch('doctrack.utils.scheduler.compare_documents_budgeted', self.compare)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = ComparisonScheduler()
+        self.addCleanup(self.drain)
+
+    def drain(self):
+        # Let running jobs finish so their results don't land in the next test's cache.
+        self.release.set()
+        if self.scheduler._executor is not None:
+            self.scheduler._executor.shutdown(wait=True)
+
+    def compare(self, file_path1, file_path2, file_type, budget):
+        self.calls.append((file_path1, file_path2))
+        self.release.wait(5)
+        return {'can_compare': True, 'compared': (file_path1, file_path2), 'partial': file_type == 'slow'}
+
+    def test_identical_comparisons_share_one_job(self):
+        first, outcome = self.scheduler.submit((1, 2), 10, 'a', 'b', 'text')
+        self.assertEqual(outcome, 'computed')
+        second, outcome = self.scheduler.submit((1, 2), 11, 'a', 'b', 'text')
+        self.assertEqual(outcome, 'coalesced')
+        self.assertIs(second, first)
+
+        self.release.set()
+        first.result(5)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_limits_reject_extra_comparisons(self):
+        self.scheduler.submit((1, 2), 10, 'a', 'b', 'text')
+        self.assertEqual(self.scheduler.submit((3, 4), 10, 'c', 'd', 'text'), (None, 'rejected'))
+        self.scheduler.submit((5, 6), 11, 'e', 'f', 'text')
+        self.assertEqual(self.scheduler.submit((7, 8), 12, 'g', 'h', 'text'), (None, 'rejected'))
+        self.assertEqual(self.scheduler.inflight_count(), 2)
+        self.assertEqual(self.scheduler.inflight_count(10), 1)
+
+    def test_finished_results_are_served_from_the_cache(self):
+        self.release.set()
+        result = asyncio.run(self.scheduler.compare((1, 2), 10, 'a', 'b', 'text'))
+        self.assertEqual(result['compared'], ('a', 'b'))
+        # The done callback caches the result and frees the slot.
+        for _ in range(50):
+            if not self.scheduler.inflight_count():
+                break
+            time.sleep(0.01)
+
+        again = asyncio.run(self.scheduler.compare((1, 2), 10, 'a', 'b', 'text'))
+
+        self.assertEqual(again, result)
+        self.assertEqual(len(self.calls), 1)
+
+    @override_settings(DOCTRACK_COMPARE_RESULT_TTL=300, DOCTRACK_COMPARE_PARTIAL_TTL=30)
+    def test_partial_results_are_cached_briefly(self):
+        self.release.set()
+        with mock.patch('doctrack.utils.scheduler.result_cache') as result_cache:
+            self.scheduler.submit((1, 2), 10, 'a', 'b', 'text')[0].result(5)
+            self.scheduler.submit((3, 4), 10, 'c', 'd', 'slow')[0].result(5)
+            self.drain()
+
+        ttls = {call.args[0]: call.args[2] for call in result_cache().set.call_args_list}
+        self.assertEqual(ttls, {self.scheduler.cache_key((1, 2)): 300, self.scheduler.cache_key((3, 4)): 30})
+
+    def test_waiting_too_long_returns_a_pending_result(self):
+        with override_settings(DOCTRACK_COMPARE_WAIT=0.05):
+            result = asyncio.run(self.scheduler.compare((1, 2), 10, 'a', 'b', 'text'))
+
+        self.assertTrue(result['pending'])
+        self.assertFalse(result['can_compare'])
+
+
+def sleep_without_alarms(seconds):
+    # Stands in for a job stuck in C code, which the worker's alarm can't interrupt.
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    try:
+        time.sleep(seconds)
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+    return 'finished'
+
+
+@override_settings(DOCTRACK_WORKER_PROCESSES=1)
+class WorkerTimeoutTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(terminate_process_pool, 'default')
+
+    def test_jobs_return_their_result(self):
+        self.assertEqual(result_within(submit_to_process(sorted, [3, 1, 2])), [1, 2, 3])
+
+    @override_settings(DOCTRACK_WORKER_TIMEOUT=0.5)
+    def test_a_job_past_its_limit_stops_itself(self):
+        began = time.monotonic()
+
+        with self.assertRaises(JobTimeout):
+            result_within(submit_to_process(time.sleep, 30))
+
+        self.assertLess(time.monotonic() - began, 10)
+        # The worker is free again.
+        self.assertEqual(result_within(submit_to_process(abs, -1)), 1)
+
+    @override_settings(DOCTRACK_WORKER_TIMEOUT=0.5)
+    def test_a_stuck_worker_gets_its_pool_killed(self):
+        pool = get_process_pool()
+
+        with mock.patch('doctrack.utils.workers.KILL_GRACE', 0), self.assertRaises(JobTimeout):
+            result_within(submit_to_process(sleep_without_alarms, 30))
+
+        self.assertIsNot(get_process_pool(), pool)
+        self.assertEqual(result_within(submit_to_process(abs, -1)), 1)
+
+
+@override_settings(DOCTRACK_COMPARE_CACHE='default')
+class AsyncComparisonViewTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.project = Project.objects.create(name='Specs', owner=self.owner)
+        self.document = Document.objects.create(
+            name='Spec', project=self.project, file_type='text', created_by=self.owner
+        )
+        self.old, self.new = [
+            Version.objects.create(
+                document=self.document, file=ContentFile(text.encode(), name='spec.txt'), uploaded_by=self.owner
+            )
+            for text in ('alpha\nbeta\ngamma\n', 'alpha\nBETA\ngamma\n')
+        ]
+        self.url = reverse('document_compare', args=[self.document.pk]) + f'?v1={self.old.pk}&v2={self.new.pk}'
+        self.addCleanup(terminate_process_pool, 'default')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_compare_runs_the_diff_in_a_worker(self):
+        self.client.force_login(self.owner)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        comparison = response.context['comparison']
+        self.assertTrue(comparison['can_compare'])
+        self.assertEqual(comparison['stats']['lines_changed'], 1)
+
+    def test_profiled_compare_reports_the_worker_job(self):
+        self.owner.is_staff = True
+        self.owner.save()
+        self.client.force_login(self.owner)
+
+        response = self.client.get(self.url + '&profile=1')
+
+        self.assertTemplateUsed(response, 'profiling/report.html')
+        [job] = response.context['offloaded_jobs']
+        self.assertEqual(job['function'], 'diff_texts_budgeted')
+        self.assertTrue(job['finished'])
+        self.assertTrue(any(row['worker'] for row in response.context['hot_paths']))
+
+    def test_pull_request_shows_its_comparison(self):
+        pr = PullRequest.objects.create(
+            title='Shout', project=self.project, document=self.document,
+            source_version=self.new, target_version=self.old, created_by=self.owner,
+        )
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('pull_request_detail', args=[pr.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['comparison']['stats']['lines_changed'], 1)
+
+    def test_outsiders_and_anonymous_users_are_turned_away(self):
+        self.assertTrue(self.client.get(self.url)['Location'].startswith(reverse('login')))
+
+        self.client.force_login(User.objects.create_user('outsider', password='pw'))
+        self.assertRedirects(self.client.get(self.url), reverse('project_list'), fetch_redirect_response=False)
+
+    def test_a_comparison_that_times_out_says_so(self):
+        self.client.force_login(self.owner)
+
+        with mock.patch('doctrack.utils.scheduler.compare_documents_budgeted', side_effect=JobTimeout):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.context['comparison']['error'], 'This comparison took too long and was stopped.')
+        self.assertIsNone(caches['default'].get(scheduler.cache_key((self.old.pk, self.new.pk))))
+
+
+class CPUBudgetTests(SimpleTestCase):
+    def test_budget_interrupts_the_block(self):
+        deadline = time.monotonic() + 5
+        with self.assertRaises(CPUBudgetExceeded):
+            with cpu_time_limit(0.05):
+                while time.monotonic() < deadline:
+                    pass
+
+    def test_exhausted_budget_keeps_finished_work(self):
+        text1 = '\n'.join(f'line {i} of the first draft' for i in range(5000))
+        text2 = '\n'.join(f'line {i} of the {"second" if i % 3 else "first"} draft' for i in range(5000))
+
+        # A budget signal arriving in a garbage collector finalizer would be swallowed.
+        gc.collect()
+        gc.disable()
+        try:
+            result = diff_texts_budgeted(text1, text2, 0.05)
+        finally:
+            gc.enable()
+
+        if result['can_compare']:
+            self.assertTrue(result['partial'])
+            self.assertIn('stats', result)
+        else:
+            self.assertIn('CPU budget', result['error'])
+
+    def test_unlimited_budget_finishes(self):
+        result = diff_texts_budgeted('one\ntwo\n', 'one\nthree\n', None)
+
+        self.assertFalse(result['partial'])
+        self.assertIn('html_diff', result)
+
+
+class LazyImportTests(SimpleTestCase):
+    def test_heavy_libraries_are_not_imported_at_startup(self):
+        script = (
+            'import json, sys, django; django.setup(); import doctrack.urls; '
+            f'print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='doctrack_project.settings')
+
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, env=env,
+            cwd=settings.BASE_DIR, timeout=60,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout.splitlines()[-1]), [])
+
+
+class HotPathTests(SimpleTestCase):
+    def test_modules_and_handler_package_are_hot_paths(self):
+        from . import views
+        from .utils import comparison
+        from .utils.handlers import detect_file_type, get_handler, pdf
+
+        self.assertTrue(is_hot_path(comparison.__file__))
+        self.assertTrue(is_hot_path(pdf.__file__))
+        self.assertFalse(is_hot_path(views.__file__))
+
+
+class RequestProfileTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(terminate_process_pool, 'default')
+
+    def test_offloaded_jobs_are_profiled_in_the_worker(self):
+        profile = RequestProfile()
+
+        result = profile.run(lambda: result_within(
+            submit_to_process(diff_texts_budgeted, 'one\ntwo\n', 'one\nthree\n', None)
+        ))
+
+        self.assertIn('html_diff', result)
+        [job] = profile.offloaded_jobs()
+        self.assertEqual((job['function'], job['pool'], job['finished']), ('diff_texts_budgeted', 'default', True))
+        worker_rows = [row for row in profile.hot_paths() if row['worker']]
+        self.assertIn('diff_texts_budgeted', [row['function'] for row in worker_rows])
+        self.assertFalse(os.path.exists(profile.offloaded[0]['stats_path']))
+
+    def test_jobs_outside_a_profile_are_not_profiled(self):
+        profile = RequestProfile()
+        profile.run(lambda: None)
+
+        result_within(submit_to_process(abs, -1))
+
+        self.assertEqual(profile.offloaded_jobs(), [])
+
+    def test_overlapping_allocation_traces_share_tracemalloc(self):
+        first, second = RequestProfile(trace_allocations=True), RequestProfile(trace_allocations=True)
+
+        first._start()
+        second._start()
+        second._stop()
+        self.assertTrue(tracemalloc.is_tracing())
+        first._stop()
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertTrue(second.allocations)
+
+    def test_tracing_started_elsewhere_is_left_running(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+
+        profile = RequestProfile(trace_allocations=True)
+        profile.run(lambda: [object() for _ in range(100)])
+
+        self.assertTrue(tracemalloc.is_tracing())
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.url = reverse('project_list')
+
+    def test_staff_get_an_html_report(self):
+        self.client.force_login(self.staff)
+
+        response = self.client.get(self.url, {'profile': '1', 'profile_alloc': '1'})
+
+        self.assertTemplateUsed(response, 'profiling/report.html')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(response.context['view_name'], 'project_list')
+        self.assertTrue(response.context['call_tree'])
+        self.assertTrue(response.context['allocations'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_pstats_download_loads_in_pstats(self):
+        self.client.force_login(self.staff)
+
+        response = self.client.get(self.url, HTTP_X_PROFILE='pstats')
+
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="project_list.pstats"')
+        with tempfile.NamedTemporaryFile(suffix='.pstats') as f:
+            f.write(response.content)
+            f.flush()
+            stats = pstats.Stats(f.name)
+        self.assertTrue(any(name == 'project_list' for _, _, name in stats.stats))
+
+    def test_other_users_get_the_page(self):
+        self.client.force_login(User.objects.create_user('member', password='pw'))
+
+        response = self.client.get(self.url, {'profile': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateNotUsed(response, 'profiling/report.html')
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.user = User.objects.create_user('cached', password='pw')
+        UserProfile.objects.create(user=self.user, role='reviewer')
+        self.client.force_login(self.user)
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        return request
+
+    def lookups(self):
+        samples = {tuple(key): value for key, value in CACHE_REQUESTS.samples()}
+        return samples.get(('user', 'hit'), 0), samples.get(('user', 'miss'), 0)
+
+    def test_second_lookup_needs_no_queries(self):
+        hits, misses = self.lookups()
+        get_user(self.request())
+
+        with self.assertNumQueries(0):
+            user = get_user(self.request())
+            self.assertEqual(user.profile.role, 'reviewer')
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(self.lookups(), (hits + 1, misses + 1))
+
+    def test_saving_the_user_or_profile_drops_the_entry(self):
+        get_user(self.request())
+        self.user.first_name = 'Changed'
+        self.user.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            user = get_user(self.request())
+        self.assertTrue(queries.captured_queries)
+        self.assertEqual(user.first_name, 'Changed')
+
+        UserProfile.objects.get(user=self.user).save()
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    def test_session_from_before_a_password_change_is_rejected(self):
+        get_user(self.request())
+        stale = self.request()
+        self.user.set_password('new password')
+        self.user.save()
+
+        self.assertFalse(get_user(stale).is_authenticated)
+
+    def test_middleware_serves_views_from_the_cache(self):
+        self.client.get(reverse('profile'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+
+        self.assertEqual(response.status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"auth_user"."password"', tables)
+        self.assertNotIn('FROM "doctrack_userprofile"', tables)
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        self.url = reverse('metrics')
+
+    @override_settings(DOCTRACK_METRICS_TOKEN=None)
+    def test_without_a_token_only_staff_can_scrape(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.force_login(User.objects.create_user('member', password='pw'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_login(User.objects.create_user('operator', password='pw', is_staff=True))
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE doctrack_request_duration_seconds histogram', response.content)
+
+    @override_settings(DOCTRACK_METRICS_TOKEN='secret')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class MetricsSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # A process that has certainly exited.
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        self.dead_pid = child.pid
+
+    def write(self, pid, requests, workers):
+        snapshot = {'pid': pid, 'metrics': {
+            'requests_total': {'type': 'counter', 'help': '', 'labelnames': [], 'samples': [[[], requests]]},
+            'workers': {'type': 'gauge', 'help': '', 'labelnames': [], 'samples': [[[], workers]]},
+        }}
+        name = f'metrics_{pid}.json' if pid else RETIRED_SNAPSHOT
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump(snapshot, f)
+
+    def load(self):
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+        return merge_snapshots(snapshots)
+
+    def test_dead_processes_are_folded_into_the_retired_snapshot(self):
+        self.write(None, 5, 0)
+        self.write(self.dead_pid, 3, 4)
+        self.write(os.getpid(), 2, 1)
+
+        retire_dead_snapshots(self.directory)
+
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        self.assertEqual(files, [f'metrics_{os.getpid()}.json', RETIRED_SNAPSHOT])
+        merged = self.load()
+        self.assertEqual(merged['requests_total']['samples'], [[[], 10]])
+        # Only the live process's gauge is left.
+        self.assertEqual(merged['workers']['samples'], [[[], 1]])
+
+    def test_live_snapshots_are_left_alone(self):
+        self.write(os.getpid(), 2, 1)
+
+        retire_dead_snapshots(self.directory)
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, RETIRED_SNAPSHOT)))
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('integrator', password='pw')
+        self.client.force_login(self.user)
+        self.projects = [
+            Project.objects.create(name=f'Project {i}', description='x' * 100, owner=self.user) for i in range(5)
+        ]
+        Project.objects.create(name='Private', owner=User.objects.create_user('stranger', password='pw'))
+
+    def get(self, resource, **params):
+        response = self.client.get(reverse('api_collection', args=[resource]), params)
+        return response.status_code, response.json()
+
+    def batch(self, *requests):
+        response = self.client.post(
+            reverse('api_batch'), json.dumps({'requests': list(requests)}), content_type='application/json'
+        )
+        return response.status_code, response.json()
+
+    def test_cursor_pages_through_visible_rows_newest_first(self):
+        names = []
+        params = {'limit': 2}
+        while True:
+            status, payload = self.get('projects', **params)
+            self.assertEqual(status, 200)
+            names += [row['name'] for row in payload['data']]
+            if not payload['next_cursor']:
+                break
+            params['cursor'] = payload['next_cursor']
+
+        self.assertEqual(names, [f'Project {i}' for i in reversed(range(5))])
+
+    def test_bad_parameters_are_client_errors(self):
+        self.assertEqual(self.get('projects', cursor='not a cursor')[0], 400)
+        self.assertEqual(self.get('projects', owner='me')[0], 400)
+        # Out of range for the database driver rather than invalid for the field.
+        self.assertEqual(self.get('projects', team='9' * 30)[0], 400)
+
+    def test_sparse_fields_and_includes(self):
+        document = Document.objects.create(name='Spec', project=self.projects[0], created_by=self.user)
+
+        status, payload = self.get('documents', fields='name', include='project', **{'fields[project]': 'name'})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['data'], [{'id': document.pk, 'name': 'Spec', 'project': self.projects[0].pk}])
+        self.assertEqual(payload['included'], {'project': [{'id': self.projects[0].pk, 'name': 'Project 0'}]})
+        self.assertEqual(self.get('documents', fields='secret')[0], 400)
+
+    def test_batch_commits_all_or_nothing(self):
+        first, second = self.projects[:2]
+        path = '/api/projects/{}/'.format
+
+        status, payload = self.batch(
+            {'method': 'PATCH', 'path': path(first.pk), 'body': {'name': 'Renamed'}},
+            {'method': 'GET', 'path': path(second.pk) + '?fields=name'},
+        )
+        self.assertEqual(status, 200)
+        self.assertTrue(payload['committed'])
+        self.assertEqual(payload['responses'][1]['body']['data'], {'id': second.pk, 'name': 'Project 1'})
+
+        status, payload = self.batch(
+            {'method': 'PATCH', 'path': path(second.pk), 'body': {'name': 'Lost'}},
+            {'method': 'GET', 'path': '/api/projects/?team=' + '9' * 30},
+            {'method': 'GET', 'path': path(first.pk)},
+        )
+        self.assertEqual(status, 400)
+        self.assertFalse(payload['committed'])
+        self.assertEqual([r['status'] for r in payload['responses']], [200, 400])
+        names = set(Project.objects.values_list('name', flat=True).filter(pk__in=[first.pk, second.pk]))
+        self.assertEqual(names, {'Renamed', 'Project 1'})
+
+    def test_batch_reports_unexpected_errors_per_request(self):
+        with mock.patch('doctrack.api.dispatch', side_effect=RuntimeError('boom')), \
+                self.assertLogs('doctrack.api', 'ERROR'):
+            status, payload = self.batch({'method': 'GET', 'path': '/api/projects/'})
+
+        self.assertEqual(status, 400)
+        self.assertEqual(payload['responses'], [{'status': 500, 'body': {'error': 'Internal error'}}])
+
+
+class ImportGroupingTests(SimpleTestCase):
+    def test_version_suffixes_are_parsed(self):
+        self.assertEqual(parse_entry('specs/report_v2.pdf'), ('specs/report', 2))
+        self.assertEqual(parse_entry('specs/report version 3.pdf'), ('specs/report', 3))
+        self.assertEqual(parse_entry('specs/report-V10.docx'), ('specs/report', 10))
+        self.assertEqual(parse_entry('specs/report.pdf'), ('specs/report', 0))
+        self.assertEqual(parse_entry('README'), ('README', 0))
+
+    def test_entries_group_by_name_and_type_in_version_order(self):
+        groups = group_entries([
+            'specs/report_v10.txt', 'specs/report.txt', 'specs/report v2.txt',
+            'specs/report_v2.pdf', 'notes/report_v1.txt',
+        ])
+
+        self.assertEqual(groups, [
+            ('notes/report', 'text', ['notes/report_v1.txt']),
+            ('specs/report', 'pdf', ['specs/report_v2.pdf']),
+            ('specs/report', 'text', ['specs/report.txt', 'specs/report v2.txt', 'specs/report_v10.txt']),
+        ])
+
+
+@override_settings(DOCTRACK_PROJECT_QUOTA_BYTES=None, DOCTRACK_TEAM_QUOTA_BYTES=None)
+class DocumentImportTests(TestCase):
+    FILES = {
+        'specs/report.txt': 'first draft',
+        'specs/report_v2.txt': 'second draft',
+        'specs/report v3.txt': 'third draft',
+        'specs/summary.txt': 'first draft',
+        'minutes.txt': 'minutes',
+        'photo.heic': 'not supported',
+    }
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('importer', password='pw')
+        self.project = Project.objects.create(name='Archive', owner=self.user)
+        filler = ' '.join(f'word{i}' for i in range(40))
+        for name, text in self.FILES.items():
+            path = os.path.join(self.source, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(f'{text} {filler}')
+        self.checkpoint = os.path.join(self.media_root, 'import.checkpoint')
+        self.addCleanup(terminate_process_pool, 'extract')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        shutil.rmtree(self.source, ignore_errors=True)
+
+    def importer(self, source=None, **kwargs):
+        return DocumentImporter(
+            self.project, self.user, source or self.source, batch=1, checkpoint=self.checkpoint, **kwargs
+        )
+
+    def assert_imported(self, stats):
+        self.assertEqual(stats['files'], 6)
+        self.assertEqual(stats['unsupported'], 1)
+        self.assertEqual(stats['duplicates'], 1)
+        report = Document.objects.get(project=self.project, name='specs/report')
+        self.assertEqual(
+            list(report.versions.order_by('version_number').values_list('version_number', 'change_summary')),
+            [(1, 'Initial version'), (2, 'Imported specs/report_v2.txt'), (3, 'Imported specs/report v3.txt')],
+        )
+        with report.versions.get(version_number=3).file.open('rb') as f:
+            self.assertTrue(f.read().startswith(b'third draft'))
+        self.assertEqual(Version.objects.filter(document__project=self.project).count(), 4)
+        self.assertEqual(
+            VersionSignature.objects.filter(version__document__project=self.project).count(), 4
+        )
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_directory_import(self):
+        self.assert_imported(self.importer().run())
+
+    def test_zip_import(self):
+        archive = os.path.join(self.media_root, 'archive.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name in self.FILES:
+                zf.write(os.path.join(self.source, *name.split('/')), name)
+
+        self.assert_imported(self.importer(archive).run())
+
+    def test_interrupted_import_resumes_from_the_checkpoint(self):
+        # Documents go in name order: 'minutes', 'specs/report', 'specs/summary'.
+        calls = []
+        original = DocumentImporter._write
+
+        def write_once(importer, plan, results):
+            if calls:
+                raise KeyboardInterrupt
+            calls.append(plan)
+            return original(importer, plan, results)
+
+        with mock.patch.object(DocumentImporter, '_write', write_once), self.assertRaises(KeyboardInterrupt):
+            self.importer().run()
+
+        with open(self.checkpoint) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(json.loads(lines[0]), {'project': self.project.pk, 'source': self.source})
+        self.assertEqual([json.loads(line) for line in lines[1:]], ['minutes.txt'])
+        self.assertEqual(Version.objects.filter(document__project=self.project).count(), 1)
+
+        stats = self.importer().run()
+
+        self.assertEqual(stats['resumed'], 1)
+        self.assertEqual(Document.objects.filter(project=self.project, name='minutes').count(), 1)
+        self.assertEqual(stats['versions'], 3)
+        self.assertEqual(Version.objects.filter(document__project=self.project).count(), 4)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_ignores_a_torn_line_and_rejects_other_sources(self):
+        checkpoint = Checkpoint(self.checkpoint, self.project, self.source)
+        checkpoint.record(['a.txt', 'b.txt'])
+        with open(self.checkpoint, 'a') as f:
+            f.write('"c.t')
+
+        self.assertEqual(checkpoint.load(), {'a.txt', 'b.txt'})
+        with self.assertRaisesMessage(ValueError, 'different project or source'):
+            Checkpoint(self.checkpoint, self.project, self.media_root).load()
+
+
+@override_settings(DOCTRACK_PROJECT_QUOTA_BYTES=None, DOCTRACK_TEAM_QUOTA_BYTES=None)
+class ImportQuotaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('importer', password='pw')
+        self.project = Project.objects.create(name='Archive', owner=self.user, storage_quota=1000)
+        for i in range(3):
+            with open(os.path.join(self.source, f'note{i}.txt'), 'w') as f:
+                f.write(f'{i}' * 400)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        shutil.rmtree(self.source, ignore_errors=True)
+
+    def run_import(self, *options):
+        call_command(
+            'import_documents', str(self.project.pk), self.source, '--no-index', '--batch-size', '2',
+            '--checkpoint', os.path.join(self.source, '.checkpoint'), *options,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def test_import_stops_at_the_batch_that_would_exceed_the_quota(self):
+        with self.assertRaisesMessage(CommandError, '--force'):
+            self.run_import()
+
+        self.project.refresh_from_db()
+        self.assertEqual(Version.objects.filter(document__project=self.project).count(), 2)
+        self.assertEqual(self.project.storage_bytes, 800)
+
+    def test_force_imports_past_the_quota(self):
+        self.run_import('--force')
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.storage_bytes, 1200)
+
+
+@override_settings(DOCTRACK_PROJECT_QUOTA_BYTES=None, DOCTRACK_TEAM_QUOTA_BYTES=None)
+class StorageQuotaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('owner', password='pw')
+        self.team = Team.objects.create(name='Writers', created_by=self.user)
+        self.project = Project.objects.create(name='Manual', owner=self.user, team=self.team)
+        # 'other' has no text extractor, so uploads queue no indexing.
+        self.document = Document.objects.create(
+            name='Chapter', project=self.project, file_type='other', created_by=self.user
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def add_version(self, size):
+        return Version.objects.create(
+            document=self.document, file=ContentFile(b'x' * size, name='chapter.txt'), uploaded_by=self.user
+        )
+
+    def assertUsage(self, project_bytes, team_bytes):
+        self.project.refresh_from_db()
+        self.team.refresh_from_db()
+        self.assertEqual((self.project.storage_bytes, self.team.storage_bytes), (project_bytes, team_bytes))
+
+    def test_versions_are_counted_on_create_and_delete(self):
+        first = self.add_version(300)
+        self.add_version(200)
+        self.assertUsage(500, 500)
+
+        first.delete()
+        self.assertUsage(200, 200)
+
+        self.document.delete()
+        self.assertUsage(0, 0)
+
+    def test_stale_project_save_keeps_the_counter(self):
+        stale = Project.objects.get(pk=self.project.pk)
+        self.add_version(300)
+
+        stale.description = 'edited'
+        stale.save()
+
+        self.assertUsage(300, 300)
+
+    def test_moving_a_project_moves_its_usage(self):
+        self.add_version(300)
+        other = Team.objects.create(name='Editors', created_by=self.user)
+
+        self.project.team = other
+        self.project.save()
+
+        other.refresh_from_db()
+        self.assertUsage(300, 0)
+        self.assertEqual(other.storage_bytes, 300)
+
+    def test_upload_over_the_project_quota_is_rejected(self):
+        self.add_version(300)
+        Project.objects.filter(pk=self.project.pk).update(storage_quota=400)
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('document_upload_version', args=[self.document.pk]), {
+            'file': SimpleUploadedFile('chapter.txt', b'y' * 200),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'storage quota left')
+        self.assertEqual(self.document.versions.count(), 1)
+        self.assertUsage(300, 300)
+
+    def test_upload_over_the_team_quota_is_rejected(self):
+        Team.objects.filter(pk=self.team.pk).update(storage_quota=100)
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('document_upload_version', args=[self.document.pk]), {
+            'file': SimpleUploadedFile('chapter.txt', b'y' * 200),
+        })
+
+        self.assertContains(response, 'Team Writers')
+        self.assertFalse(self.document.versions.exists())
+
+    def test_reconcile_storage_fixes_drifted_counters(self):
+        self.add_version(300)
+        Project.objects.filter(pk=self.project.pk).update(storage_bytes=5)
+        Team.objects.filter(pk=self.team.pk).update(storage_bytes=5)
+
+        call_command('reconcile_storage', '--fix', stdout=StringIO(), stderr=StringIO())
+
+        self.assertUsage(300, 300)
+
+
+class ProjectExportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.project = Project.objects.create(name='Field Notes', owner=self.owner)
+        self.document = Document.objects.create(
+            name='Survey', project=self.project, file_type='text', created_by=self.owner
+        )
+        self.versions = [
+            Version.objects.create(
+                document=self.document, file=ContentFile(text, name='survey.txt'), uploaded_by=self.owner
+            )
+            for text in (b'first pass\n', b'second pass\n')
+        ]
+        Comment.objects.create(content='Looks right', author=self.owner, document=self.document)
+        self.url = reverse('project_export', args=[self.project.pk])
+        self.folder = f'documents/{self.document.pk}-survey'
+        self.addCleanup(terminate_process_pool, 'extract')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="field-notes-export.zip"')
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def test_export_streams_a_valid_archive(self):
+        self.client.force_login(self.owner)
+
+        with self.archive(self.client.get(self.url)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(
+                archive.namelist(), ['manifest.jsonl', f'{self.folder}/v1.txt', f'{self.folder}/v2.txt']
+            )
+            self.assertEqual(archive.read(f'{self.folder}/v2.txt'), b'second pass\n')
+            records = [json.loads(line) for line in archive.read('manifest.jsonl').splitlines()]
+
+        by_type = {}
+        for record in records:
+            by_type.setdefault(record['type'], []).append(record)
+        self.assertEqual(by_type['project'][0]['name'], 'Field Notes')
+        self.assertEqual([v['path'] for v in by_type['version']], [f'{self.folder}/v1.txt', f'{self.folder}/v2.txt'])
+        self.assertEqual(by_type['comment'][0]['content'], 'Looks right')
+        self.assertEqual([u['username'] for u in by_type['user']], ['owner'])
+
+    def test_export_with_text_adds_the_extracted_text(self):
+        self.client.force_login(self.owner)
+
+        with self.archive(self.client.get(self.url, {'text': '1'})) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            self.assertEqual(archive.read(f'text/{self.document.pk}-survey/v1.txt').strip(), b'first pass')
+            versions = [
+                record for record in map(json.loads, archive.read('manifest.jsonl').splitlines())
+                if record['type'] == 'version'
+            ]
+
+        # A .txt version's text doesn't collide with the version itself.
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(
+            sorted(names[1:]), sorted([v['path'] for v in versions] + [v['text_path'] for v in versions])
+        )
+
+    async def test_asgi_export_streams_asynchronously(self):
+        await self.async_client.aforce_login(self.owner)
+
+        response = await self.async_client.get(self.url)
+
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertIn(f'{self.folder}/v2.txt', archive.namelist())
+
+    def test_only_project_members_can_export(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+        outsider = User.objects.create_user('outsider', password='pw')
+        self.client.force_login(outsider)
+        self.assertRedirects(self.client.get(self.url), reverse('project_list'), fetch_redirect_response=False)
+
+        self.project.collaborators.add(outsider)
+        with self.archive(self.client.get(self.url)) as archive:
+            self.assertIsNone(archive.testzip())
+
+
+class ProjectPurgeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('owner', password='pw')
+        self.team = Team.objects.create(name='Writers', created_by=self.user)
+        self.project = Project.objects.create(name='Old', owner=self.user, team=self.team)
+        self.document = Document.objects.create(
+            name='Chapter', project=self.project, file_type='other', created_by=self.user
+        )
+        self.versions = [
+            Version.objects.create(
+                document=self.document, file=ContentFile(b'x' * 100, name='chapter.txt'), uploaded_by=self.user
+            )
+            for _ in range(3)
+        ]
+        top = Comment.objects.create(content='top', author=self.user, document=self.document)
+        reply = Comment.objects.create(content='reply', author=self.user, document=self.document, parent=top)
+        Comment.objects.create(content='nested', author=self.user, document=self.document, parent=reply)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_mark_deleted_hides_the_project_and_releases_its_storage(self):
+        self.assertTrue(self.project.mark_deleted())
+
+        self.assertFalse(Project.objects.filter(pk=self.project.pk).exists())
+        self.assertTrue(Project.all_objects.filter(pk=self.project.pk).exists())
+        self.assertFalse(Document.objects.filter(pk=self.document.pk).exists())
+        self.assertTrue(Document.all_objects.filter(pk=self.document.pk).exists())
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.storage_bytes, 0)
+        # Marking twice doesn't release the storage twice.
+        self.assertFalse(self.project.mark_deleted())
+
+    def test_purge_removes_rows_and_files_in_batches(self):
+        names = [version.file.name for version in self.versions]
+        self.project.mark_deleted()
+
+        with CaptureQueriesContext(connection) as queries:
+            deleted = purge_project(self.project.pk, batch=2)
+
+        self.assertEqual(deleted['doctrack.Version'], 3)
+        self.assertEqual(deleted['doctrack.Comment'], 3)
+        self.assertEqual(deleted['doctrack.Project'], 1)
+        version_deletes = [q for q in queries if q['sql'].startswith('DELETE FROM "doctrack_version"')]
+        self.assertEqual(len(version_deletes), 2)
+        self.assertFalse(Project.all_objects.filter(pk=self.project.pk).exists())
+        self.assertFalse(Document.all_objects.filter(pk=self.document.pk).exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.storage_bytes, 0)
+
+    def test_live_projects_are_not_purged(self):
+        self.assertEqual(purge_project(self.project.pk), {})
+        self.assertEqual(self.document.versions.count(), 3)
+
+    def test_delete_view_marks_and_queues_the_purge(self):
+        self.client.force_login(self.user)
+
+        with mock.patch('doctrack.views.purger.purge_later') as purge_later, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('project_delete', args=[self.project.pk]))
+
+        self.assertEqual(response.status_code, 302)
+        purge_later.assert_called_once_with(self.project.pk)
+        self.assertFalse(Project.objects.filter(pk=self.project.pk).exists())
+
+    def test_api_delete_marks_and_queues_the_purge(self):
+        self.client.force_login(self.user)
+
+        with mock.patch('doctrack.api.purger.purge_later') as purge_later, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('api_item', args=['projects', self.project.pk]))
+
+        self.assertLess(response.status_code, 300)
+        purge_later.assert_called_once_with(self.project.pk)
+        self.assertTrue(Project.all_objects.get(pk=self.project.pk).deleted_at)
+
+    def test_purge_projects_command_finishes_interrupted_purges(self):
+        self.project.mark_deleted()
+        out = StringIO()
+
+        call_command('purge_projects', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Purged Old', out.getvalue())
+        self.assertFalse(Project.all_objects.exists())
+        self.assertFalse(Version.objects.exists())
+
+
+class AdminExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        project = Project.objects.create(name='Handbook', owner=self.admin)
+        self.documents = [
+            Document.objects.create(name=name, project=project, file_type='text', created_by=self.admin)
+            for name in ('Intro', 'Usage, "advanced"')
+        ]
+        self.url = reverse('admin:doctrack_document_changelist')
+
+    def export(self, model_admin_url=None):
+        return self.client.post(model_admin_url or self.url, {
+            'action': 'export_csv', '_selected_action': [document.pk for document in self.documents],
+        })
+
+    def test_export_streams_the_allowed_columns(self):
+        self.client.force_login(self.admin)
+
+        response = self.export()
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], DocumentAdmin.csv_fields)
+        self.assertEqual(sorted(row[1] for row in rows[1:]), ['Intro', 'Usage, "advanced"'])
+
+    def test_export_needs_the_export_permission(self):
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='view_document'))
+        self.client.force_login(staff)
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'export_csv')
+        self.assertFalse(getattr(self.export(), 'streaming', False))
+
+        staff.user_permissions.add(Permission.objects.get(codename='export_document'))
+        staff = User.objects.get(pk=staff.pk)
+        self.client.force_login(staff)
+        self.assertTrue(self.export().streaming)
+
+    def test_other_models_have_no_export(self):
+        request = RequestFactory().get('/')
+        request.user = self.admin
+
+        self.assertNotIn('export_csv', admin.site._registry[User].get_actions(request))
+        self.assertIn('export_csv', admin.site._registry[Document].get_actions(request))
+
+    def test_csv_rows_quote_values_and_read_in_chunks(self):
+        queryset = Document.objects.order_by('pk')
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(csv_rows(queryset, ['id', 'name'], chunk_size=1))
+
+        self.assertEqual(rows[0], 'id,name\r\n')
+        self.assertEqual(rows[2], f'{self.documents[1].pk},"Usage, ""advanced"""\r\n')
+        self.assertEqual(len(queries), 1)
+
+
+@override_settings(DOCTRACK_ADMIN_EXACT_COUNT_LIMIT=3)
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('counter', password='pw')
+        self.activities = [
+            Activity.objects.create(user=user, action='created', target_type='Project', target_id=n,
+                                    target_name=f'P{n}')
+            for n in range(6)
+        ]
+
+    def test_unfiltered_tables_past_the_limit_are_estimated(self):
+        self.activities[2].delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            count = EstimatedCountPaginator(Activity.objects.all(), 2).count
+
+        # MAX(id) over-counts by the deleted row instead of scanning the table.
+        self.assertEqual(count, self.activities[-1].pk - self.activities[0].pk + 1)
+        self.assertNotIn('COUNT', queries[0]['sql'])
+
+    def test_filtered_querysets_are_counted_up_to_the_limit(self):
+        paginator = EstimatedCountPaginator(Activity.objects.filter(target_id__gte=4), 2)
+        self.assertEqual(paginator.count, 2)
+
+        paginator = EstimatedCountPaginator(Activity.objects.filter(target_id__gte=1), 2)
+        self.assertEqual(paginator.count, 3)
+
+
+class StaticFilesTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        os.makedirs(os.path.join(self.root, 'css'))
+        for name in ('app.css', 'app.0123456789ab.css'):
+            path = os.path.join(self.root, 'css', name)
+            with open(path, 'w') as f:
+                f.write('body { color: #333; }\n' * 50)
+            compress(path)
+        with override_settings(STATIC_ROOT=self.root, STATIC_URL='/static/'):
+            self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('app'))
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, **headers))
+
+    def test_encodings_are_negotiated_with_their_own_etags(self):
+        plain = self.get('/static/css/app.css')
+        gzipped = self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertLess(int(gzipped['Content-Length']), int(plain['Content-Length']))
+        self.assertNotEqual(plain['ETag'], gzipped['ETag'])
+        self.assertEqual(gzipped['Vary'], 'Accept-Encoding')
+        self.assertEqual(plain['Cache-Control'], 'public, max-age=60')
+        refused = self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual(refused['ETag'], plain['ETag'])
+
+    def test_brotli_is_preferred_and_each_variant_decodes_to_the_file(self):
+        plain = b''.join(self.get('/static/css/app.css').streaming_content)
+        served = {}
+        for accept in ('gzip, deflate, br', 'br', 'gzip', 'identity'):
+            response = self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            served[accept] = response.get('Content-Encoding'), b''.join(response.streaming_content)
+
+        self.assertEqual(served['gzip, deflate, br'][0], 'br')
+        self.assertEqual(brotli.decompress(served['br'][1]), plain)
+        self.assertEqual(gzip.decompress(served['gzip'][1]), plain)
+        self.assertEqual(served['identity'], (None, plain))
+
+    def test_conditional_requests_match_the_served_encoding(self):
+        etag = self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING='gzip')['ETag']
+
+        self.assertEqual(self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING='gzip',
+                                  HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get('/static/css/app.css', HTTP_ACCEPT_ENCODING='gzip',
+                                  HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        # The gzip ETag doesn't validate the uncompressed bytes.
+        self.assertEqual(self.get('/static/css/app.css', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_hashed_names_are_immutable_and_others_pass_through(self):
+        response = self.get('/static/css/app.0123456789ab.css')
+
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.get('/static/css/missing.css').content, b'app')
+        self.assertEqual(self.get('/projects/').content, b'app')
+
+
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('measured', password='pw')
+        self.client.force_login(self.user)
+
+    def test_requests_are_logged_with_their_queries(self):
+        with self.assertLogs('doctrack.perf', 'INFO') as logs:
+            response = self.client.get(reverse('project_list'))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['url_name'], 'project_list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertIn(f'desc="{record["queries"]} queries"', response['Server-Timing'])
+
+    def test_repeated_statements_share_a_fingerprint(self):
+        recorder = QueryRecorder()
+        with record_queries(recorder):
+            for user_id in (1, 2, 3):
+                list(User.objects.filter(pk=user_id))
+            Project.objects.count()
+
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(list(recorder.duplicates().values()), [3])
+        self.assertEqual(fingerprint_sql("SELECT 1 FROM t WHERE a = 'x' AND b IN (%s, %s)"),
+                         'SELECT ? FROM t WHERE a = ? AND b IN (...)')
+
+    def test_summary_ranks_views_by_p90(self):
+        records = [
+            {'url_name': 'slow', 'total_ms': 100.0 + i, 'sql_ms': 1, 'render_ms': 1, 'queries': 40,
+             'bytes': 10, 'duplicates': {'q': 20}} for i in range(10)
+        ] + [
+            {'url_name': 'fast', 'total_ms': 5.0, 'sql_ms': 1, 'render_ms': 1, 'queries': 2,
+             'bytes': 10, 'duplicates': {}}
+        ]
+
+        summary = summarize_requests(records)
+
+        self.assertEqual([row['url_name'] for row in summary], ['slow', 'fast'])
+        self.assertEqual(summary[0]['count'], 10)
+        self.assertEqual(summary[0]['n_plus_one'], 10)
+        self.assertEqual(summary[1]['n_plus_one'], 0)
+
+
+def make_pdf(pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    count = len(pages)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        ('<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            ' '.join(f'{4 + 2 * i} 0 R' for i in range(count)), count)).encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for i, text in enumerate(pages):
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+        objects.append((
+            '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>'
+        ).encode())
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class PageWiseExtractionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'report.pdf')
+        with open(self.path, 'wb') as f:
+            f.write(make_pdf([f'Page {n} text' for n in range(1, 8)]))
+
+    def test_page_ranges_come_back_in_order(self):
+        with override_settings(DOCTRACK_PDF_PARALLEL_MIN_PAGES=2):
+            pages = pdf.extract_pages(self.path)
+
+        self.assertEqual([page['number'] for page in pages], list(range(1, 8)))
+        self.assertEqual([page['text'].strip() for page in pages], [f'Page {n} text' for n in range(1, 8)])
+
+    def test_page_range_is_clipped_to_the_document(self):
+        pages = pdf.extract_page_range(self.path, 5, 20)
+
+        self.assertEqual([page['number'] for page in pages], [6, 7])
+
+
+class PageAlignmentTests(SimpleTestCase):
+    def test_unchanged_pages_are_matched_across_insertions(self):
+        old = ['intro', 'methods', 'results', 'appendix']
+        new = ['intro', 'summary', 'methods', 'results v2', 'appendix']
+
+        self.assertEqual(list(align_pages(old, new)), [
+            ('equal', 0, 0), ('added', None, 1), ('equal', 1, 2), ('changed', 2, 3), ('equal', 3, 4),
+        ])
+
+    def test_removed_pages_have_no_counterpart(self):
+        self.assertEqual(list(align_pages(['a', 'b', 'c'], ['a', 'c'])), [
+            ('equal', 0, 0), ('removed', 1, None), ('equal', 2, 1),
+        ])
+
+    def test_only_differing_pages_are_diffed(self):
+        old = [f'page {n}\nline two' for n in range(50)]
+        new = list(old)
+        new[10] = 'page 10\nline 2'
+
+        result = diff_pages_budgeted(old, new, None)
+
+        self.assertEqual(result['unchanged_pages'], 49)
+        self.assertEqual([(p['status'], p['old_page'], p['new_page']) for p in result['pages']],
+                         [('changed', 11, 11)])
+        self.assertEqual(result['stats']['lines_changed'], 1)
+        self.assertEqual(result['stats']['total_lines_v1'], 100)
+        self.assertEqual(result['stats']['similarity_percent'], 99.0)
+
+
+def make_zip(members):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+SML = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+ODF = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:meta="urn:oasis:names:tc:opendocument:xmlns:meta:1.0"'
+)
+
+
+def make_xlsx():
+    rels = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    return make_zip({
+        'xl/workbook.xml': f'<workbook {SML} xmlns:r="{rels}"><sheets>'
+                           '<sheet name="Budget" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        'xl/_rels/workbook.xml.rels': (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>'
+        ),
+        'xl/sharedStrings.xml': f'<sst {SML}><si><t>Item</t></si><si><t>Paper</t></si></sst>',
+        'xl/worksheets/sheet1.xml': (
+            f'<worksheet {SML}><sheetData>'
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="C1" t="inlineStr"><is><t>Cost</t></is></c></row>'
+            '<row r="2"><c r="A2" t="s"><v>1</v></c><c r="B2" t="b"><v>1</v></c><c r="C2"><v>12.5</v></c></row>'
+            '</sheetData></worksheet>'
+        ),
+    })
+
+
+def make_odt():
+    return make_zip({
+        'mimetype': 'application/vnd.oasis.opendocument.text',
+        'content.xml': (
+            f'<office:document-content {ODF}><office:body><office:text>'
+            '<text:h>Minutes</text:h><text:p>Two<text:s text:c="2"/>spaces<text:tab/>and a tab</text:p>'
+            '<table:table><table:table-row><table:table-cell><text:p>Who</text:p></table:table-cell>'
+            '<table:table-cell table:number-columns-repeated="2"><text:p>x</text:p></table:table-cell>'
+            '</table:table-row></table:table>'
+            '</office:text></office:body></office:document-content>'
+        ),
+        'meta.xml': f'<office:document-meta {ODF}><office:meta>'
+                    '<meta:document-statistic meta:page-count="3"/></office:meta></office:document-meta>',
+    })
+
+
+WML = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def make_word(body, header=None, footer=None, pages=None):
+    members = {'word/document.xml': f'<w:document {WML}><w:body>{body}</w:body></w:document>'}
+    if header:
+        members['word/header1.xml'] = f'<w:hdr {WML}><w:p><w:r><w:t>{header}</w:t></w:r></w:p></w:hdr>'
+    if footer:
+        members['word/footer1.xml'] = f'<w:ftr {WML}><w:p><w:r><w:t>{footer}</w:t></w:r></w:p></w:ftr>'
+    if pages:
+        members['docProps/app.xml'] = (
+            '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+            f'<Pages>{pages}</Pages></Properties>'
+        )
+    return make_zip(members)
+
+
+def paragraph(text):
+    return f'<w:p><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+
+
+def image_bytes(format):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 6), 'red').save(buffer, format)
+    return buffer.getvalue()
+
+
+class FormatDetectionTests(SimpleTestCase):
+    def detect(self, data, filename):
+        return detect_file_type(BytesIO(data), filename)
+
+    def test_magic_bytes_win_over_the_extension(self):
+        self.assertEqual(self.detect(make_pdf(['One']), 'report.txt'), 'pdf')
+        self.assertEqual(self.detect(image_bytes('PNG'), 'scan.dat'), 'image')
+        self.assertEqual(self.detect(image_bytes('JPEG'), 'scan'), 'image')
+        self.assertEqual(self.detect(image_bytes('GIF'), 'scan'), 'image')
+        self.assertEqual(self.detect(image_bytes('BMP'), 'scan'), 'image')
+        self.assertEqual(self.detect(image_bytes('WEBP'), 'scan'), 'image')
+
+    def test_zip_formats_are_told_apart_by_their_contents(self):
+        docx = make_zip({'word/document.xml': '<w:document/>'})
+        self.assertEqual(self.detect(docx, 'upload.zip'), 'word')
+        self.assertEqual(self.detect(make_xlsx(), 'upload.zip'), 'spreadsheet')
+        self.assertEqual(self.detect(make_odt(), 'upload.docx'), 'odt')
+        self.assertEqual(self.detect(make_zip({'readme.txt': 'hi'}), 'bundle.zip'), 'other')
+
+    def test_shared_prefixes_that_are_not_images_fall_back_to_the_extension(self):
+        self.assertEqual(self.detect(b'BMI,weight\n22.1,70\n', 'health.csv'), 'csv')
+        self.assertEqual(self.detect(b'BM notes\nsecond line\n', 'notes.txt'), 'text')
+        self.assertEqual(self.detect(b'BM', 'short.txt'), 'text')
+        wav = b'RIFF' + (36).to_bytes(4, 'little') + b'WAVEfmt ' + bytes(28)
+        self.assertEqual(self.detect(wav, 'sound.wav'), 'other')
+
+    def test_a_truncated_bmp_is_not_an_image(self):
+        self.assertEqual(self.detect(image_bytes('BMP')[:40], 'scan.txt'), 'text')
+
+    def test_text_formats_are_typed_by_extension(self):
+        for filename, file_type in [('a.md', 'markdown'), ('a.tsv', 'csv'), ('a.json', 'json'),
+                                    ('a.htm', 'html'), ('a.log', 'text'), ('a.xyz', 'other')]:
+            self.assertEqual(self.detect(b'plain', filename), file_type)
+
+
+class FormatExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        return path
+
+    def test_pdf(self):
+        path = self.write('a.pdf', make_pdf(['First page', 'Second page']))
+        handler = get_handler('pdf')
+
+        self.assertEqual(handler.extract_text(path).split(), ['First', 'page', 'Second', 'page'])
+        self.assertEqual(handler.metadata(path), {'pages': 2})
+
+    def test_spreadsheet_rows_keep_their_columns(self):
+        path = self.write('a.xlsx', make_xlsx())
+        handler = get_handler('spreadsheet')
+
+        self.assertEqual(handler.extract_text(path), '[Budget]\nItem\t\tCost\nPaper\tTRUE\t12.5')
+        self.assertEqual(handler.metadata(path), {'sheets': 1, 'sheet_names': ['Budget']})
+
+    def test_odt_paragraphs_and_tables(self):
+        path = self.write('a.odt', make_odt())
+        handler = get_handler('odt')
+
+        self.assertEqual(handler.extract_text(path), 'Minutes\nTwo  spaces\tand a tab\nWho\tx\tx')
+        self.assertEqual(handler.metadata(path), {'pages': 3})
+
+    def test_docx_tables_headers_and_footers(self):
+        table = '<w:tbl>' + ''.join(
+            '<w:tr>' + ''.join(f'<w:tc>{paragraph(cell)}</w:tc>' for cell in row) + '</w:tr>'
+            for row in (('Name', 'Role'), ('Ada', 'Author'))
+        ) + '</w:tbl>'
+        body = paragraph('Intro') + '<w:p><w:r><w:t>a</w:t><w:tab/><w:t>b</w:t></w:r></w:p>' + table
+        path = self.write('a.docx', make_word(body, header='Confidential', footer='Footer'))
+
+        self.assertEqual(
+            get_handler('word').extract_text(path), 'Confidential\nIntro\na\tb\nName\tRole\nAda\tAuthor\nFooter'
+        )
+
+    def test_docx_page_count(self):
+        page_break = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        section_break = '<w:p><w:pPr><w:sectPr/></w:pPr></w:p>'
+        body = paragraph('one') + page_break + paragraph('two') + section_break + paragraph('three')
+        handler = get_handler('word')
+
+        self.assertEqual(handler.metadata(self.write('a.docx', make_word(paragraph('short')))), {'pages': 1})
+        self.assertEqual(handler.metadata(self.write('b.docx', make_word(body))), {'pages': 3})
+        # A page count saved by Word is trusted over the breaks.
+        self.assertEqual(handler.metadata(self.write('c.docx', make_word(body, pages=7))), {'pages': 7})
+
+    def test_malformed_docx_reports_an_error(self):
+        path = self.write('a.docx', b'PK\x03\x04 not really a zip')
+        handler = get_handler('word')
+
+        self.assertTrue(handler.extract_text(path).startswith('Error extracting Word text'))
+        self.assertEqual(handler.metadata(path), {'pages': 0})
+        self.assertIsNone(handler.preview(path, (100, 100)))
+
+    def test_benchmark_docx_round_trips(self):
+        lines = ['Section 1', 'Terms & conditions <apply>.']
+        path = self.write('a.docx', make_file('word', lines)[1])
+
+        self.assertEqual(get_handler('word').extract_text(path), '\n'.join(lines))
+
+    def test_broken_archives_report_an_error_instead_of_raising(self):
+        path = self.write('a.xlsx', b'PK\x03\x04 not really a zip')
+
+        self.assertTrue(get_handler('spreadsheet').extract_text(path).startswith('Error extracting'))
+        self.assertEqual(get_handler('odt').metadata(path), {})
+
+    def test_text_and_markdown(self):
+        path = self.write('a.md', '# Title\r\nbody\n## Part\n')
+
+        self.assertEqual(get_handler('text').extract_text(path), '# Title\nbody\n## Part')
+        self.assertEqual(get_handler('markdown').metadata(path), {'lines': 3, 'headings': 2})
+
+    def test_latin1_text_is_decoded(self):
+        path = self.write('a.txt', 'café'.encode('latin-1'))
+        self.assertEqual(get_handler('text').extract_text(path), 'café')
+
+    def test_csv_delimiters_are_normalised_to_tabs(self):
+        path = self.write('a.csv', 'name;size\n"a;b";3\n')
+        handler = get_handler('csv')
+
+        self.assertEqual(handler.extract_text(path), 'name\tsize\na;b\t3')
+        self.assertEqual(handler.metadata(path), {'rows': 2, 'columns': 2})
+
+    def test_json_is_reindented_and_invalid_json_kept_as_text(self):
+        handler = get_handler('json')
+
+        self.assertEqual(handler.extract_text(self.write('a.json', '{"a": [1]}')), '{\n  "a": [\n    1\n  ]\n}')
+        self.assertEqual(handler.extract_text(self.write('b.json', '{oops')), '{oops')
+        self.assertEqual(handler.metadata(self.write('c.json', '[1, 2, 3]')), {'items': 3})
+
+    def test_html_keeps_visible_text_by_block(self):
+        path = self.write('a.html', (
+            '<html><head><title> The  Page </title><style>p {}</style></head>'
+            '<body><h1>Heading</h1><p>Some <b>bold</b> text</p><script>var x;</script><ul><li>one</li></ul>'
+            '</body></html>'
+        ))
+        handler = get_handler('html')
+
+        self.assertEqual(handler.extract_text(path), 'Heading\nSome bold text\none')
+        self.assertEqual(handler.metadata(path), {'title': 'The Page'})
+
+    def test_image_metadata_and_preview(self):
+        path = self.write('a.png', image_bytes('PNG'))
+        handler = get_handler('image')
+
+        self.assertIsNone(handler.extract_text(path))
+        self.assertEqual(handler.metadata(path), {'width': 8, 'height': 6})
+        self.assertEqual(handler.preview(path, (4, 4)).size, (4, 3))
+
+
+class MinHashTests(SimpleTestCase):
+    def test_signature_agreement_estimates_jaccard_similarity(self):
+        common = set(range(800))
+        first = minhash(common | set(range(10000, 10200)), 128).tobytes()
+        second = minhash(common | set(range(20000, 20200)), 128).tobytes()
+
+        # True Jaccard similarity is 800 / 1200.
+        self.assertAlmostEqual(estimate_similarity(first, second), 2 / 3, delta=0.15)
+        self.assertEqual(estimate_similarity(first, first), 1.0)
+
+    def test_shingles_ignore_case_and_punctuation(self):
+        self.assertEqual(shingles('The quick, brown fox!', 2), shingles('the QUICK brown   fox', 2))
+        self.assertEqual(len(shingles('one two three four', 2)), 3)
+        self.assertEqual(shingles('', 2), set())
+
+    def test_bands_bucket_identical_rows_together_within_a_band_only(self):
+        signature = minhash(set(range(100)), 16).tobytes()
+        changed = bytearray(signature)
+        changed[0] ^= 1
+
+        buckets, changed_buckets = band_buckets(signature, 4), band_buckets(bytes(changed), 4)
+
+        self.assertNotEqual(buckets[0], changed_buckets[0])
+        self.assertEqual(buckets[1:], changed_buckets[1:])
+        # Equal rows in different bands still land in different buckets.
+        repeated = bytes(4) * 16
+        self.assertEqual(len(set(band_buckets(repeated, 4))), 4)
+
+
+class SimilarDocumentsTests(TestCase):
+    TEXT = ' '.join(f'clause {n} of the supply agreement covers delivery' for n in range(40))
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('reader', password='pw')
+        self.project = Project.objects.create(name='Contracts', owner=self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def document(self, name, text, project=None):
+        document = Document.objects.create(
+            name=name, project=project or self.project, file_type='text', created_by=self.user
+        )
+        version = Version.objects.create(
+            document=document, file=ContentFile(text.encode(), name=f'{name}.txt'), uploaded_by=self.user
+        )
+        hashes = shingles(text, 5)
+        save_signature(version, minhash(hashes, 128).tobytes(), len(hashes))
+        return document
+
+    def test_near_duplicates_the_user_can_see_are_found(self):
+        original = self.document('Original', self.TEXT)
+        copy = self.document('Copy', self.TEXT.replace('clause 39', 'clause 40'))
+        self.document('Unrelated', ' '.join(f'meeting minutes item {n} action owner' for n in range(40)))
+        hidden_project = Project.objects.create(name='Hidden', owner=User.objects.create_user('other'))
+        self.document('Hidden copy', self.TEXT, hidden_project)
+
+        matches = similar_documents(original, self.user)
+
+        self.assertEqual([version.document for _, version in matches], [copy])
+        self.assertGreaterEqual(matches[0][0], 80)
+
+
+@override_settings(DOCTRACK_COMPARE_CACHE='default')
+class BenchCommandTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(terminate_process_pool, 'default')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def bench(self, *args):
+        output = os.path.join(self.media_root, 'report.json')
+        call_command('bench', '--iterations', '1', '--output', output, *args, stdout=StringIO(), stderr=StringIO())
+        with open(output) as f:
+            return json.load(f)
+
+    def comparisons(self):
+        return {key[0]: value for key, value in COMPARISONS.samples()}
+
+    def test_views_need_seeded_data(self):
+        with self.assertRaisesMessage(CommandError, 'seed_bench'):
+            self.bench('--only', 'dashboard')
+
+    def test_compare_view_is_timed_cold_and_cached(self):
+        call_command(
+            'seed_bench', '--users', '2', '--teams', '1', '--projects', '1', '--documents', '2',
+            '--versions', '2', '--lines', '20', stdout=StringIO(),
+        )
+        before = self.comparisons()
+
+        report = self.bench('--only', 'document_compare')
+
+        self.assertEqual(set(report), {'environment', 'results'})
+        self.assertEqual(set(report['results']), {'view.document_compare', 'view.document_compare.cached'})
+        for result in report['results'].values():
+            self.assertEqual(result['iterations'], 1)
+            self.assertLessEqual(result['min_ms'], result['median_ms'])
+        after = self.comparisons()
+        # Warm-up plus one timed request each.
+        self.assertEqual(after.get('computed', 0) - before.get('computed', 0), 2)
+        self.assertEqual(after.get('cached', 0) - before.get('cached', 0), 2)
+
+    def test_baseline_regressions_fail_the_run(self):
+        baseline = os.path.join(self.media_root, 'baseline.json')
+        self.bench('--skip-views', '--only', 'text_diff', '--baseline', baseline, '--save-baseline')
+        with open(baseline) as f:
+            saved = json.load(f)
+        self.assertEqual(list(saved['results']), ['func.comparison.text_diff'])
+
+        self.assertEqual(self.bench('--skip-views', '--only', 'text_diff', '--baseline', baseline,
+                                    '--threshold', '1000')['regressions'], [])
+
+        saved['results']['func.comparison.text_diff']['median_ms'] = 1e-6
+        with open(baseline, 'w') as f:
+            json.dump(saved, f)
+        with self.assertRaisesMessage(CommandError, 'func.comparison.text_diff'):
+            self.bench('--skip-views', '--only', 'text_diff', '--baseline', baseline)
+
+
+class BenchDiffCommandTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def bench_diff(self, *args):
+        output = os.path.join(self.directory, 'report.json')
+        call_command(
+            'bench_diff', '--sizes', '10', '--edit-rates', '0.1', '--repeat', '1', '--timeout', '0',
+            '--functions', 'side_by_side_diff', 'get_diff_stats', '--output', output, *args,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        with open(output) as f:
+            return json.load(f)
+
+    def test_report_shape_and_golden_digests(self):
+        golden = os.path.join(self.directory, 'golden.json')
+
+        report = self.bench_diff('--record-golden', golden)
+
+        self.assertEqual(report['engine'], 'doctrack.utils.comparison')
+        self.assertEqual((report['failures'], report['errors']), ([], []))
+        self.assertIn('get_diff_stats.edit0.1_10', report['results'])
+        self.assertEqual(
+            set(report['results']['side_by_side_diff.empty_left']), {'median_ms', 'p90_ms', 'min_ms', 'peak_kb'}
+        )
+        self.assertEqual(self.bench_diff('--verify-golden', golden)['failures'], [])
+
+    def test_baseline_regressions_fail_the_run(self):
+        baseline = os.path.join(self.directory, 'baseline.json')
+        report = self.bench_diff()
+        with open(baseline, 'w') as f:
+            json.dump(report, f)
+
+        self.assertEqual(self.bench_diff('--baseline', baseline, '--threshold', '1000')['regressions'], [])
+
+        for result in report['results'].values():
+            result['median_ms'] = 1e-6
+        with open(baseline, 'w') as f:
+            json.dump(report, f)
+        with self.assertRaisesMessage(CommandError, 'timing regression'):
+            self.bench_diff('--baseline', baseline)
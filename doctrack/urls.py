@@ -1,6 +1,6 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import views, api
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -15,7 +15,9 @@ urlpatterns = [
     path('projects/', views.project_list, name='project_list'),
     path('projects/create/', views.project_create, name='project_create'),
     path('projects/<int:pk>/', views.project_detail, name='project_detail'),
+    path('projects/<int:pk>/export/', views.project_export, name='project_export'),
     path('projects/<int:pk>/settings/', views.project_settings, name='project_settings'),
+    path('projects/<int:pk>/delete/', views.project_delete, name='project_delete'),
     path('projects/<int:pk>/add-collaborator/', views.project_add_collaborator, name='project_add_collaborator'),
     path('projects/<int:pk>/remove-collaborator/<int:user_id>/', views.project_remove_collaborator, name='project_remove_collaborator'),
     path('projects/<int:project_pk>/upload/', views.document_upload, name='document_upload'),
@@ -25,6 +27,9 @@ urlpatterns = [
     path('documents/<int:pk>/', views.document_detail, name='document_detail'),
     path('documents/<int:pk>/upload-version/', views.document_upload_version, name='document_upload_version'),
     path('documents/<int:pk>/compare/', views.document_compare, name='document_compare'),
+    path('versions/<int:pk>/rendition/<slug:size>.<slug:fmt>', views.version_rendition, name='version_rendition'),
+    path('versions/<int:pk>/heatmap/<int:base_pk>/<int:width>x<int:height>.png', views.version_heatmap,
+         name='version_heatmap'),
     path('documents/<int:document_pk>/pull-request/create/', views.pull_request_create, name='pull_request_create'),
     
     path('pull-requests/', views.pull_request_list, name='pull_request_list'),
@@ -41,4 +46,11 @@ urlpatterns = [
     path('teams/<int:pk>/', views.team_detail, name='team_detail'),
     
     path('comments/add/', views.add_comment, name='add_comment'),
+    
+    path('api/batch/', api.api_batch, name='api_batch'),
+    path('api/<slug:resource>/', api.api_collection, name='api_collection'),
+    path('api/<slug:resource>/<int:pk>/', api.api_item, name='api_item'),
+    
+    path('performance/', views.performance_summary, name='performance_summary'),
+    path('metrics', views.metrics, name='metrics'),
 ]
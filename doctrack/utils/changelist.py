@@ -0,0 +1,82 @@
+"""
+Helpers for admin changelists over large tables.
+
+``EstimatedCountPaginator`` avoids an exact ``COUNT(*)`` over a whole table:
+an unfiltered changelist is counted from the database's own statistics, and
+a filtered one is counted up to ``DOCTRACK_ADMIN_EXACT_COUNT_LIMIT`` rows, so
+pages past that limit are reached by narrowing the filter. ``csv_rows``
+streams a queryset as CSV lines without holding the result set in memory.
+"""
+import csv
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def exact_count_limit():
+    return getattr(settings, 'DOCTRACK_ADMIN_EXACT_COUNT_LIMIT', 10000)
+
+
+def csv_chunk_size():
+    return getattr(settings, 'DOCTRACK_ADMIN_CSV_CHUNK_SIZE', 2000)
+
+
+def estimated_row_count(model, using='default'):
+    """Approximate number of rows in ``model``'s table, or None if the backend can't tell cheaply."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [table]
+            )
+        elif connection.vendor == 'sqlite' and model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):
+            # An integer primary key is the rowid; its maximum is read from the
+            # b-tree without a scan and only overcounts by the rows deleted.
+            cursor.execute(f'SELECT MAX({connection.ops.quote_name(model._meta.pk.column)}) FROM '
+                           f'{connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    value = row[0] if row else None
+    if value is None:
+        # MAX() of an empty table; the others have no statistics yet.
+        return 0 if connection.vendor == 'sqlite' else None
+    return int(value) if value >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = exact_count_limit()
+        if not _is_filtered(queryset):
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+
+def _is_filtered(queryset):
+    # Compare against the default manager, which may filter on its own.
+    return str(queryset.query.where) != str(queryset.model._default_manager.all().query.where)
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back to ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+def csv_rows(queryset, fields, chunk_size=None):
+    """Yield a header line and one CSV line per row of ``queryset``."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size or csv_chunk_size()):
+        yield writer.writerow(row)
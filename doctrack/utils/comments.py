@@ -0,0 +1,59 @@
+"""
+Threaded comment loading.
+
+A page of top-level comments is fetched first, then every reply in those
+threads with a single query on ``Comment.root``, and the tree is assembled in
+Python. The number of queries is the same however many comments there are and
+however deeply they nest.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+
+from ..models import Comment
+
+
+def build_tree(roots, replies):
+    """
+    Attach ``replies`` (any order) beneath ``roots``. Every comment gets a
+    ``children`` list in posting order and a ``depth``; runs in O(n).
+    """
+    by_id = {}
+    for comment in roots:
+        comment.children = []
+        comment.depth = 0
+        by_id[comment.pk] = comment
+    for comment in replies:
+        comment.children = []
+        by_id[comment.pk] = comment
+    for comment in sorted(replies, key=lambda c: (c.created_at, c.pk)):
+        parent = by_id.get(comment.parent_id)
+        if parent is not None:
+            parent.children.append(comment)
+    # Depth needs parents before children, which posting order doesn't
+    # guarantee after imports; walk down from the roots instead.
+    stack = list(roots)
+    while stack:
+        comment = stack.pop()
+        for child in comment.children:
+            child.depth = comment.depth + 1
+            stack.append(child)
+    return roots
+
+
+def comment_threads(target, page=None, per_page=None):
+    """
+    A ``Page`` of the top-level comments on ``target`` (a document, pull
+    request or work item), newest first, with their threads attached as
+    ``children``.
+    """
+    per_page = per_page or getattr(settings, 'DOCTRACK_COMMENT_THREADS_PER_PAGE', 20)
+    roots = target.comments.filter(parent__isnull=True).select_related('author').order_by('-created_at', '-pk')
+    threads = Paginator(roots, per_page).get_page(page)
+    roots = list(threads.object_list)
+    # reply_count lets a page of unanswered comments skip the replies query.
+    with_replies = [c.pk for c in roots if c.reply_count]
+    replies = []
+    if with_replies:
+        replies = list(Comment.objects.filter(root__in=with_replies).select_related('author'))
+    threads.object_list = build_tree(roots, replies)
+    return threads
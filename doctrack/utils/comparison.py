@@ -2,7 +2,12 @@
 Document comparison and diff utilities.
 """
 import difflib
+import hashlib
 from .file_handlers import extract_text_content, get_file_type
+from .handlers import get_handler
+from .handlers.base import EXPENSIVE
+from .metrics import DIFF_TIME, DIFF_LINES, EXTRACTION_TIME
+from .workers import cpu_time_limit, result_within, submit_to_process, CPUBudgetExceeded, JobTimeout
 
 
 def text_diff(text1, text2):
@@ -96,20 +101,193 @@ def compare_documents(file_path1, file_path2, file_type):
             'can_compare': False
         }
     
-    return {
-        'can_compare': True,
-        'text_diff': text_diff(text1, text2),
-        'side_by_side': side_by_side_diff(text1, text2),
-        'html_diff': html_diff(text1, text2),
-        'stats': get_diff_stats(text1, text2)
+    with DIFF_TIME.time():
+        result = {
+            'can_compare': True,
+            'text_diff': text_diff(text1, text2),
+            'side_by_side': side_by_side_diff(text1, text2),
+            'html_diff': html_diff(text1, text2),
+            'stats': get_diff_stats(text1, text2)
+        }
+    
+    _observe_diff_lines(result['stats'])
+    return result
+
+
+def compare_documents_budgeted(file_path1, file_path2, file_type, budget):
+    """
+    Like ``compare_documents``, but extraction and diffing run in the worker
+    pools and the diff stops after ``budget`` seconds of CPU time. Called from
+    a scheduler thread, which blocks until both stages finish; a stage that
+    outlives ``DOCTRACK_WORKER_TIMEOUT`` raises ``JobTimeout``.
+    """
+    handler = get_handler(file_type)
+    if handler is None:
+        return {'error': 'Cannot extract text from one or both files', 'can_compare': False}
+
+    if hasattr(handler, 'diff'):
+        # Formats without text (images) compare their own way, in a worker.
+        return result_within(submit_to_process(handler.diff, file_path1, file_path2, budget, queue='compare'))
+
+    if hasattr(handler, 'extract_pages'):
+        # Paged formats fan their page ranges out to the extraction pool themselves.
+        try:
+            with EXTRACTION_TIME.time(file_type=file_type):
+                pages1 = [page['text'] for page in handler.extract_pages(file_path1)]
+                pages2 = [page['text'] for page in handler.extract_pages(file_path2)]
+        except JobTimeout:
+            raise
+        except Exception as e:
+            return {'error': f'Error extracting text: {e}', 'can_compare': False}
+        return result_within(submit_to_process(diff_pages_budgeted, pages1, pages2, budget, queue='compare'))
+
+    if handler.cost == EXPENSIVE:
+        futures = [
+            submit_to_process(extract_text_content, path, file_type, queue='extract', pool='extract')
+            for path in (file_path1, file_path2)
+        ]
+        text1, text2 = (result_within(future, pool='extract') for future in futures)
+    else:
+        # Cheap formats cost less to parse here than to ship to a worker.
+        text1 = extract_text_content(file_path1, file_type)
+        text2 = extract_text_content(file_path2, file_type)
+    if text1 is None or text2 is None:
+        return {
+            'error': 'Cannot extract text from one or both files',
+            'can_compare': False
+        }
+    return result_within(submit_to_process(diff_texts_budgeted, text1, text2, budget, queue='compare'))
+
+
+def diff_texts_budgeted(text1, text2, budget):
+    """
+    Diff two texts until ``budget`` seconds of CPU time are used. Cheap parts
+    run first, so an exhausted budget still returns the stats and whatever
+    diffs finished, with ``partial`` set.
+    """
+    result = {'can_compare': True, 'partial': False}
+    try:
+        with cpu_time_limit(budget):
+            with DIFF_TIME.time():
+                result['stats'] = get_diff_stats(text1, text2)
+                result['side_by_side'] = side_by_side_diff(text1, text2)
+                result['text_diff'] = text_diff(text1, text2)
+                result['html_diff'] = html_diff(text1, text2)
+    except CPUBudgetExceeded:
+        if 'stats' not in result:
+            return {
+                'error': f'Comparison exceeded its {budget} second CPU budget.',
+                'can_compare': False
+            }
+        result['partial'] = True
+    _observe_diff_lines(result['stats'])
+    return result
+
+
+def page_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def align_pages(pages1, pages2):
+    """
+    Align two lists of page texts by content hash. Yields ``(status, i, j)``
+    with status ``equal``, ``changed``, ``added`` or ``removed`` and page
+    indexes (``None`` on the side a page is missing from), in document order.
+    """
+    matcher = difflib.SequenceMatcher(
+        None, [page_hash(p) for p in pages1], [page_hash(p) for p in pages2], autojunk=False
+    )
+    for opcode, i1, i2, j1, j2 in matcher.get_opcodes():
+        if opcode == 'equal':
+            for offset in range(i2 - i1):
+                yield 'equal', i1 + offset, j1 + offset
+            continue
+        # Pages in a replaced block are paired in order; the longer side's
+        # leftovers are whole-page insertions or removals.
+        paired = min(i2 - i1, j2 - j1)
+        for offset in range(paired):
+            yield 'changed', i1 + offset, j1 + offset
+        for i in range(i1 + paired, i2):
+            yield 'removed', i, None
+        for j in range(j1 + paired, j2):
+            yield 'added', None, j
+
+
+def diff_pages_budgeted(pages1, pages2, budget):
+    """
+    Page-aware counterpart of ``diff_texts_budgeted``: pages with identical
+    text are skipped and only the pages that differ are line-diffed, so the
+    work and the result scale with the edit rather than the document.
+    """
+    result = {'can_compare': True, 'partial': False, 'mode': 'pages', 'pages': [], 'unchanged_pages': 0}
+    lines1 = [page.splitlines() for page in pages1]
+    lines2 = [page.splitlines() for page in pages2]
+    matched = 0
+    try:
+        with cpu_time_limit(budget):
+            with DIFF_TIME.time():
+                for status, i, j in align_pages(pages1, pages2):
+                    if status == 'equal':
+                        result['unchanged_pages'] += 1
+                        matched += len(lines1[i])
+                        continue
+                    result['pages'].append({
+                        'status': status,
+                        'old_page': i + 1 if i is not None else None,
+                        'new_page': j + 1 if j is not None else None,
+                    })
+
+                for page in result['pages']:
+                    old = lines1[page['old_page'] - 1] if page['old_page'] else []
+                    new = lines2[page['new_page'] - 1] if page['new_page'] else []
+                    page['stats'], page_matched = _line_stats(old, new)
+                    matched += page_matched
+
+                # Rows come last and are the part an exhausted budget drops.
+                for page in result['pages']:
+                    old = pages1[page['old_page'] - 1] if page['old_page'] else ''
+                    new = pages2[page['new_page'] - 1] if page['new_page'] else ''
+                    page['side_by_side'] = side_by_side_diff(old, new)
+    except CPUBudgetExceeded:
+        if any('stats' not in page for page in result['pages']):
+            return {
+                'error': f'Comparison exceeded its {budget} second CPU budget.',
+                'can_compare': False
+            }
+        result['partial'] = True
+
+    total1 = sum(len(lines) for lines in lines1)
+    total2 = sum(len(lines) for lines in lines2)
+    page_stats = [page['stats'] for page in result['pages']]
+    result['stats'] = {
+        'lines_added': sum(s['lines_added'] for s in page_stats),
+        'lines_removed': sum(s['lines_removed'] for s in page_stats),
+        'lines_changed': sum(s['lines_changed'] for s in page_stats),
+        'similarity_percent': round(200.0 * matched / (total1 + total2), 1) if total1 + total2 else 100.0,
+        'total_lines_v1': total1,
+        'total_lines_v2': total2,
+        'total_pages_v1': len(pages1),
+        'total_pages_v2': len(pages2),
     }
+    _observe_diff_lines(result['stats'])
+    return result
+
+
+def _observe_diff_lines(stats):
+    DIFF_LINES.observe(stats['lines_added'], kind='added')
+    DIFF_LINES.observe(stats['lines_removed'], kind='removed')
+    DIFF_LINES.observe(stats['lines_changed'], kind='changed')
 
 
 def get_diff_stats(text1, text2):
     """Calculate statistics about the differences."""
     lines1 = text1.splitlines() if text1 else []
     lines2 = text2.splitlines() if text2 else []
-    
+    return _line_stats(lines1, lines2)[0]
+
+
+def _line_stats(lines1, lines2):
+    """``get_diff_stats`` for pre-split lines, plus the number of matching lines."""
     matcher = difflib.SequenceMatcher(None, lines1, lines2)
     
     added = 0
@@ -125,6 +303,7 @@ def get_diff_stats(text1, text2):
             changed += max(i2 - i1, j2 - j1)
     
     similarity = matcher.ratio() * 100
+    matched = sum(block.size for block in matcher.get_matching_blocks())
     
     return {
         'lines_added': added,
@@ -133,4 +312,4 @@ def get_diff_stats(text1, text2):
         'similarity_percent': round(similarity, 1),
         'total_lines_v1': len(lines1),
         'total_lines_v2': len(lines2)
-    }
+    }, matched
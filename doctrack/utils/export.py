@@ -0,0 +1,202 @@
+"""
+Streaming project export.
+
+``export_project`` yields a zip archive of a project chunk by chunk: a
+``manifest.jsonl`` with one record per project, document, version, pull
+request, reviewer, review, work item, comment, activity and user, then every
+version's file under ``documents/`` and, optionally, its extracted text under
+``text/``. The zip is written to a buffer that is drained after each chunk, so
+memory use does not grow with the size of the project and nothing is written
+to disk.
+"""
+import json
+import zipfile
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils.text import slugify
+
+from ..models import Project, Document, Version, PullRequest, Review, WorkItem, Comment, Activity
+from .file_handlers import extract_text_content
+from .handlers.base import FormatHandler
+from .handlers import get_handler_class
+from .workers import submit_to_process, pool_size
+
+CHUNK_SIZE = 64 * 1024
+QUERY_CHUNK = 2000
+# Formats that are already compressed are stored rather than deflated again.
+STORED_EXTENSIONS = {'pdf', 'docx', 'xlsx', 'odt', 'png', 'jpg', 'jpeg', 'gif', 'webp', 'zip'}
+
+
+class _StreamBuffer:
+    """Write-only file for ``ZipFile``; it has no ``tell``, so entries are written with data descriptors."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+
+def version_path(version, document_name):
+    ext = version.file.name.rsplit('.', 1)[-1].lower() if '.' in version.file.name else 'bin'
+    folder = f'{version.document_id}-{slugify(document_name) or "document"}'
+    return f'documents/{folder}/v{version.version_number}.{ext}'
+
+
+def text_path(version, document_name):
+    # Under text/ rather than beside the file, which may well be a .txt itself.
+    path = version_path(version, document_name).split('/', 1)[1]
+    return 'text/' + path.rsplit('.', 1)[0] + '.txt'
+
+
+def _has_text(file_type):
+    cls = get_handler_class(file_type)
+    return cls is not None and cls.extract_text is not FormatHandler.extract_text
+
+
+def _manifest_querysets(project):
+    """``(record type, rows, user reference fields)`` for everything in the manifest, in order."""
+    comments = Comment.objects.filter(
+        Q(document__project=project) | Q(pull_request__project=project) | Q(work_item__project=project)
+    )
+    return [
+        ('document', Document.objects.filter(project=project), ('created_by',)),
+        ('version', Version.objects.filter(document__project=project), ('uploaded_by',)),
+        ('pull_request', PullRequest.objects.filter(project=project), ('created_by', 'merged_by')),
+        ('pull_request_reviewer', PullRequest.reviewers.through.objects.filter(pullrequest__project=project), ('user',)),
+        ('review', Review.objects.filter(pull_request__project=project), ('reviewer',)),
+        ('work_item', WorkItem.objects.filter(project=project), ('created_by', 'assigned_to')),
+        ('comment', comments, ('author',)),
+        ('activity', Activity.objects.filter(project=project), ('user',)),
+    ]
+
+
+def _versions(project):
+    return (
+        Version.objects.filter(document__project=project)
+        .select_related('document').order_by('document_id', 'version_number')
+    )
+
+
+def export_project(project, include_text=False):
+    """Yield the export archive of ``project`` as a sequence of byte strings."""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        with archive.open('manifest.jsonl', 'w', force_zip64=True) as manifest:
+            for record in manifest_records(project, include_text):
+                manifest.write(json.dumps(record, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+                if buffer.size >= CHUNK_SIZE:
+                    yield buffer.drain()
+        yield buffer.drain()
+
+        for version, text in _with_text(_versions(project).iterator(QUERY_CHUNK), include_text):
+            if not version.file:
+                continue
+            path = version_path(version, version.document.name)
+            info = zipfile.ZipInfo(path, date_time=version.created_at.timetuple()[:6])
+            info.compress_type = (
+                zipfile.ZIP_STORED if path.rsplit('.', 1)[-1] in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            )
+            try:
+                source = version.file.open('rb')
+            except FileNotFoundError:
+                continue
+            # Declaring the size lets zipfile pick zip64 for files over 4 GB.
+            info.file_size = version.file.size
+            with source, archive.open(info, 'w') as entry:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            if text is not None:
+                archive.writestr(text_path(version, version.document.name), text)
+                yield buffer.drain()
+    yield buffer.drain()
+
+
+def _with_text(versions, include_text):
+    """
+    ``(version, extracted text or None)`` pairs in order. Extraction runs in
+    the extraction pool a bounded number of versions ahead.
+    """
+    if not include_text:
+        for version in versions:
+            yield version, None
+        return
+    pending = deque()
+    for version in versions:
+        future = None
+        if version.file and _has_text(version.document.file_type):
+            future = submit_to_process(
+                extract_text_content, version.file.path, version.document.file_type,
+                queue='export', pool='extract',
+            )
+        pending.append((version, future))
+        if len(pending) > pool_size('extract'):
+            yield _resolve(*pending.popleft())
+    while pending:
+        yield _resolve(*pending.popleft())
+
+
+def _resolve(version, future):
+    if future is None:
+        return version, None
+    try:
+        return version, future.result() or ''
+    except Exception:
+        # Still write the (empty) text file the manifest points to.
+        return version, ''
+
+
+def manifest_records(project, include_text=False):
+    users = {project.owner_id}
+    yield {'type': 'project', **Project.objects.filter(pk=project.pk).values().get()}
+    for user_id in project.collaborators.values_list('pk', flat=True):
+        users.add(user_id)
+        yield {'type': 'collaborator', 'user_id': user_id}
+
+    documents = {}
+    for record_type, rows, user_fields in _manifest_querysets(project):
+        for row in rows.order_by('pk').values().iterator(QUERY_CHUNK):
+            users.update(row[f'{field}_id'] for field in user_fields if row[f'{field}_id'])
+            if record_type == 'document':
+                documents[row['id']] = (row['name'], row['file_type'])
+            elif record_type == 'version':
+                name, file_type = documents.get(row['document_id'], ('', None))
+                version = Version(
+                    id=row['id'], document_id=row['document_id'],
+                    version_number=row['version_number'], file=row['file'],
+                )
+                row['path'] = version_path(version, name)
+                if include_text and row['file'] and _has_text(file_type):
+                    row['text_path'] = text_path(version, name)
+            yield {'type': record_type, **row}
+
+    for row in User.objects.filter(pk__in=users).order_by('pk').values('id', 'username').iterator(QUERY_CHUNK):
+        yield {'type': 'user', **row}
+
+
+
+async def aiterate(iterator):
+    """
+    Async view of a sync iterator, one item at a time. Under ASGI, Django reads
+    a sync streaming iterator into a list before sending any of it.
+    """
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item
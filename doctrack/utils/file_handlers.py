@@ -1,99 +1,80 @@
 """
 File handling utilities for different document types.
+
+Format-specific work lives in ``doctrack.utils.handlers``; the functions here
+dispatch to the registered handler classes, which are imported lazily.
 """
+import hashlib
 import os
-from io import BytesIO
-from PIL import Image
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
+
+from .handlers import get_handler, type_from_extension
+from .metrics import EXTRACTION_TIME
 
 
 def get_file_type(filename):
     """Determine file type based on extension."""
-    ext = filename.split('.')[-1].lower()
-    if ext == 'pdf':
-        return 'pdf'
-    elif ext in ['doc', 'docx']:
-        return 'word'
-    elif ext in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-        return 'image'
-    return 'other'
+    return type_from_extension(filename)
+
+
+def extract_pdf_pages(file_path):
+    """Extract a PDF page by page; see ``handlers.pdf.extract_pages``."""
+    return get_handler('pdf').extract_pages(file_path)
 
 
 def extract_pdf_text(file_path):
     """Extract text content from a PDF file."""
-    try:
-        with open(file_path, 'rb') as f:
-            reader = PdfReader(f)
-            text = []
-            for page in reader.pages:
-                text.append(page.extract_text() or '')
-            return '\n\n'.join(text)
-    except Exception as e:
-        return f"Error extracting PDF text: {str(e)}"
+    return get_handler('pdf').extract_text(file_path)
 
 
 def extract_docx_text(file_path):
-    """Extract text content from a Word document."""
-    try:
-        doc = DocxDocument(file_path)
-        text = []
-        for paragraph in doc.paragraphs:
-            text.append(paragraph.text)
-        return '\n'.join(text)
-    except Exception as e:
-        return f"Error extracting Word text: {str(e)}"
+    """Extract text content from a Word document, including tables, headers and footers."""
+    return get_handler('word').extract_text(file_path)
 
 
 def extract_text_content(file_path, file_type):
     """Extract text from various file types."""
-    if file_type == 'pdf':
-        return extract_pdf_text(file_path)
-    elif file_type == 'word':
-        return extract_docx_text(file_path)
-    return None
+    handler = get_handler(file_type)
+    if handler is None:
+        return None
+    with EXTRACTION_TIME.time(file_type=file_type):
+        return handler.extract_text(file_path)
 
 
 def get_pdf_page_count(file_path):
     """Get the number of pages in a PDF."""
-    try:
-        with open(file_path, 'rb') as f:
-            reader = PdfReader(f)
-            return len(reader.pages)
-    except Exception:
-        return 0
+    return get_handler('pdf').metadata(file_path)['pages']
 
 
 def get_docx_page_count(file_path):
     """Estimate the number of pages in a Word document."""
-    try:
-        doc = DocxDocument(file_path)
-        return max(1, len(doc.paragraphs) // 30)
-    except Exception:
-        return 0
+    return get_handler('word').metadata(file_path)['pages']
 
 
 def get_image_dimensions(file_path):
     """Get image dimensions."""
-    try:
-        with Image.open(file_path) as img:
-            return img.size
-    except Exception:
-        return (0, 0)
+    info = get_handler('image').metadata(file_path)
+    return (info['width'], info['height'])
 
 
 def create_thumbnail(file_path, file_type, max_size=(200, 200)):
-    """Create a thumbnail for image files."""
-    if file_type == 'image':
-        try:
-            with Image.open(file_path) as img:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                thumb_buffer = BytesIO()
-                img.save(thumb_buffer, format='PNG')
-                return thumb_buffer.getvalue()
-        except Exception:
-            return None
-    return None
+    """Create a thumbnail for file types whose handler supports it."""
+    handler = get_handler(file_type)
+    if handler is None:
+        return None
+    return handler.thumbnail(file_path, max_size)
+
+
+def file_digest(file):
+    """128-bit BLAKE2b hex digest of a path or a Django ``File``."""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        for chunk in file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def format_file_size(size_bytes):
@@ -111,15 +92,10 @@ def get_file_info(file_path, file_type):
         'size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
         'type': file_type,
     }
-    
-    if file_type == 'pdf':
-        info['pages'] = get_pdf_page_count(file_path)
-    elif file_type == 'word':
-        info['pages'] = get_docx_page_count(file_path)
-    elif file_type == 'image':
-        width, height = get_image_dimensions(file_path)
-        info['width'] = width
-        info['height'] = height
-    
+
+    handler = get_handler(file_type)
+    if handler is not None:
+        info.update(handler.metadata(file_path))
+
     info['size_formatted'] = format_file_size(info['size'])
     return info
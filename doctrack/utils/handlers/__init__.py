@@ -0,0 +1,122 @@
+"""
+Format handler registry.
+
+Each ``file_type`` maps to a ``FormatHandler`` subclass (see ``base``) named by
+dotted path. The class is imported the first time that type is used, so
+processes that never open a PDF or an image (``migrate``, ``collectstatic``,
+most worker boots) don't pay for PyPDF2 or Pillow.
+
+Uploads are typed by magic bytes first and by extension second, so a renamed
+file is still handled by the right parser.
+"""
+from importlib import import_module
+
+from .base import SNIFF_BYTES
+
+# file_type -> (handler class path, label, extensions, magic prefixes)
+HANDLERS = {}
+EXTENSIONS = {}
+
+_loaded = {}
+
+
+def register_handler(file_type, class_path, label=None, extensions=(), magic=()):
+    """Add or replace the handler class for ``file_type``."""
+    HANDLERS[file_type] = (class_path, label or file_type.title(), tuple(extensions), tuple(magic))
+    _loaded.pop(file_type, None)
+    for ext in extensions:
+        EXTENSIONS[ext.lower()] = file_type
+
+
+def get_handler_class(file_type):
+    entry = HANDLERS.get(file_type)
+    if entry is None:
+        return None
+    module_path, _, class_name = entry[0].rpartition('.')
+    return getattr(import_module(module_path), class_name)
+
+
+def get_handler(file_type):
+    """Return the handler instance for ``file_type``, importing it on first use, or None."""
+    handler = _loaded.get(file_type)
+    if handler is None:
+        cls = get_handler_class(file_type)
+        if cls is None:
+            return None
+        handler = _loaded[file_type] = cls()
+    return handler
+
+
+def loaded_handlers():
+    return sorted(_loaded)
+
+
+def supported_extensions():
+    return sorted(EXTENSIONS)
+
+
+def type_from_extension(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return EXTENSIONS.get(ext, 'other')
+
+
+def detect_file_type(fileobj, filename=''):
+    """
+    Type a file by its leading bytes, falling back to its extension.
+
+    Several formats share a magic prefix (zip, OLE), so every handler whose
+    prefix matches is asked to confirm with ``detect``; the type implied by the
+    extension is tried first. ``fileobj`` is left at position 0.
+    """
+    by_extension = type_from_extension(filename)
+    fileobj.seek(0)
+    head = fileobj.read(SNIFF_BYTES)
+    fileobj.seek(0)
+
+    candidates = [
+        file_type for file_type, (_, _, _, magic) in HANDLERS.items()
+        if any(head.startswith(prefix) for prefix in magic)
+    ]
+    candidates.sort(key=lambda file_type: file_type != by_extension)
+    for file_type in candidates:
+        try:
+            if get_handler_class(file_type).detect(fileobj):
+                return file_type
+        except Exception:
+            pass
+        finally:
+            fileobj.seek(0)
+
+    # Text formats have no magic bytes.
+    return by_extension
+
+
+ZIP_MAGIC = b'PK\x03\x04'
+OLE_MAGIC = b'\xd0\xcf\x11\xe0'
+
+register_handler(
+    'pdf', 'doctrack.utils.handlers.pdf.PdfHandler', 'PDF',
+    extensions=('pdf',), magic=(b'%PDF-',),
+)
+register_handler(
+    'word', 'doctrack.utils.handlers.word.WordHandler', 'Word Document',
+    extensions=('doc', 'docx'), magic=(ZIP_MAGIC, OLE_MAGIC),
+)
+register_handler(
+    'image', 'doctrack.utils.handlers.image.ImageHandler', 'Image',
+    extensions=('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'),
+    magic=(b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'BM', b'RIFF'),
+)
+register_handler(
+    'spreadsheet', 'doctrack.utils.handlers.office.XlsxHandler', 'Spreadsheet',
+    extensions=('xlsx',), magic=(ZIP_MAGIC,),
+)
+register_handler(
+    'odt', 'doctrack.utils.handlers.office.OdtHandler', 'OpenDocument Text',
+    extensions=('odt',), magic=(ZIP_MAGIC,),
+)
+register_handler('text', 'doctrack.utils.handlers.text.TextHandler', 'Text', extensions=('txt', 'log'))
+register_handler('markdown', 'doctrack.utils.handlers.text.MarkdownHandler', 'Markdown', extensions=('md', 'markdown'))
+register_handler('csv', 'doctrack.utils.handlers.text.CsvHandler', 'CSV', extensions=('csv', 'tsv'))
+register_handler('json', 'doctrack.utils.handlers.text.JsonHandler', 'JSON', extensions=('json',))
+register_handler('html', 'doctrack.utils.handlers.text.HtmlHandler', 'HTML', extensions=('html', 'htm'))
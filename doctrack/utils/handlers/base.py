@@ -0,0 +1,70 @@
+"""
+Base class for format handlers.
+"""
+import zipfile
+from io import BytesIO
+
+# Cost classes. Cheap formats are extracted inline; expensive ones are sent to
+# the extraction process pool.
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+# How much of a text file to sniff when guessing its encoding.
+SNIFF_BYTES = 64 * 1024
+
+
+class FormatHandler:
+    """
+    One document format. The defaults mean "no text", "no extra metadata" and
+    "no thumbnail"; subclasses override what their format supports.
+    """
+    file_type = None
+    cost = CHEAP
+
+    @classmethod
+    def detect(cls, fileobj):
+        """Confirm a magic-byte match by looking further into ``fileobj``."""
+        return True
+
+    def extract_text(self, file_path):
+        return None
+
+    def metadata(self, file_path):
+        """Extra ``get_file_info`` fields, e.g. pages or dimensions."""
+        return {}
+
+    def preview(self, file_path, max_size):
+        """An RGB PIL image of the document's first page, fitting ``max_size``."""
+        return None
+
+    def thumbnail(self, file_path, max_size=(200, 200)):
+        """PNG bytes of ``preview``, or None."""
+        img = self.preview(file_path, max_size)
+        if img is None:
+            return None
+        buffer = BytesIO()
+        img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def zip_contains(fileobj, member):
+    """True when ``fileobj`` is a zip archive with an entry named ``member``."""
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            return member in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def open_text(file_path):
+    """Open a text file as UTF-8 (BOM aware), falling back to Latin-1."""
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    try:
+        head.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the sniff window is still UTF-8.
+        truncated = e.reason == 'unexpected end of data' and len(head) == SNIFF_BYTES
+        encoding = 'utf-8-sig' if truncated else 'latin-1'
+    return open(file_path, encoding=encoding, errors='replace', newline='')
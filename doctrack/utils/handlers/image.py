@@ -0,0 +1,117 @@
+"""
+Image handler (Pillow): dimensions and previews, plus the text "page" previews
+other handlers draw for documents that have no picture of their own.
+"""
+import os
+import struct
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from .base import FormatHandler
+
+# Portrait page proportions for text previews.
+PAGE_RATIO = 1.414
+
+# DIB header sizes: BITMAPCOREHEADER, BITMAPINFOHEADER, its two Adobe
+# extensions, BITMAPV4HEADER and BITMAPV5HEADER.
+BMP_DIB_HEADER_SIZES = {12, 40, 52, 56, 108, 124}
+
+
+def dimensions(file_path):
+    """Get image dimensions."""
+    try:
+        with Image.open(file_path) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
+
+
+def is_bmp_header(head, size):
+    """
+    True when ``head`` (the first 18 bytes of a ``size`` byte file) is a BMP
+    file header; two bytes of ``BM`` alone also start plenty of text files.
+    """
+    if len(head) < 18:
+        return False
+    recorded_size, reserved, pixel_offset, dib_size = struct.unpack('<4I', head[2:18])
+    return (
+        recorded_size in (0, size) and reserved == 0 and dib_size in BMP_DIB_HEADER_SIZES
+        and 14 + dib_size <= pixel_offset <= size
+    )
+
+
+def to_rgb(img):
+    """Convert to RGB, flattening transparency onto white."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert('RGB')
+
+
+def fit(img, max_size):
+    img = to_rgb(img)
+    img.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return img
+
+
+def preview(file_path, max_size):
+    try:
+        with Image.open(file_path) as img:
+            # Lets JPEG decode at a reduced scale instead of full resolution.
+            img.draft('RGB', max_size)
+            return fit(ImageOps.exif_transpose(img), max_size)
+    except Exception:
+        return None
+
+
+def text_preview(lines, max_size):
+    """Draw the first lines of a document on a blank page that fits ``max_size``."""
+    height = max_size[1]
+    width = min(max_size[0], round(height / PAGE_RATIO))
+    height = round(width * PAGE_RATIO)
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    margin = max(4, width // 12)
+    font_size = max(4, width // 40)
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:
+        font = ImageFont.load_default()
+    line_height = round(font_size * 1.4)
+    y = margin
+    for line in lines:
+        if y + line_height > height - margin:
+            break
+        text = line.strip()
+        # Trim to the printable width rather than wrapping; it's a preview.
+        while text and draw.textlength(text, font=font) > width - 2 * margin:
+            text = text[:-4]
+        draw.text((margin, y), text, fill=(55, 65, 81), font=font)
+        y += line_height
+    draw.rectangle((0, 0, width - 1, height - 1), outline=(209, 213, 219))
+    return img
+
+
+class ImageHandler(FormatHandler):
+    file_type = 'image'
+
+    @classmethod
+    def detect(cls, fileobj):
+        head = fileobj.read(18)
+        if head.startswith(b'BM'):
+            return is_bmp_header(head, fileobj.seek(0, os.SEEK_END))
+        # RIFF is shared with WAV and AVI; only RIFF....WEBP is an image.
+        return not head.startswith(b'RIFF') or head[8:12] == b'WEBP'
+
+    def metadata(self, file_path):
+        width, height = dimensions(file_path)
+        return {'width': width, 'height': height}
+
+    def preview(self, file_path, max_size):
+        return preview(file_path, max_size)
+
+    def diff(self, file_path1, file_path2, budget):
+        # NumPy is only needed here, so it stays out of every other import path.
+        from ..image_diff import compare_images
+        return compare_images(file_path1, file_path2, budget)
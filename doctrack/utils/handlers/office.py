@@ -0,0 +1,198 @@
+"""
+Spreadsheet (XLSX) and OpenDocument text (ODT) handlers. Both formats are zip
+archives of XML parts, streamed with ``iterparse`` like the Word handler.
+"""
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from .base import FormatHandler, EXPENSIVE
+
+SML_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+TABLE_NS = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+META_NS = '{urn:oasis:names:tc:opendocument:xmlns:meta:1.0}'
+OFFICE_NS = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+
+ODT_MIMETYPE = b'application/vnd.oasis.opendocument.text'
+
+_CELL_REF_RE = re.compile(r'([A-Z]+)')
+
+
+def _column_index(ref):
+    """Zero-based column of a cell reference such as ``AB12``."""
+    match = _CELL_REF_RE.match(ref or '')
+    if not match:
+        return None
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as stream:
+        for _, element in ElementTree.iterparse(stream):
+            if element.tag == f'{SML_NS}si':
+                strings.append(''.join(t.text or '' for t in element.iter(f'{SML_NS}t')))
+                element.clear()
+    return strings
+
+
+def _sheets(archive):
+    """``(name, part path)`` for each worksheet, in workbook order."""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{PKG_REL_NS}Relationship')}
+    sheets = []
+    for sheet in workbook.iter(f'{SML_NS}sheet'):
+        target = targets.get(sheet.get(f'{REL_NS}id'), '')
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        sheets.append((sheet.get('name'), path))
+    return sheets
+
+
+def _cell_value(cell, strings):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(f'{SML_NS}t'))
+    value = cell.findtext(f'{SML_NS}v') or ''
+    if kind == 's' and value.isdigit():
+        index = int(value)
+        return strings[index] if index < len(strings) else ''
+    if kind == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    return value
+
+
+def iter_xlsx(file_path):
+    """Yield a ``[Sheet name]`` line per sheet, then one tab-separated line per row."""
+    with zipfile.ZipFile(file_path) as archive:
+        strings = _shared_strings(archive)
+        for name, path in _sheets(archive):
+            yield f'[{name}]'
+            with archive.open(path) as stream:
+                for _, element in ElementTree.iterparse(stream):
+                    if element.tag != f'{SML_NS}row':
+                        continue
+                    cells = []
+                    for cell in element.iter(f'{SML_NS}c'):
+                        column = _column_index(cell.get('r'))
+                        if column is not None and column > len(cells):
+                            cells.extend([''] * (column - len(cells)))
+                        cells.append(_cell_value(cell, strings))
+                    yield '\t'.join(cells).rstrip('\t')
+                    element.clear()
+
+
+class XlsxHandler(FormatHandler):
+    file_type = 'spreadsheet'
+    cost = EXPENSIVE
+
+    @classmethod
+    def detect(cls, fileobj):
+        try:
+            with zipfile.ZipFile(fileobj) as archive:
+                return 'xl/workbook.xml' in archive.namelist()
+        except zipfile.BadZipFile:
+            return False
+
+    def extract_text(self, file_path):
+        try:
+            return '\n'.join(iter_xlsx(file_path))
+        except Exception as e:
+            return f"Error extracting spreadsheet text: {str(e)}"
+
+    def metadata(self, file_path):
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                names = [name for name, _ in _sheets(archive)]
+        except Exception:
+            return {}
+        return {'sheets': len(names), 'sheet_names': names}
+
+
+def _odt_text(element):
+    parts = [element.text or '']
+    for child in element:
+        if child.tag == f'{TEXT_NS}s':
+            parts.append(' ' * int(child.get(f'{TEXT_NS}c', 1)))
+        elif child.tag == f'{TEXT_NS}tab':
+            parts.append('\t')
+        elif child.tag == f'{TEXT_NS}line-break':
+            parts.append('\n')
+        elif child.tag != f'{OFFICE_NS}annotation':
+            parts.append(_odt_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def iter_odt(file_path):
+    """Yield paragraphs and headings, and one tab-separated line per table row, in order."""
+    paragraph_tags = (f'{TEXT_NS}p', f'{TEXT_NS}h')
+    table_depth = 0
+    parents = []
+    with zipfile.ZipFile(file_path) as archive, archive.open('content.xml') as stream:
+        for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == f'{TABLE_NS}table':
+                    table_depth += 1
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag in paragraph_tags and table_depth == 0:
+                # Paragraphs nested in another paragraph (notes, frames) are part of it.
+                if any(parent.tag in paragraph_tags for parent in parents):
+                    continue
+                yield _odt_text(element)
+            elif element.tag == f'{TABLE_NS}table-row' and table_depth == 1:
+                cells = []
+                for cell in element.iter(f'{TABLE_NS}table-cell'):
+                    text = ' '.join(_odt_text(p) for p in cell.iter(f'{TEXT_NS}p')).strip()
+                    cells.extend([text] * int(cell.get(f'{TABLE_NS}number-columns-repeated', 1)))
+                yield '\t'.join(cells).rstrip('\t')
+            elif element.tag == f'{TABLE_NS}table':
+                table_depth -= 1
+                if table_depth:
+                    continue
+            else:
+                continue
+            # Drop finished blocks so memory stays flat.
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+
+class OdtHandler(FormatHandler):
+    file_type = 'odt'
+    cost = EXPENSIVE
+
+    @classmethod
+    def detect(cls, fileobj):
+        try:
+            with zipfile.ZipFile(fileobj) as archive:
+                return archive.read('mimetype').strip() == ODT_MIMETYPE
+        except (zipfile.BadZipFile, KeyError):
+            return False
+
+    def extract_text(self, file_path):
+        try:
+            return '\n'.join(iter_odt(file_path))
+        except Exception as e:
+            return f"Error extracting ODT text: {str(e)}"
+
+    def metadata(self, file_path):
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                meta = ElementTree.fromstring(archive.read('meta.xml'))
+        except Exception:
+            return {}
+        stats = meta.find(f'.//{META_NS}document-statistic')
+        pages = stats.get(f'{META_NS}page-count') if stats is not None else None
+        return {'pages': int(pages)} if pages and pages.isdigit() else {}
@@ -0,0 +1,127 @@
+"""
+PDF handler (PyPDF2): page-wise text extraction, page counts and first-page
+previews.
+"""
+import mmap
+import time
+
+from django.conf import settings
+from PyPDF2 import PdfReader
+
+from ..metrics import PDF_PAGE_TIME
+from ..workers import in_worker, pool_size, result_within, submit_to_process
+from .base import FormatHandler, EXPENSIVE
+
+
+def _map_file(file_path):
+    """Read-only mmap of a file; processes mapping the same file share its page cache."""
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def extract_page_range(file_path, start, stop):
+    """Extract pages ``start``..``stop - 1`` as ``{'number', 'text', 'seconds'}`` dicts."""
+    with _map_file(file_path) as data:
+        reader = PdfReader(data)
+        pages = []
+        for index in range(start, min(stop, len(reader.pages))):
+            began = time.perf_counter()
+            text = reader.pages[index].extract_text() or ''
+            seconds = time.perf_counter() - began
+            PDF_PAGE_TIME.observe(seconds)
+            pages.append({'number': index + 1, 'text': text, 'seconds': seconds})
+        return pages
+
+
+def extract_pages(file_path):
+    """
+    Extract a PDF page by page in the extraction pool. Documents with at least
+    ``DOCTRACK_PDF_PARALLEL_MIN_PAGES`` pages are split into one page range per
+    worker; each worker maps the file instead of reading its own copy.
+    """
+    with _map_file(file_path) as data:
+        page_count = len(PdfReader(data).pages)
+    if in_worker():
+        return extract_page_range(file_path, 0, page_count)
+
+    min_pages = getattr(settings, 'DOCTRACK_PDF_PARALLEL_MIN_PAGES', 40)
+    ranges = pool_size('extract') if page_count >= min_pages else 1
+    chunk = max(1, -(-page_count // ranges))
+    futures = [
+        submit_to_process(extract_page_range, file_path, start, start + chunk,
+                          queue='extract', pool='extract')
+        for start in range(0, page_count, chunk)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(result_within(future, pool='extract'))
+    return pages
+
+
+def extract_text(file_path):
+    """Extract text content from a PDF file."""
+    try:
+        return '\n\n'.join(page['text'] for page in extract_pages(file_path))
+    except Exception as e:
+        return f"Error extracting PDF text: {str(e)}"
+
+
+def page_count(file_path):
+    """Get the number of pages in a PDF."""
+    try:
+        with _map_file(file_path) as data:
+            return len(PdfReader(data).pages)
+    except Exception:
+        return 0
+
+
+def _page_scan(page):
+    """The largest image on a page, when it is a scanned page rather than a figure."""
+    width, height = float(page.mediabox.width), float(page.mediabox.height)
+    best = None
+    for image in page.images:
+        img = image.image
+        if best is None or img.width * img.height > best.width * best.height:
+            best = img
+    # A scan carries roughly the page's proportions; a chart or logo does not.
+    if best is not None and height and abs(best.width / best.height - width / height) < 0.1:
+        return best
+    return None
+
+
+def preview(file_path, max_size):
+    """
+    PyPDF2 cannot rasterise pages, so a scanned first page is shown as its
+    embedded image and any other page as a text preview.
+    """
+    from .image import fit, text_preview
+
+    try:
+        with _map_file(file_path) as data:
+            page = PdfReader(data).pages[0]
+            try:
+                scan = _page_scan(page)
+            except Exception:
+                scan = None
+            if scan is not None:
+                return fit(scan, max_size)
+            return text_preview((page.extract_text() or '').splitlines(), max_size)
+    except Exception:
+        return None
+
+
+class PdfHandler(FormatHandler):
+    file_type = 'pdf'
+    cost = EXPENSIVE
+
+    def extract_text(self, file_path):
+        return extract_text(file_path)
+
+    def extract_pages(self, file_path):
+        return extract_pages(file_path)
+
+    def metadata(self, file_path):
+        return {'pages': page_count(file_path)}
+
+    def preview(self, file_path, max_size):
+        return preview(file_path, max_size)
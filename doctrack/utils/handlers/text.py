@@ -0,0 +1,167 @@
+"""
+Plain-text family handlers: text, Markdown, CSV, JSON and HTML. All of them
+use the standard library only.
+"""
+import csv
+import json
+from html.parser import HTMLParser
+
+from .base import FormatHandler, open_text
+
+READ_CHUNK = 64 * 1024
+
+
+def iter_lines(file_path):
+    """Yield the lines of a text file without line endings."""
+    with open_text(file_path) as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+class TextHandler(FormatHandler):
+    file_type = 'text'
+
+    def extract_text(self, file_path):
+        return '\n'.join(iter_lines(file_path))
+
+    def metadata(self, file_path):
+        return {'lines': sum(1 for _ in iter_lines(file_path))}
+
+
+class MarkdownHandler(TextHandler):
+    file_type = 'markdown'
+
+    def metadata(self, file_path):
+        lines = headings = 0
+        for line in iter_lines(file_path):
+            lines += 1
+            if line.startswith('#'):
+                headings += 1
+        return {'lines': lines, 'headings': headings}
+
+
+def _csv_dialect(f):
+    sample = f.read(READ_CHUNK)
+    f.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+    except csv.Error:
+        return csv.excel
+
+
+class CsvHandler(FormatHandler):
+    """One line per row with cells separated by tabs, whatever the file's delimiter."""
+    file_type = 'csv'
+
+    def iter_rows(self, file_path):
+        with open_text(file_path) as f:
+            yield from csv.reader(f, _csv_dialect(f))
+
+    def extract_text(self, file_path):
+        return '\n'.join('\t'.join(row) for row in self.iter_rows(file_path))
+
+    def metadata(self, file_path):
+        rows = columns = 0
+        for row in self.iter_rows(file_path):
+            rows += 1
+            columns = max(columns, len(row))
+        return {'rows': rows, 'columns': columns}
+
+
+class JsonHandler(FormatHandler):
+    """
+    Re-indents the document so that diffs follow its structure. The standard
+    library has no incremental JSON parser, so the document is loaded whole.
+    """
+    file_type = 'json'
+
+    def _load(self, file_path):
+        with open_text(file_path) as f:
+            return json.load(f)
+
+    def extract_text(self, file_path):
+        try:
+            return json.dumps(self._load(file_path), indent=2, ensure_ascii=False)
+        except ValueError:
+            # Not valid JSON; still worth comparing as text.
+            return TextHandler().extract_text(file_path)
+
+    def metadata(self, file_path):
+        try:
+            data = self._load(file_path)
+        except ValueError:
+            return {}
+        if isinstance(data, (dict, list)):
+            return {'items': len(data)}
+        return {}
+
+
+class _HtmlTextParser(HTMLParser):
+    """Collects visible text, starting a new line at each block-level element."""
+
+    BLOCK_TAGS = {
+        'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+        'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+        'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th',
+        'tr', 'ul',
+    }
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.current = []
+        self.skipping = 0
+        self.in_title = False
+        self.title = ''
+
+    def _break(self):
+        text = ' '.join(''.join(self.current).split())
+        if text:
+            self.lines.append(text)
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skipping += 1
+        elif tag == 'title':
+            self.in_title = True
+        elif tag in self.BLOCK_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag == 'title':
+            self.in_title = False
+        elif tag in self.BLOCK_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skipping:
+            self.current.append(data)
+
+    def close(self):
+        super().close()
+        self._break()
+
+
+class HtmlHandler(FormatHandler):
+    file_type = 'html'
+
+    def _parse(self, file_path):
+        parser = _HtmlTextParser()
+        with open_text(file_path) as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), ''):
+                parser.feed(chunk)
+        parser.close()
+        return parser
+
+    def extract_text(self, file_path):
+        return '\n'.join(self._parse(file_path).lines)
+
+    def metadata(self, file_path):
+        title = ' '.join(self._parse(file_path).title.split())
+        return {'title': title} if title else {}
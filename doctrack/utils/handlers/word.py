@@ -0,0 +1,207 @@
+"""
+Word (DOCX) handler: streaming text extraction and page estimates using only
+the standard library.
+"""
+import math
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from .base import FormatHandler, EXPENSIVE, zip_contains
+
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+APP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+_HEADER_PART_RE = re.compile(r'word/header\d*\.xml$')
+_FOOTER_PART_RE = re.compile(r'word/footer\d*\.xml$')
+
+_W_P, _W_T, _W_TAB, _W_BR, _W_CR = (W_NS + t for t in ('p', 't', 'tab', 'br', 'cr'))
+_W_TBL, _W_TR, _W_TC = (W_NS + t for t in ('tbl', 'tr', 'tc'))
+_W_PPR, _W_SECTPR, _W_TYPE, _W_VAL = (W_NS + t for t in ('pPr', 'sectPr', 'type', 'val'))
+_W_RENDERED_BREAK = W_NS + 'lastRenderedPageBreak'
+_W_BREAK_BEFORE = W_NS + 'pageBreakBefore'
+
+# Fallback page size when a document carries no layout hints at all.
+DOCX_CHARS_PER_PAGE = 3000
+
+
+def _docx_part_text(element):
+    parts = []
+    for node in element.iter():
+        tag = node.tag
+        if tag == _W_T:
+            parts.append(node.text or '')
+        elif tag == _W_TAB:
+            parts.append('\t')
+        elif (tag == _W_BR or tag == _W_CR) and node.get(_W_TYPE) != 'page':
+            parts.append('\n')
+    return ''.join(parts)
+
+
+def _iter_docx_part(stream):
+    """
+    Stream one WordprocessingML part. Yields ``('text', str)`` for each body
+    paragraph and each table row (cells joined by tabs), and ``('page_break',
+    kind)`` for explicit, section and last-rendered page breaks.
+    """
+    table_depth = 0
+    row_cells = []
+    parents = []
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == _W_TBL:
+                table_depth += 1
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if tag == _W_P:
+            if table_depth:
+                continue
+            yield 'text', _docx_part_text(element)
+        elif tag == _W_RENDERED_BREAK:
+            yield 'page_break', 'rendered'
+            continue
+        elif tag == _W_BR:
+            if element.get(_W_TYPE) == 'page':
+                yield 'page_break', 'explicit'
+            continue
+        elif tag == _W_BREAK_BEFORE:
+            if element.get(_W_VAL, 'true') not in ('0', 'false'):
+                yield 'page_break', 'explicit'
+            continue
+        elif tag == _W_SECTPR:
+            if parents and parents[-1].tag == _W_PPR:
+                section_type = element.find(_W_TYPE)
+                if section_type is None or section_type.get(_W_VAL) != 'continuous':
+                    yield 'page_break', 'section'
+            continue
+        elif tag == _W_TC:
+            if table_depth == 1:
+                row_cells.append(' '.join(_docx_part_text(p) for p in element.iter(_W_P)).strip())
+            continue
+        elif tag == _W_TR:
+            if table_depth != 1:
+                continue
+            yield 'text', '\t'.join(row_cells)
+            row_cells = []
+        elif tag == _W_TBL:
+            table_depth -= 1
+            if table_depth:
+                continue
+        else:
+            continue
+
+        # A finished top-level paragraph, table or table row: drop it so
+        # memory stays flat however long the part is.
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def iter_docx(file_path):
+    """
+    Stream a DOCX without building a document tree: headers, then the body,
+    then footers, each in document order. See ``_iter_docx_part``.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        names = archive.namelist()
+        parts = (
+            sorted(n for n in names if _HEADER_PART_RE.match(n))
+            + ['word/document.xml']
+            + sorted(n for n in names if _FOOTER_PART_RE.match(n))
+        )
+        for name in parts:
+            with archive.open(name) as stream:
+                for kind, value in _iter_docx_part(stream):
+                    if kind == 'page_break' and name != 'word/document.xml':
+                        continue
+                    yield kind, value
+
+
+def extract_text(file_path):
+    """Extract text content from a Word document, including tables, headers and footers."""
+    try:
+        return '\n'.join(value for kind, value in iter_docx(file_path) if kind == 'text')
+    except Exception as e:
+        return f"Error extracting Word text: {str(e)}"
+
+
+def _docx_saved_page_count(file_path):
+    """Page count Word recorded in docProps/app.xml when it last saved the file."""
+    with zipfile.ZipFile(file_path) as archive:
+        try:
+            data = archive.read('docProps/app.xml')
+        except KeyError:
+            return 0
+    pages = ElementTree.fromstring(data).findtext(f'{APP_NS}Pages')
+    return int(pages) if pages and pages.strip().isdigit() else 0
+
+
+def page_count(file_path):
+    """
+    Estimate the number of pages in a Word document from layout hints: the
+    page count Word saved and the page breaks it rendered last time, else
+    explicit page and section breaks or the text length, whichever is larger.
+    """
+    try:
+        breaks = {'rendered': 0, 'explicit': 0, 'section': 0}
+        chars = 0
+        for kind, value in iter_docx(file_path):
+            if kind == 'page_break':
+                breaks[value] += 1
+            else:
+                chars += len(value)
+        by_breaks = breaks['explicit'] + breaks['section'] + 1
+        # Files not written by Word (python-docx, converters) often keep a
+        # template's "1 page", so a single saved page is not trusted.
+        rendered = max(_docx_saved_page_count(file_path), breaks['rendered'] + 1)
+        if rendered > 1:
+            return max(rendered, by_breaks)
+        return max(by_breaks, math.ceil(chars / DOCX_CHARS_PER_PAGE))
+    except Exception:
+        return 0
+
+
+def first_page_lines(file_path, limit=80):
+    """Body text up to the first explicit page break, at most ``limit`` lines."""
+    lines = []
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as stream:
+        for kind, value in _iter_docx_part(stream):
+            if kind == 'page_break' or len(lines) >= limit:
+                break
+            lines.extend(value.splitlines() or [''])
+    return lines[:limit]
+
+
+def preview(file_path, max_size):
+    from .image import text_preview
+
+    try:
+        return text_preview(first_page_lines(file_path), max_size)
+    except Exception:
+        # Legacy .doc files are not zip archives.
+        return None
+
+
+class WordHandler(FormatHandler):
+    file_type = 'word'
+    cost = EXPENSIVE
+
+    @classmethod
+    def detect(cls, fileobj):
+        # Legacy .doc files share the OLE magic with other Office formats.
+        if fileobj.read(4) == b'\xd0\xcf\x11\xe0':
+            return True
+        fileobj.seek(0)
+        return zip_contains(fileobj, 'word/document.xml')
+
+    def extract_text(self, file_path):
+        return extract_text(file_path)
+
+    def metadata(self, file_path):
+        return {'pages': page_count(file_path)}
+
+    def preview(self, file_path, max_size):
+        return preview(file_path, max_size)
@@ -0,0 +1,215 @@
+"""
+Image version comparison.
+
+Identical files and images whose perceptual hashes match are reported without
+touching pixels. Otherwise both versions are downsampled to a common grid and
+differenced with NumPy; the result has a similarity percentage, bounding boxes
+of the changed regions and a heatmap PNG stored once per pair of files. The
+heatmap is named after both files' digests; ``views.version_heatmap`` serves it
+to users who can see the document.
+"""
+from collections import deque
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw
+
+from .file_handlers import file_digest
+from .handlers.image import to_rgb
+from .workers import cpu_time_limit, CPUBudgetExceeded
+
+HASH_SIZE = 8
+HASH_SAMPLE = 32
+HEATMAP_DIR = 'diffs'
+
+
+def heatmap_name(digest1, digest2, grid):
+    return f'{HEATMAP_DIR}/{digest1}-{digest2}-{grid[0]}x{grid[1]}.png'
+
+
+def _setting(name, default):
+    return getattr(settings, f'DOCTRACK_IMAGE_DIFF_{name}', default)
+
+
+def _open_rgb(file_path, size):
+    """
+    Open an image as RGB, flattening transparency onto white. Returns the
+    image and its original size; JPEGs may be decoded at reduced scale.
+    """
+    with Image.open(file_path) as img:
+        original_size = img.size
+        img.draft('RGB', size)
+        return to_rgb(img), original_size
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+
+
+def perceptual_hash(img):
+    """64-bit DCT hash of an image: low frequencies above/below their median."""
+    small = img.convert('L').resize((HASH_SAMPLE, HASH_SAMPLE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (low > np.median(low.flatten()[1:])).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+
+def _grid_size(size, limit):
+    width, height = size
+    scale = min(1.0, limit / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _changed_regions(mask, cell):
+    """
+    Bounding boxes, in grid pixels, of connected groups of changed cells. The
+    mask is reduced to ``cell``-sized blocks first so the walk stays small.
+    """
+    height, width = mask.shape
+    rows, cols = -(-height // cell), -(-width // cell)
+    padded = np.zeros((rows * cell, cols * cell), dtype=bool)
+    padded[:height, :width] = mask
+    cells = padded.reshape(rows, cell, cols, cell).any(axis=(1, 3))
+
+    seen = np.zeros_like(cells)
+    regions = []
+    for start in zip(*np.nonzero(cells)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        queue = deque([start])
+        top, left, bottom, right = start[0], start[1], start[0], start[1]
+        while queue:
+            r, c = queue.popleft()
+            top, bottom = min(top, r), max(bottom, r)
+            left, right = min(left, c), max(right, c)
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < rows and 0 <= nc < cols and cells[nr, nc] and not seen[nr, nc]:
+                    seen[nr, nc] = True
+                    queue.append((nr, nc))
+        regions.append((
+            left * cell, top * cell,
+            min((right + 1) * cell, width), min((bottom + 1) * cell, height),
+        ))
+    return regions
+
+
+def _render_heatmap(new_pixels, diff, boxes):
+    """Dimmed grayscale of the new version with changes tinted red and boxed."""
+    base = new_pixels.mean(axis=2) * 0.6 + 100
+    weight = np.clip(diff / 128.0, 0, 1)
+    heat = np.stack([
+        base + (255 - base) * weight,
+        base * (1 - weight),
+        base * (1 - weight),
+    ], axis=2).astype(np.uint8)
+    img = Image.fromarray(heat, 'RGB')
+    draw = ImageDraw.Draw(img)
+    for box in boxes:
+        draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), outline=(220, 38, 38), width=2)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _stats(similarity, **extra):
+    """Stats shaped like ``get_diff_stats`` so summaries and metrics treat images alike."""
+    stats = {
+        'lines_added': 0,
+        'lines_removed': 0,
+        'lines_changed': 0,
+        'similarity_percent': similarity,
+        'total_lines_v1': 0,
+        'total_lines_v2': 0,
+    }
+    stats.update(extra)
+    return stats
+
+
+def compare_images(file_path1, file_path2, budget):
+    """
+    Compare two image versions. Runs in a pool worker; the pixel diff stops
+    after ``budget`` seconds of CPU time, leaving the hash comparison with
+    ``partial`` set.
+    """
+    digest1, digest2 = file_digest(file_path1), file_digest(file_path2)
+    result = {
+        'can_compare': True,
+        'partial': False,
+        'mode': 'image',
+        'identical': digest1 == digest2,
+        'near_identical': False,
+        'regions': [],
+        'heatmap': None,
+    }
+    if result['identical']:
+        result['stats'] = _stats(100.0, changed_pixels_percent=0.0, regions=0)
+        return result
+
+    grid_limit = _setting('SIZE', 512)
+    try:
+        img1, result['dimensions_v1'] = _open_rgb(file_path1, (grid_limit, grid_limit))
+        img2, result['dimensions_v2'] = _open_rgb(file_path2, (grid_limit, grid_limit))
+    except Exception as e:
+        return {'error': f'Cannot read image: {e}', 'can_compare': False}
+
+    distance = hash_distance(perceptual_hash(img1), perceptual_hash(img2))
+    result['hash_distance'] = distance
+    hash_similarity = round(100.0 * (1 - distance / HASH_SIZE ** 2), 1)
+    same_size = result['dimensions_v1'] == result['dimensions_v2']
+    if same_size and distance <= _setting('HASH_DISTANCE', 0):
+        result['near_identical'] = True
+        result['stats'] = _stats(hash_similarity, regions=0)
+        return result
+
+    try:
+        with cpu_time_limit(budget):
+            grid = _grid_size(result['dimensions_v2'], grid_limit)
+            old = np.asarray(img1.resize(grid, Image.Resampling.BILINEAR), dtype=np.int16)
+            new = np.asarray(img2.resize(grid, Image.Resampling.BILINEAR), dtype=np.int16)
+            diff = np.abs(old - new).max(axis=2)
+            mask = diff > _setting('TOLERANCE', 32)
+            changed = float(mask.mean())
+            boxes = _changed_regions(mask, _setting('REGION_CELL', 16))
+            boxes.sort(key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)
+            boxes = boxes[:_setting('MAX_REGIONS', 20)]
+
+            name = heatmap_name(digest1, digest2, grid)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(_render_heatmap(new, diff, boxes)))
+    except CPUBudgetExceeded:
+        result['partial'] = True
+        result['stats'] = _stats(hash_similarity, regions=0)
+        return result
+
+    # Boxes are reported in the new version's own pixel coordinates.
+    scale_x = result['dimensions_v2'][0] / grid[0]
+    scale_y = result['dimensions_v2'][1] / grid[1]
+    result['regions'] = [
+        {
+            'x': round(left * scale_x), 'y': round(top * scale_y),
+            'width': round((right - left) * scale_x), 'height': round((bottom - top) * scale_y),
+        }
+        for left, top, right, bottom in boxes
+    ]
+    # Size of the heatmap; with the digests it names the file (heatmap_name).
+    result['heatmap'] = grid
+    result['stats'] = _stats(
+        round(100.0 * (1 - changed), 1),
+        changed_pixels_percent=round(100.0 * changed, 2),
+        regions=len(result['regions']),
+    )
+    return result
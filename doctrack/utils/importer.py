@@ -0,0 +1,407 @@
+"""
+Bulk import of documents from a directory tree or a zip archive, used by the
+``import_documents`` management command.
+
+Files are grouped into documents by path: ``specs/report_v2.pdf`` and
+``specs/report v3.pdf`` are versions of the document ``specs/report``, ordered
+by their version suffix (a file without one sorts first). New versions are
+numbered after a document's existing ones, so importing into a project that
+already has ``specs/report`` appends to it.
+
+Each file is hashed, typed and, unless indexing is off, fingerprinted for
+near-duplicate search in the extraction pool, so its text is extracted there
+and only once; content already stored in the project is skipped. Documents are written a batch at a time with bulk
+inserts in one transaction, and each finished batch is appended to a
+checkpoint file so an interrupted import picks up where it stopped. A batch
+that would take the project or its team over its storage quota stops the
+import (``QuotaExceeded``) unless quotas are explicitly ignored.
+"""
+import json
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Document, Version, Activity, adjust_storage_usage, version_upload_path
+from .file_handlers import file_digest
+from .handlers import EXTENSIONS, type_from_extension, detect_file_type
+from .metrics import UPLOAD_BYTES
+from .quotas import quota_error
+from .similarity import has_text, save_signature, signature_options, text_signature
+from .workers import submit_to_process
+
+VERSION_SUFFIX_RE = re.compile(r'^(?P<name>.+?)[\s._-]*v(?:ersion)?[\s._-]?(?P<number>\d+)$', re.IGNORECASE)
+
+
+def batch_size():
+    return getattr(settings, 'DOCTRACK_IMPORT_BATCH_SIZE', 50)
+
+
+class QuotaExceeded(ValueError):
+    pass
+
+
+class DirectorySource:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def entries(self):
+        """Relative POSIX paths of every file, in a stable order; hidden files and directories are skipped."""
+        for root, dirs, files in os.walk(self.path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            relative = os.path.relpath(root, self.path)
+            for name in sorted(files):
+                if not name.startswith('.'):
+                    yield posixpath.normpath(posixpath.join(relative.replace(os.sep, '/'), name))
+
+    def open(self, entry):
+        return open(os.path.join(self.path, *entry.split('/')), 'rb')
+
+    @contextmanager
+    def local_path(self, entry):
+        yield os.path.join(self.path, *entry.split('/'))
+
+    def close(self):
+        pass
+
+
+class ZipSource:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.archive = zipfile.ZipFile(self.path)
+
+    def entries(self):
+        for info in self.archive.infolist():
+            parts = info.filename.split('/')
+            if not info.is_dir() and not any(part.startswith('.') or part == '__MACOSX' for part in parts):
+                yield info.filename
+
+    def open(self, entry):
+        return self.archive.open(entry)
+
+    @contextmanager
+    def local_path(self, entry):
+        """The entry copied to a temporary file, for handlers that need a path."""
+        with tempfile.NamedTemporaryFile(suffix=posixpath.splitext(entry)[1]) as f:
+            with self.archive.open(entry) as member:
+                shutil.copyfileobj(member, f)
+            f.flush()
+            yield f.name
+
+    def close(self):
+        self.archive.close()
+
+
+def open_source(path):
+    """A directory or zip archive to import from; raises ValueError for anything else."""
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    raise ValueError(f'{path} is neither a directory nor a zip archive')
+
+
+@contextmanager
+def _source(path):
+    source = open_source(path)
+    try:
+        yield source
+    finally:
+        source.close()
+
+
+_worker_sources = {}
+
+
+def _worker_source(path):
+    # Keep the current source open across jobs: reopening a zip re-reads its
+    # whole central directory for every file.
+    source = _worker_sources.get(path)
+    if source is None:
+        for stale in _worker_sources.values():
+            stale.close()
+        _worker_sources.clear()
+        source = _worker_sources[path] = open_source(path)
+    return source
+
+
+def inspect_file(source_path, entry, options=None):
+    """
+    Pool job: ``(digest, size, file_type, signature)`` of one file in a
+    source. ``signature`` is the ``text_signature`` result for ``options``,
+    or None when no options are given, the type has no text or it can't be
+    extracted.
+    """
+    source = _worker_source(source_path)
+    with source.open(entry) as f:
+        file_type = detect_file_type(f, entry)
+        digest = file_digest(File(f))
+        # Hashing read the whole file, so the position is its size.
+        size = f.tell()
+    signature = None
+    if options and has_text(file_type):
+        try:
+            with source.local_path(entry) as path:
+                signature = text_signature(path, file_type, *options)
+        except Exception:
+            # The file still imports, like an upload whose text can't be read.
+            signature = None
+    return digest, size, file_type, signature
+
+
+def parse_entry(entry):
+    """``(document name, version order)`` for a source path; the order is 0 without a version suffix."""
+    stem = entry.rsplit('.', 1)[0] if '.' in posixpath.basename(entry) else entry
+    directory, base = posixpath.split(stem)
+    match = VERSION_SUFFIX_RE.match(base)
+    number = 0
+    if match:
+        base, number = match.group('name'), int(match.group('number'))
+    return posixpath.join(directory, base)[:255], number
+
+
+def group_entries(entries):
+    """
+    Supported ``entries`` grouped into documents: a list of
+    ``(name, extension type, [entry, ...])`` with versions in order.
+    """
+    groups = {}
+    for entry in entries:
+        name, number = parse_entry(entry)
+        key = (name, type_from_extension(entry))
+        groups.setdefault(key, []).append((number, entry))
+    return [
+        (name, file_type, [entry for _, entry in sorted(members)])
+        for (name, file_type), members in sorted(groups.items())
+    ]
+
+
+def is_supported(entry):
+    return '.' in entry and entry.rsplit('.', 1)[-1].lower() in EXTENSIONS
+
+
+class Checkpoint:
+    """
+    Append-only record of finished entries: a JSON header naming the project
+    and source, then one JSON-encoded entry per line. A torn last line from a
+    crash is ignored.
+    """
+
+    def __init__(self, path, project, source_path):
+        self.path = path
+        self.header = {'project': project.pk, 'source': os.path.abspath(source_path)}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return set()
+        with open(self.path, encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        if not lines or json.loads(lines[0] or 'null') != self.header:
+            raise ValueError(f'{self.path} is a checkpoint for a different project or source')
+        # The final element is '' after a complete line, or a partial write.
+        return {json.loads(line) for line in lines[1:-1]}
+
+    def record(self, entries):
+        if not self.path:
+            return
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            if new:
+                f.write(json.dumps(self.header) + '\n')
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DocumentImporter:
+    def __init__(self, project, user, source_path, batch=None, checkpoint=None, index=True, log=None,
+                 enforce_quota=True):
+        self.project = project
+        self.user = user
+        self.source_path = source_path
+        self.batch = batch or batch_size()
+        self.checkpoint = Checkpoint(checkpoint, project, source_path)
+        self.index = index
+        self.enforce_quota = enforce_quota
+        self.log = log or (lambda message: None)
+        self.stats = dict.fromkeys(
+            ('files', 'resumed', 'unsupported', 'duplicates', 'failed', 'documents', 'versions', 'bytes'), 0
+        )
+
+    def run(self):
+        with _source(self.source_path) as source:
+            self.source = source
+            entries = list(source.entries())
+            self.stats['files'] = len(entries)
+            done = self.checkpoint.load()
+            pending = []
+            for entry in entries:
+                if entry in done:
+                    self.stats['resumed'] += 1
+                elif not is_supported(entry):
+                    self.stats['unsupported'] += 1
+                else:
+                    pending.append(entry)
+
+            self.known = set(
+                Version.objects.filter(document__project=self.project)
+                .exclude(content_hash='').values_list('content_hash', flat=True)
+            )
+            groups = group_entries(pending)
+            batches = [groups[i:i + self.batch] for i in range(0, len(groups), self.batch)]
+            # Inspect the next batch in the pool while this one is written.
+            upcoming = self._inspect(batches[0]) if batches else None
+            for i, batch in enumerate(batches):
+                inspected = upcoming
+                upcoming = self._inspect(batches[i + 1]) if i + 1 < len(batches) else None
+                self._import_batch(batch, inspected)
+        if not self.stats['failed']:
+            # Keep it otherwise, so a rerun retries just the failed files.
+            self.checkpoint.remove()
+        return self.stats
+
+    def _inspect(self, batch):
+        options = signature_options() if self.index else None
+        return {
+            entry: submit_to_process(
+                inspect_file, self.source_path, entry, options, queue='import', pool='extract'
+            )
+            for _, _, members in batch for entry in members
+        }
+
+    def _import_batch(self, batch, inspected):
+        results = {}
+        for entry, future in inspected.items():
+            try:
+                results[entry] = future.result()
+            except Exception as e:
+                self.stats['failed'] += 1
+                self.log(f'Skipping {entry}: {e}')
+
+        plan = []
+        finished = []
+        for name, _, members in batch:
+            keep = []
+            for entry in members:
+                if entry not in results:
+                    continue
+                finished.append(entry)
+                digest = results[entry][0]
+                if digest in self.known:
+                    self.stats['duplicates'] += 1
+                    continue
+                self.known.add(digest)
+                keep.append(entry)
+            if keep:
+                plan.append((name, keep))
+
+        if plan and self.enforce_quota:
+            entries = [entry for _, keep in plan for entry in keep]
+            error = quota_error(self.project, sum(results[entry][1] for entry in entries), len(entries))
+            if error:
+                # Earlier batches stay imported and checkpointed.
+                raise QuotaExceeded(f'Import stopped: {error}')
+        versions = self._write(plan, results) if plan else []
+        if self.index:
+            written = [entry for _, keep in plan for entry in keep]
+            for version, entry in zip(versions, written):
+                if results[entry][3] is not None:
+                    save_signature(version, *results[entry][3])
+        self.checkpoint.record(finished)
+        processed = sum(self.stats[k] for k in ('resumed', 'unsupported', 'duplicates', 'failed', 'versions'))
+        self.log(
+            f"{processed}/{self.stats['files']} files: {self.stats['versions']} imported, "
+            f"{self.stats['duplicates']} duplicates, {self.stats['failed']} failed"
+        )
+
+    def _write(self, plan, results):
+        """Create the documents, versions and activities for one batch; returns the new versions."""
+        stored = []
+        try:
+            with transaction.atomic():
+                existing = {
+                    (d.name, d.file_type): d for d in
+                    Document.objects.filter(project=self.project, name__in=[name for name, _ in plan])
+                }
+                new_documents = []
+                targets = []
+                for name, entries in plan:
+                    file_type = results[entries[0]][2]
+                    document = existing.get((name, file_type))
+                    is_new = document is None
+                    if is_new:
+                        document = Document(
+                            name=name, project=self.project, file_type=file_type, created_by=self.user,
+                            description=f'Imported from {posixpath.basename(self.source_path.rstrip("/"))}',
+                            version_counter=len(entries),
+                        )
+                        new_documents.append(document)
+                    targets.append((document, is_new, entries))
+                Document.objects.bulk_create(new_documents)
+
+                versions = []
+                for document, is_new, entries in targets:
+                    number = 0 if is_new else document.allocate_version_numbers(len(entries)) - 1
+                    for entry in entries:
+                        number += 1
+                        digest, size = results[entry][:2]
+                        version = Version(
+                            document=document, version_number=number, file_size=size,
+                            content_hash=digest, uploaded_by=self.user,
+                            change_summary='Initial version' if number == 1 else f'Imported {entry}',
+                        )
+                        with self.source.open(entry) as f:
+                            version.file.name = default_storage.save(
+                                version_upload_path(version, posixpath.basename(entry)), File(f)
+                            )
+                        stored.append(version.file.name)
+                        versions.append(version)
+                Version.objects.bulk_create(versions)
+                adjust_storage_usage(self.project.pk, sum(v.file_size for v in versions))
+
+                created = {document.pk for document in new_documents}
+                # Same activity as the upload views: one per new document,
+                # one per version added to an existing document.
+                activities = [
+                    Activity(
+                        user=self.user, action='uploaded', target_type='Document',
+                        target_id=document.pk, target_name=document.name, project=self.project,
+                    )
+                    for document in new_documents
+                ]
+                activities.extend(
+                    Activity(
+                        user=self.user, action='uploaded', target_type='Version', target_id=version.pk,
+                        target_name=f'{version.document.name} v{version.version_number}', project=self.project,
+                    )
+                    for version in versions if version.document_id not in created
+                )
+                Activity.objects.bulk_create(activities)
+                Document.objects.filter(
+                    pk__in=[document.pk for document, is_new, _ in targets if not is_new]
+                ).update(updated_at=timezone.now())
+        except BaseException:
+            # The rows are rolled back; don't leave their files behind.
+            for name in stored:
+                default_storage.delete(name)
+            raise
+
+        for version in versions:
+            UPLOAD_BYTES.inc(version.file_size, file_type=version.document.file_type)
+        self.stats['documents'] += len(new_documents)
+        self.stats['versions'] += len(versions)
+        self.stats['bytes'] += sum(v.file_size for v in versions)
+        return versions
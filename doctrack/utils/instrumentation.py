@@ -0,0 +1,218 @@
+"""
+Request instrumentation: SQL query recording, template render timing and the
+JSONL performance log that backs the admin performance summary.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('doctrack.perf')
+
+# Mutable [seconds] cell for the request currently being instrumented.
+_render_timer = contextvars.ContextVar('doctrack_render_timer', default=None)
+
+# Recorders receiving queries in the current context. Context variables follow
+# ``sync_to_async`` into its worker thread, so async views are recorded too.
+_active_recorders = contextvars.ContextVar('doctrack_query_recorders', default=())
+
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_IN_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_SQL_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint_sql(sql):
+    """Normalize a SQL statement so repeated queries share one fingerprint."""
+    sql = _SQL_STRING_RE.sub('?', sql)
+    sql = _SQL_NUMBER_RE.sub('?', sql)
+    sql = _SQL_IN_LIST_RE.sub('(...)', sql)
+    return _SQL_SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Collects the SQL statements run while it is active (see ``record_queries``)."""
+
+    def __init__(self):
+        # (sql, duration, perf_counter start) per statement, in execution order.
+        self.queries = []
+
+    def record(self, sql, duration, start):
+        self.queries.append((sql, duration, start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    def duplicates(self, threshold=None):
+        """Return {fingerprint: count} for statements repeated within one request."""
+        if threshold is None:
+            threshold = getattr(settings, 'DOCTRACK_DUPLICATE_QUERY_THRESHOLD', 2)
+        counts = Counter(fingerprint_sql(sql) for sql, _, _ in self.queries)
+        return {fp: n for fp, n in counts.items() if n >= threshold}
+
+
+@contextmanager
+def record_queries(recorder):
+    """Send every query executed in this context, on any thread, to ``recorder``."""
+    token = _active_recorders.set(_active_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _active_recorders.reset(token)
+
+
+def _dispatch_query(execute, sql, params, many, context):
+    recorders = _active_recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        for recorder in recorders:
+            recorder.record(sql, duration, start)
+
+
+def install_query_dispatcher(sender, connection, **kwargs):
+    """``connection_created`` receiver that routes the connection's queries to recorders."""
+    if _dispatch_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch_query)
+
+
+def start_render_timer():
+    """Begin accumulating template render time for the current context."""
+    return _render_timer.set([0.0])
+
+
+def stop_render_timer(token):
+    """Stop the timer started with ``start_render_timer`` and return seconds."""
+    elapsed = _render_timer.get()[0]
+    _render_timer.reset(token)
+    return elapsed
+
+
+class TimedTemplate:
+    """Wraps a backend template so top-level renders add to the request timer."""
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timer = _render_timer.get()
+            if timer is not None:
+                timer[0] += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that reports render time to the metrics middleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def response_size(response):
+    """Size of the response body in bytes, without consuming streaming bodies."""
+    if response.streaming:
+        try:
+            return int(response.get('Content-Length', 0))
+        except ValueError:
+            return 0
+    return len(response.content)
+
+
+def server_timing_header(record):
+    """Format a request record as a ``Server-Timing`` header value."""
+    return ', '.join([
+        f'sql;dur={record["sql_ms"]:.1f};desc="{record["queries"]} queries"',
+        f'render;dur={record["render_ms"]:.1f}',
+        f'total;dur={record["total_ms"]:.1f}',
+    ])
+
+
+def log_request(record):
+    """Append a request record to the JSONL performance log."""
+    logger.info(json.dumps(record, separators=(',', ':')))
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (pct in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def load_request_log(path=None, limit=50000):
+    """Read the most recent records from the log and its rotated backups."""
+    path = str(path or settings.DOCTRACK_PERF_LOG)
+    candidates = [path] + [f'{path}.{i}' for i in range(1, 100)]
+    records = []
+    for candidate in candidates:
+        if not os.path.exists(candidate):
+            break
+        with open(candidate, encoding='utf-8') as f:
+            chunk = []
+            for line in f:
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError:
+                    continue
+        records = chunk + records
+        if len(records) >= limit:
+            break
+    return records[-limit:]
+
+
+def summarize_requests(records):
+    """Aggregate request records into per-URL-name latency and query statistics."""
+    grouped = defaultdict(list)
+    for record in records:
+        grouped[record.get('url_name') or '(unresolved)'].append(record)
+
+    summary = []
+    for url_name, rows in grouped.items():
+        totals = [r['total_ms'] for r in rows]
+        queries = [r['queries'] for r in rows]
+        summary.append({
+            'url_name': url_name,
+            'count': len(rows),
+            'p50_ms': round(percentile(totals, 50), 1),
+            'p90_ms': round(percentile(totals, 90), 1),
+            'p99_ms': round(percentile(totals, 99), 1),
+            'max_ms': round(max(totals), 1),
+            'avg_queries': round(sum(queries) / len(rows), 1),
+            'max_queries': max(queries),
+            'p90_sql_ms': round(percentile([r['sql_ms'] for r in rows], 90), 1),
+            'p90_render_ms': round(percentile([r['render_ms'] for r in rows], 90), 1),
+            'avg_bytes': int(sum(r['bytes'] for r in rows) / len(rows)),
+            'n_plus_one': sum(1 for r in rows if r.get('duplicates')),
+        })
+    summary.sort(key=lambda row: row['p90_ms'], reverse=True)
+    return summary
@@ -0,0 +1,376 @@
+"""
+Small in-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and histograms are thread-safe. When ``DOCTRACK_METRICS_DIR``
+is set, each worker process periodically writes a JSON snapshot of its values
+into that directory and the ``/metrics`` view merges the snapshots of every
+process, so multi-worker deployments report one consistent set of series.
+Snapshots of processes that have exited are folded into one
+``metrics_retired.json`` (counters and histograms only) and deleted, so the
+directory doesn't grow with every worker restart.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+FLUSH_INTERVAL = 1.0
+# Counters and histograms of exited processes, in the shared directory.
+RETIRED_SNAPSHOT = 'metrics_retired.json'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def describe(self):
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]
+
+    def describe(self):
+        description = super().describe()
+        description['buckets'] = [b for b in self.buckets if b != math.inf]
+        return description
+
+
+class Registry:
+    """Named collection of metrics that can be snapshotted and exposed."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} already registered as {metric.type}')
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of every metric's current values."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: dict(metric.describe(), samples=metric.samples())
+            for metric in metrics
+        }
+
+    def reset(self):
+        """Clear all recorded values; forked worker processes start from zero."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                metric._values.clear()
+        self._last_flush = 0.0
+
+    def flush(self, directory=None, force=False):
+        """Write this process's snapshot into the shared metrics directory."""
+        directory = directory or metrics_dir()
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'metrics': self.snapshot()}, f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Snapshot for exposition, merged across processes in shared-directory mode."""
+        directory = metrics_dir()
+        if not directory:
+            return self.snapshot()
+        self.flush(directory, force=True)
+        retire_dead_snapshots(directory)
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge_snapshots(snapshots)
+
+    def expose(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        return render_exposition(self.collect())
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_pid(path):
+    """PID in a ``metrics_<pid>.json`` name, or None for any other file."""
+    name = os.path.basename(path)[len('metrics_'):-len('.json')]
+    return int(name) if name.isdigit() else None
+
+
+def retire_dead_snapshots(directory):
+    """
+    Fold the snapshots of exited processes into ``metrics_retired.json`` and
+    delete them. Counters keep counting what those processes recorded;
+    their gauges are dropped, as ``merge_snapshots`` would drop them anyway.
+    Does nothing where ``fcntl`` locks aren't available.
+    """
+    if fcntl is None:
+        return
+    retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+    with open(os.path.join(directory, 'metrics.lock'), 'w') as lock:
+        # Two processes folding the same snapshot would count it twice.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            dead = [
+                path for path in glob.glob(os.path.join(directory, 'metrics_*.json'))
+                if _snapshot_pid(path) is not None and not _pid_alive(_snapshot_pid(path))
+            ]
+            if not dead:
+                return
+            snapshots = []
+            for path in [retired_path] + dead:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+            tmp_path = f'{retired_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'pid': None, 'metrics': merge_snapshots(snapshots)}, f)
+            os.replace(tmp_path, retired_path)
+            for path in dead:
+                os.remove(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def merge_snapshots(snapshots):
+    """
+    Combine per-process snapshots. Counters and histograms are summed over
+    every process that ever wrote one (retired ones included); gauges only
+    over live processes.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        alive = _pid_alive(snapshot['pid'])
+        for name, metric in snapshot['metrics'].items():
+            if metric['type'] == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labelvalues, value in metric['samples']:
+                key = tuple(labelvalues)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+                else:
+                    target['samples'][key] = current + value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def render_exposition(snapshot):
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        labelnames = metric['labelnames']
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        for labelvalues, value in sorted(metric['samples']):
+            if metric['type'] == 'histogram':
+                bucket_counts, total, count = value
+                cumulative = 0
+                bounds = list(metric['buckets']) + [math.inf]
+                for bound, bucket_count in zip(bounds, bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(labelnames, labelvalues, ('le', _format_value(bound)))
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                labels = _format_labels(labelnames, labelvalues)
+                lines.append(f'{name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{name}_count{labels} {count}')
+            else:
+                labels = _format_labels(labelnames, labelvalues)
+                lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_dir():
+    return getattr(settings, 'DOCTRACK_METRICS_DIR', None)
+
+
+registry = Registry()
+atexit.register(lambda: registry.flush(force=True))
+
+REQUEST_LATENCY = registry.histogram(
+    'doctrack_request_duration_seconds', 'Request latency by view.', ['view'])
+DB_QUERY_TIME = registry.histogram(
+    'doctrack_db_query_seconds', 'Total SQL time per request by view.', ['view'])
+DB_QUERIES = registry.counter(
+    'doctrack_db_queries_total', 'SQL statements executed by view.', ['view'])
+EXTRACTION_TIME = registry.histogram(
+    'doctrack_extraction_seconds', 'Text extraction time by file type.', ['file_type'])
+PDF_PAGE_TIME = registry.histogram(
+    'doctrack_pdf_page_extraction_seconds', 'Text extraction time per PDF page.')
+DIFF_TIME = registry.histogram(
+    'doctrack_diff_seconds', 'Time spent diffing two extracted documents.')
+DIFF_LINES = registry.histogram(
+    'doctrack_diff_lines', 'Lines added, removed and changed per comparison.', ['kind'],
+    buckets=SIZE_BUCKETS)
+UPLOAD_BYTES = registry.counter(
+    'doctrack_upload_bytes_total', 'Bytes of uploaded version files by file type.', ['file_type'])
+QUEUE_DEPTH = registry.gauge(
+    'doctrack_background_queue_depth', 'Jobs queued or running in background worker pools.', ['queue'])
+COMPARISONS = registry.counter(
+    'doctrack_comparisons_total',
+    'Comparison requests by outcome (computed, coalesced, cached, rejected, pending, timeout, failed).',
+    ['outcome'])
+CACHE_REQUESTS = registry.counter(
+    'doctrack_cache_requests_total', 'Cache lookups by cache name and result (hit/miss).',
+    ['cache', 'result'])
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
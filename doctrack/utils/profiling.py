@@ -0,0 +1,311 @@
+"""
+On-demand request profiling: cProfile call statistics, an optional
+tracemalloc allocation sample and the SQL timeline for a single request.
+
+Jobs the request sends to a worker pool are profiled in the worker, which
+dumps its stats to a file the report picks up. tracemalloc is process-wide,
+so concurrent profiled requests share one trace and see each other's
+allocations.
+"""
+import contextvars
+import cProfile
+import marshal
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+
+from .instrumentation import QueryRecorder, record_queries
+
+# Modules, and packages (trailing separator), whose functions are singled out
+# in the report as known hot paths.
+HOT_PATH_MODULES = (
+    os.path.join('doctrack', 'utils', 'comparison.py'),
+    os.path.join('doctrack', 'utils', 'file_handlers.py'),
+    os.path.join('doctrack', 'utils', 'image_diff.py'),
+    os.path.join('doctrack', 'utils', 'handlers', ''),
+)
+
+
+# The profile of the request running in the current context.
+_active_profile = contextvars.ContextVar('doctrack_request_profile', default=None)
+
+# Profiled requests tracing allocations, and whether we started tracemalloc
+# for them (it may have been started with PYTHONTRACEMALLOC instead).
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def offloaded_stats_path(func, pool):
+    """
+    Called as a job is sent to a worker pool. Returns the file the worker
+    should dump its profile to if the current request is being profiled.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return None
+    return profile.add_offloaded_job(func, pool)
+
+
+def is_hot_path(filename):
+    for entry in HOT_PATH_MODULES:
+        if entry.endswith(os.sep):
+            if os.sep + entry in filename:
+                return True
+        elif filename.endswith(os.sep + entry):
+            return True
+    return False
+
+
+def profiling_requested(request, user):
+    """Return the requested profile mode ('html' or 'pstats') or None."""
+    if not getattr(settings, 'DOCTRACK_PROFILING_ENABLED', True):
+        return None
+    mode = request.GET.get('profile') or request.headers.get('X-Profile')
+    if not mode or not user.is_staff:
+        return None
+    return 'pstats' if mode == 'pstats' else 'html'
+
+
+def allocations_requested(request):
+    return bool(request.GET.get('profile_alloc') or request.headers.get('X-Profile-Alloc'))
+
+
+class RequestProfile:
+    """Collects profiling data while a view runs."""
+
+    def __init__(self, trace_allocations=False):
+        self.profiler = cProfile.Profile()
+        self.recorder = QueryRecorder()
+        self.trace_allocations = trace_allocations
+        self.allocations = []
+        self.peak_memory = 0
+        self.started = None
+        self.duration = 0.0
+        self.offloaded = []
+        self._worker_stats = None
+        self._context_token = None
+
+    def _start(self):
+        if self.trace_allocations:
+            _start_tracemalloc()
+        self._context_token = _active_profile.set(self)
+        self.started = time.perf_counter()
+
+    def _stop(self):
+        self.duration = time.perf_counter() - self.started
+        _active_profile.reset(self._context_token)
+        if self.trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            _stop_tracemalloc()
+            self.allocations = snapshot.statistics('lineno')[:30]
+
+    def run(self, func, *args, **kwargs):
+        self._start()
+        try:
+            with record_queries(self.recorder):
+                return self.profiler.runcall(func, *args, **kwargs)
+        finally:
+            self._stop()
+
+    async def arun(self, func, *args, **kwargs):
+        """
+        Profile an async handler. cProfile only sees the event loop thread, so
+        work other coroutines do meanwhile shows up in the same profile.
+        """
+        self._start()
+        self.profiler.enable()
+        try:
+            with record_queries(self.recorder):
+                return await func(*args, **kwargs)
+        finally:
+            self.profiler.disable()
+            self._stop()
+
+    def add_offloaded_job(self, func, pool):
+        fd, path = tempfile.mkstemp(prefix='doctrack-profile-', suffix='.pstats')
+        os.close(fd)
+        self.offloaded.append({
+            'function': getattr(func, '__qualname__', repr(func)),
+            'pool': pool,
+            'stats_path': path,
+            'finished': False,
+            'duration_ms': None,
+        })
+        return path
+
+    def worker_stats(self):
+        """
+        Combined stats of the offloaded jobs that finished while the request
+        ran, or None. Jobs still running (the view stopped waiting) are left
+        out. The stats files are removed once read.
+        """
+        if self._worker_stats is not None or not self.offloaded:
+            return self._worker_stats or None
+        combined = None
+        for job in self.offloaded:
+            path = job['stats_path']
+            try:
+                if os.path.getsize(path):
+                    stats = pstats.Stats(path)
+                    job['finished'] = True
+                    job['duration_ms'] = round(stats.total_tt * 1000, 3)
+                    combined = stats if combined is None else combined.add(stats)
+            except (OSError, EOFError, ValueError, TypeError):
+                # Missing, or caught halfway through being written.
+                pass
+            finally:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._worker_stats = combined or False
+        return combined
+
+    def stats(self):
+        return pstats.Stats(self.profiler)
+
+    def pstats_bytes(self):
+        """
+        Marshalled stats in the format written by ``pstats.Stats.dump_stats``,
+        including the offloaded jobs' stats.
+        """
+        stats = self.stats()
+        worker_stats = self.worker_stats()
+        if worker_stats is not None:
+            stats.add(worker_stats)
+        return marshal.dumps(stats.stats)
+
+    def top_functions(self, sort='cumulative', limit=40):
+        rows = [
+            _function_row(func, nc, tt, ct)
+            for func, (cc, nc, tt, ct, _) in self.stats().stats.items()
+        ]
+        key = 'cumulative_ms' if sort == 'cumulative' else 'own_ms'
+        rows.sort(key=lambda row: row[key], reverse=True)
+        return rows[:limit]
+
+    def hot_paths(self):
+        """
+        Rows for functions defined in the comparison, extraction and format
+        handler modules, from the request itself and from its offloaded jobs
+        (marked ``worker``).
+        """
+        rows = []
+        worker_stats = self.worker_stats()
+        sources = [(self.stats(), False)] + ([(worker_stats, True)] if worker_stats is not None else [])
+        for stats, in_worker in sources:
+            rows.extend(
+                dict(_function_row(func, nc, tt, ct), worker=in_worker)
+                for func, (cc, nc, tt, ct, _) in stats.stats.items()
+                if is_hot_path(func[0])
+            )
+        rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+        return rows
+
+    def offloaded_jobs(self):
+        self.worker_stats()
+        return [
+            {key: job[key] for key in ('function', 'pool', 'finished', 'duration_ms')}
+            for job in self.offloaded
+        ]
+
+    def call_tree(self, min_fraction=0.01, max_depth=15, max_rows=300):
+        """
+        Flatten the profile into an indented call tree rooted at the view,
+        keeping only branches that account for at least ``min_fraction`` of
+        the request time. Each row carries a percentage for a flame-style bar.
+        """
+        stats = self.stats()
+        callees = {}
+        for func, (_, _, _, _, callers) in stats.stats.items():
+            for caller, (_, _, _, ct) in callers.items():
+                callees.setdefault(caller, []).append((func, ct))
+
+        total = self.duration or 1e-9
+        roots = [func for func, entry in stats.stats.items() if not entry[4]]
+        rows = []
+
+        def walk(func, cumulative, depth, path):
+            if cumulative < total * min_fraction or depth > max_depth or func in path:
+                return
+            if len(rows) >= max_rows:
+                return
+            rows.append(dict(
+                _function_row(func, stats.stats[func][1], stats.stats[func][2], cumulative),
+                depth=depth,
+                percent=round(100 * cumulative / total, 1),
+            ))
+            children = sorted(callees.get(func, []), key=lambda item: item[1], reverse=True)
+            for child, child_ct in children:
+                walk(child, child_ct, depth + 1, path | {func})
+
+        for root in roots:
+            walk(root, stats.stats[root][3], 0, frozenset())
+        return rows
+
+    def sql_timeline(self):
+        return [
+            {
+                'offset_ms': round((start - self.started) * 1000, 2),
+                'duration_ms': round(duration * 1000, 3),
+                'sql': sql,
+            }
+            for sql, duration, start in self.recorder.queries
+        ]
+
+    def allocation_rows(self):
+        return [
+            {
+                'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'size_kb': round(stat.size / 1024, 1),
+                'count': stat.count,
+            }
+            for stat in self.allocations
+        ]
+
+
+def _function_row(func, calls, own_time, cumulative_time):
+    filename, lineno, name = func
+    return {
+        'function': name,
+        'location': f'{_short_path(filename)}:{lineno}' if lineno else filename,
+        'calls': calls,
+        'own_ms': round(own_time * 1000, 3),
+        'cumulative_ms': round(cumulative_time * 1000, 3),
+        'hot': is_hot_path(filename),
+    }
+
+
+def _short_path(filename):
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        return os.path.relpath(filename, base)
+    marker = f'{os.sep}site-packages{os.sep}'
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
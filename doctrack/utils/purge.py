@@ -0,0 +1,136 @@
+"""
+Background purge of deleted projects.
+
+Deleting a project through the ORM makes the collector load every related
+row and holds one write transaction for the whole cascade, and it leaves the
+version files on disk. Instead ``Project.mark_deleted`` hides the project at
+once and ``purge_project`` removes its rows afterwards with plain batched
+``DELETE`` statements, leaves first so no batch breaks a foreign key, each
+batch in its own short transaction. Version files are removed before their
+rows, so an interrupted purge can simply be run again.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+
+from ..models import (
+    Project, Document, Version, VersionSignature, SignatureBand,
+    PullRequest, Review, WorkItem, Comment, Activity
+)
+
+
+def batch_size():
+    return getattr(settings, 'DOCTRACK_PURGE_BATCH_SIZE', 500)
+
+
+def _purge_steps(project_id):
+    """``(model, rows)`` in the order they have to go; ``rows`` use base managers."""
+    in_project = Q(project=project_id) | Q(document__project=project_id)
+    documents = Document.all_objects.filter(project=project_id).values('pk')
+    versions = Version.objects.filter(document__in=documents).values('pk')
+    pull_requests = PullRequest.all_objects.filter(in_project).values('pk')
+    work_items = WorkItem.all_objects.filter(in_project).values('pk')
+    return [
+        (SignatureBand, SignatureBand.objects.filter(signature__version__in=versions)),
+        (VersionSignature, VersionSignature.objects.filter(version__in=versions)),
+        # Replies are newer than their parents, so newest first never leaves
+        # a reply pointing at a deleted comment.
+        (Comment, Comment.objects.filter(
+            Q(document__in=documents) | Q(pull_request__in=pull_requests) | Q(work_item__in=work_items)
+        ).order_by('-pk')),
+        (Review, Review.objects.filter(pull_request__in=pull_requests)),
+        (PullRequest.reviewers.through,
+         PullRequest.reviewers.through.objects.filter(pullrequest__in=pull_requests)),
+        (PullRequest, PullRequest.all_objects.filter(in_project)),
+        (WorkItem, WorkItem.all_objects.filter(in_project)),
+        (Activity, Activity.all_objects.filter(project=project_id)),
+        (Version, Version.objects.filter(document__in=documents)),
+        (Document, Document.all_objects.filter(project=project_id)),
+        (Project.collaborators.through, Project.collaborators.through.objects.filter(project=project_id)),
+        (Project, Project.all_objects.filter(pk=project_id)),
+    ]
+
+
+def _delete_rows(model, pks):
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', pks)
+
+
+def purge_project(project_id, batch=None, log=None):
+    """
+    Delete a project marked with ``mark_deleted`` and everything in it.
+    Returns the number of rows deleted per model label.
+    """
+    batch = batch or batch_size()
+    if not Project.all_objects.filter(pk=project_id, deleted_at__isnull=False).exists():
+        return {}
+    deleted = {}
+    for model, rows in _purge_steps(project_id):
+        if not rows.query.order_by:
+            rows = rows.order_by('pk')
+        label = model._meta.label
+        while True:
+            if model is Version:
+                versions = list(rows.values_list('pk', 'file')[:batch])
+                pks = [pk for pk, _ in versions]
+                # Files first: if the purge stops here, the rows are still
+                # there for the next run to find.
+                for _, name in versions:
+                    if name:
+                        default_storage.delete(name)
+            else:
+                pks = list(rows.values_list('pk', flat=True)[:batch])
+            if not pks:
+                break
+            with transaction.atomic():
+                _delete_rows(model, pks)
+            deleted[label] = deleted.get(label, 0) + len(pks)
+            if len(pks) < batch:
+                break
+        if log and deleted.get(label):
+            log(f'Deleted {deleted[label]} {model._meta.verbose_name_plural}')
+    return deleted
+
+
+def pending_projects():
+    return Project.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at')
+
+
+class ProjectPurger:
+    """Purges deleted projects one at a time on a background thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._queued = set()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+            return self._executor
+
+    def purge_later(self, project_id):
+        with self._lock:
+            if project_id in self._queued:
+                return None
+            self._queued.add(project_id)
+        return self._get_executor().submit(self._purge, project_id)
+
+    def _purge(self, project_id):
+        try:
+            return purge_project(project_id)
+        finally:
+            with self._lock:
+                self._queued.discard(project_id)
+            connection.close()
+
+
+purger = ProjectPurger()
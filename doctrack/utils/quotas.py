@@ -0,0 +1,51 @@
+"""
+Storage quotas.
+
+Every project and team keeps a running ``storage_bytes`` counter that is
+adjusted when versions are created or deleted (see
+``models.adjust_storage_usage``), so checking a quota is a single indexed
+read instead of a sum over all versions. A project's or team's own
+``storage_quota`` wins over the ``DOCTRACK_PROJECT_QUOTA_BYTES`` and
+``DOCTRACK_TEAM_QUOTA_BYTES`` defaults; ``None`` means unlimited.
+"""
+from django.conf import settings
+
+from ..models import Project
+from .file_handlers import format_file_size
+
+
+def project_quota(project):
+    if project.storage_quota is not None:
+        return project.storage_quota
+    return getattr(settings, 'DOCTRACK_PROJECT_QUOTA_BYTES', None)
+
+
+def team_quota(team):
+    if team.storage_quota is not None:
+        return team.storage_quota
+    return getattr(settings, 'DOCTRACK_TEAM_QUOTA_BYTES', None)
+
+
+def quota_error(project, size, files=1):
+    """Message explaining why ``size`` more bytes (in ``files`` files) don't fit, or None if they do."""
+    # Re-read the counters: the instance may be older than other uploads.
+    project = Project.objects.select_related('team').only(
+        'storage_bytes', 'storage_quota', 'team__name', 'team__storage_bytes', 'team__storage_quota'
+    ).get(pk=project.pk)
+    limits = [('This project', project_quota(project), project.storage_bytes)]
+    if project.team:
+        limits.append((f'Team {project.team.name}', team_quota(project.team), project.team.storage_bytes))
+    for label, quota, used in limits:
+        if quota is not None and used + size > quota:
+            available = max(quota - used, 0)
+            adding = 'this file is' if files == 1 else f'these {files} files are'
+            return (
+                f'{label} has {format_file_size(available)} of its {format_file_size(quota)} '
+                f'storage quota left; {adding} {format_file_size(size)}.'
+            )
+    return None
+
+
+def storage_usage(project):
+    """``(used, quota)`` for the project, for display."""
+    return project.storage_bytes, project_quota(project)
@@ -0,0 +1,230 @@
+"""
+Thumbnail and preview renditions.
+
+Every size and format for a version is rendered from one decode in the
+extraction pool and stored in an on-disk cache keyed by the file's content
+hash, so identical uploads share renditions and a version's renditions never
+change. The cache evicts least recently used files once it exceeds
+``DOCTRACK_RENDITION_CACHE_BYTES``.
+"""
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+
+from .file_handlers import file_digest
+from .handlers import get_handler
+from .metrics import record_cache_lookup
+from .workers import submit_to_process
+
+# Formats a rendition can be requested in:
+# extension -> (Pillow format, content type, save options).
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+}
+
+# File types whose handlers draw previews.
+PREVIEW_TYPES = ('image', 'pdf', 'word')
+
+DEFAULT_SIZES = {
+    'small': (160, 160),
+    'medium': (480, 480),
+    'large': (1024, 1024),
+}
+
+
+def rendition_sizes():
+    return getattr(settings, 'DOCTRACK_RENDITION_SIZES', DEFAULT_SIZES)
+
+
+def render_renditions(file_path, file_type, sizes):
+    """
+    Pool job: ``{(size name, extension): bytes}`` for every size and format,
+    or an empty dict when the file has no preview. The largest preview is
+    decoded once and scaled down for the smaller sizes.
+    """
+    handler = get_handler(file_type)
+    if handler is None:
+        return {}
+    largest = max(sizes.values(), key=lambda size: size[0] * size[1])
+    img = handler.preview(file_path, largest)
+    if img is None:
+        return {}
+    renditions = {}
+    for name, size in sizes.items():
+        scaled = img.copy()
+        scaled.thumbnail(size)
+        for ext, (pil_format, _, options) in FORMATS.items():
+            buffer = BytesIO()
+            scaled.save(buffer, format=pil_format, **options)
+            renditions[(name, ext)] = buffer.getvalue()
+    return renditions
+
+
+class RenditionCache:
+    """
+    Files under ``directory`` named by key, with LRU eviction by total bytes.
+    Reads bump a file's mtime, so eviction order survives restarts and is
+    shared by every process using the directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key[:2], f'{key}.{ext}')
+
+    def get(self, key, ext):
+        """Path of a cached rendition, or None."""
+        path = self.path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            record_cache_lookup('rendition', False)
+            return None
+        record_cache_lookup('rendition', True)
+        return path
+
+    def put(self, key, ext, data):
+        path = self.path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see half a file.
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_total(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Rescan: other processes write to the same directory. Evict down to
+        # 90% so a full cache doesn't rescan on every write.
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+
+class RenditionService:
+    """Renders each version once, however many requests ask for it meanwhile."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # content hash -> future
+        self._inflight = {}
+        self._cache = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = RenditionCache(
+                getattr(settings, 'DOCTRACK_RENDITION_DIR', settings.BASE_DIR / 'renditions'),
+                getattr(settings, 'DOCTRACK_RENDITION_CACHE_BYTES', 256 * 1024 * 1024),
+            )
+        return self._cache
+
+    def key(self, version, size_name):
+        width, height = rendition_sizes()[size_name]
+        return f'{content_hash(version)}-{width}x{height}'
+
+    def get(self, version, size_name, ext):
+        return self.cache.get(self.key(version, size_name), ext)
+
+    def schedule(self, version):
+        """
+        Start rendering ``version`` in the extraction pool, or join the render
+        already running for the same content. Returns a future of the
+        ``render_renditions`` result; the cache is filled when it finishes.
+        """
+        digest = content_hash(version)
+        sizes = rendition_sizes()
+        with self._lock:
+            future = self._inflight.get(digest)
+            if future is not None:
+                return future
+            future = submit_to_process(
+                render_renditions, version.file.path, version.document.file_type, sizes,
+                queue='renditions', pool='extract',
+            )
+            self._inflight[digest] = future
+        future.add_done_callback(lambda f: self._store(digest, sizes, f))
+        return future
+
+    def _store(self, digest, sizes, future):
+        try:
+            if not future.cancelled() and future.exception() is None:
+                for (name, ext), data in future.result().items():
+                    width, height = sizes[name]
+                    self.cache.put(f'{digest}-{width}x{height}', ext, data)
+        finally:
+            with self._lock:
+                self._inflight.pop(digest, None)
+
+    def wait(self, version, size_name, ext, timeout):
+        """
+        Path of the rendition, rendering it if needed and waiting up to
+        ``timeout`` seconds. Raises ``TimeoutError`` if it isn't ready, and
+        returns None if the file has no preview.
+        """
+        path = self.get(version, size_name, ext)
+        if path is not None:
+            return path
+        future = self.schedule(version)
+        data = future.result(timeout=timeout).get((size_name, ext))
+        if data is None:
+            return None
+        # The done callback that stores the files may not have run yet.
+        key = self.key(version, size_name)
+        path = self.cache.path(key, ext)
+        return path if os.path.exists(path) else self.cache.put(key, ext, data)
+
+    def warm(self, version):
+        """Render a new version in the background unless it can't be previewed."""
+        smallest = next(iter(rendition_sizes()))
+        if version.document.file_type in PREVIEW_TYPES and not self.get(version, smallest, 'webp'):
+            self.schedule(version)
+
+
+def content_hash(version):
+    """The version's content hash, computed and saved for versions uploaded before it existed."""
+    if not version.content_hash:
+        version.content_hash = file_digest(version.file.path)
+        type(version).objects.filter(pk=version.pk).update(content_hash=version.content_hash)
+    return version.content_hash
+
+
+renditions = RenditionService()
@@ -0,0 +1,135 @@
+"""
+Admission control for document comparisons.
+
+Identical in-flight comparisons share one worker job, the number of running
+comparisons is capped per process and per user, and finished results are
+cached so the "still computing" poll picks them up without recomputing
+(partial results, cut short by the CPU budget, only briefly). The result cache
+is ``DOCTRACK_COMPARE_CACHE``, a cache shared by every worker process, since
+the poll may well land on a different one; coalescing and the limits are per
+process.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .comparison import compare_documents_budgeted
+from .metrics import record_cache_lookup, COMPARISONS
+from .workers import JobTimeout
+
+CACHE_PREFIX = 'doctrack:comparison'
+
+
+def _setting(name, default):
+    return getattr(settings, f'DOCTRACK_COMPARE_{name}', default)
+
+
+def result_cache():
+    return caches[_setting('CACHE', 'default')]
+
+
+def pending_result(message):
+    return {'can_compare': False, 'pending': True, 'error': message}
+
+
+class ComparisonScheduler:
+    """
+    Coalesces and rate-limits comparisons. Each admitted comparison runs on a
+    scheduler thread that waits on the extraction and diff worker pools.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (future, user id that started it)
+        self._inflight = {}
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=_setting('MAX_INFLIGHT', 2), thread_name_prefix='comparison'
+            )
+        return self._executor
+
+    def cache_key(self, key):
+        return f'{CACHE_PREFIX}:' + ':'.join(str(part) for part in key)
+
+    def inflight_count(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                return len(self._inflight)
+            return sum(1 for _, owner in self._inflight.values() if owner == user_id)
+
+    def submit(self, key, user_id, file_path1, file_path2, file_type):
+        """
+        Return ``(future, outcome)`` for the comparison identified by ``key``,
+        joining a running job when there is one. ``future`` is None when the
+        process or user limit is reached.
+        """
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                return entry[0], 'coalesced'
+            if len(self._inflight) >= _setting('MAX_INFLIGHT', 2):
+                return None, 'rejected'
+            running = sum(1 for _, owner in self._inflight.values() if owner == user_id)
+            if running >= _setting('MAX_PER_USER', 2):
+                return None, 'rejected'
+            # Run in a copy of the caller's context so a profiled request
+            # follows its comparison into the worker pools.
+            future = self._get_executor().submit(
+                contextvars.copy_context().run, compare_documents_budgeted,
+                file_path1, file_path2, file_type, _setting('CPU_BUDGET', 30)
+            )
+            self._inflight[key] = (future, user_id)
+        future.add_done_callback(lambda f: self._finished(key, f))
+        return future, 'computed'
+
+    def _finished(self, key, future):
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+            # A diff cut short by the CPU budget is only kept long enough to
+            # answer the poll; the next request gets another go at finishing it.
+            ttl = _setting('PARTIAL_TTL', 30) if result.get('partial') else _setting('RESULT_TTL', 300)
+            result_cache().set(self.cache_key(key), result, ttl)
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    async def compare(self, key, user_id, file_path1, file_path2, file_type):
+        """
+        Comparison result for ``key``, or a ``pending`` placeholder when the job
+        is still running after ``DOCTRACK_COMPARE_WAIT`` seconds or could not
+        be admitted yet. Pending results are meant to be polled again.
+        """
+        result = await result_cache().aget(self.cache_key(key))
+        record_cache_lookup('comparison', result is not None)
+        if result is not None:
+            COMPARISONS.inc(outcome='cached')
+            return result
+
+        future, outcome = self.submit(key, user_id, file_path1, file_path2, file_type)
+        COMPARISONS.inc(outcome=outcome)
+        if future is None:
+            return pending_result('Too many comparisons are running; this one will start shortly.')
+        try:
+            # Shield the shared future so one impatient waiter doesn't cancel it for the rest.
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)), _setting('WAIT', 10)
+            )
+        except asyncio.TimeoutError:
+            COMPARISONS.inc(outcome='pending')
+            return pending_result('This comparison is still being computed.')
+        except JobTimeout:
+            COMPARISONS.inc(outcome='timeout')
+            return {'can_compare': False, 'error': 'This comparison took too long and was stopped.'}
+        except BrokenExecutor:
+            # Another comparison's stuck worker took the pool down with it.
+            COMPARISONS.inc(outcome='failed')
+            return {'can_compare': False, 'error': 'The comparison was interrupted; please try again.'}
+
+
+scheduler = ComparisonScheduler()
@@ -0,0 +1,224 @@
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing.
+
+Each version's extracted text is cut into word shingles and summarised as a
+MinHash signature (``NUM_PERM`` 32-bit ints), whose agreement with another
+signature estimates the Jaccard similarity of the two shingle sets. The
+signature is split into ``BANDS`` bands; each band is hashed to a bucket
+stored in ``SignatureBand``, so near-duplicates are found by looking up shared
+buckets instead of comparing every pair of documents.
+
+Changing ``DOCTRACK_SIMILARITY_*`` settings other than the threshold makes
+stored signatures incomparable; rebuild them with ``find_duplicates --reindex``.
+"""
+import hashlib
+import random
+import re
+import threading
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from ..models import Version, VersionSignature, SignatureBand
+from .file_handlers import extract_text_content
+from .handlers import get_handler_class
+from .handlers.base import FormatHandler
+from .workers import submit_to_process
+
+MERSENNE_PRIME = (1 << 31) - 1
+# Shingle hashes permuted per NumPy step; bounds memory at NUM_PERM x this.
+HASH_CHUNK = 8192
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _setting(name, default):
+    return getattr(settings, f'DOCTRACK_SIMILARITY_{name}', default)
+
+
+def default_threshold():
+    return _setting('THRESHOLD', 0.8)
+
+
+def shingles(text, size):
+    """CRC32 hashes of the ``size``-word windows of ``text``, ignoring case and punctuation."""
+    words = _WORD_RE.findall(text.lower())
+    return {
+        zlib.crc32(' '.join(words[i:i + size]).encode('utf-8'))
+        for i in range(max(1, len(words) - size + 1))
+    } if words else set()
+
+
+def _permutations(num_perm):
+    # Fixed seed: signatures are compared across processes and restarts.
+    rng = random.Random(20240601)
+    a = [rng.randrange(1, MERSENNE_PRIME) for _ in range(num_perm)]
+    b = [rng.randrange(0, MERSENNE_PRIME) for _ in range(num_perm)]
+    return a, b
+
+
+def minhash(hashes, num_perm):
+    """MinHash signature of a set of 32-bit hashes as an ``array('I')``."""
+    import numpy as np
+
+    a, b = (np.array(values, dtype=np.uint64)[:, None] for values in _permutations(num_perm))
+    values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    signature = np.full(num_perm, MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(values), HASH_CHUNK):
+        block = values[None, start:start + HASH_CHUNK]
+        # a < 2**31 and hashes < 2**32, so a * x + b fits in 64 bits.
+        np.minimum(signature, ((a * block + b) % MERSENNE_PRIME).min(axis=1), out=signature)
+    return array('I', signature.astype(np.uint32).tobytes())
+
+
+def text_signature(file_path, file_type, shingle_size, num_perm, min_shingles):
+    """
+    Pool job: ``(signature bytes, shingle count)`` for a file, or None when it
+    has too little text to compare meaningfully.
+    """
+    text = extract_text_content(file_path, file_type) or ''
+    hashes = shingles(text, shingle_size)
+    if len(hashes) < min_shingles:
+        return None
+    return minhash(hashes, num_perm).tobytes(), len(hashes)
+
+
+def _signature(data):
+    signature = array('I')
+    signature.frombytes(bytes(data))
+    return signature
+
+
+def band_buckets(data, bands):
+    """One signed 64-bit bucket per band; the band number is hashed in, so buckets never collide across bands."""
+    signature = _signature(data)
+    rows = len(signature) // bands
+    buckets = []
+    for band in range(bands):
+        digest = hashlib.blake2b(
+            band.to_bytes(2, 'little') + signature[band * rows:(band + 1) * rows].tobytes(),
+            digest_size=8,
+        ).digest()
+        buckets.append(int.from_bytes(digest, 'little', signed=True))
+    return buckets
+
+
+def estimate_similarity(data1, data2):
+    """Estimated Jaccard similarity (0..1) of the texts behind two signatures."""
+    signature1, signature2 = _signature(data1), _signature(data2)
+    if not signature1 or len(signature1) != len(signature2):
+        return 0.0
+    return sum(x == y for x, y in zip(signature1, signature2)) / len(signature1)
+
+
+def has_text(file_type):
+    cls = get_handler_class(file_type)
+    return cls is not None and cls.extract_text is not FormatHandler.extract_text
+
+
+def signature_options():
+    """The trailing ``text_signature`` arguments, from settings."""
+    return _setting('SHINGLE_SIZE', 5), _setting('NUM_PERM', 128), _setting('MIN_SHINGLES', 20)
+
+
+def index_versions(versions):
+    """
+    Compute and store signatures for ``versions``, fanned out to the
+    extraction pool. Yields ``(version, stored)`` as each one finishes.
+    """
+    options = signature_options()
+    futures = [
+        (version, submit_to_process(
+            text_signature, version.file.path, version.document.file_type, *options,
+            queue='similarity', pool='extract',
+        ))
+        for version in versions
+        if version.file and has_text(version.document.file_type)
+    ]
+    for version, future in futures:
+        result = future.result()
+        if result is None:
+            VersionSignature.objects.filter(version=version).delete()
+        else:
+            save_signature(version, *result)
+        yield version, result is not None
+
+
+@transaction.atomic
+def save_signature(version, signature, shingle_count):
+    VersionSignature.objects.filter(version=version).delete()
+    stored = VersionSignature.objects.create(
+        version=version, signature=signature, shingle_count=shingle_count
+    )
+    SignatureBand.objects.bulk_create(
+        SignatureBand(signature=stored, bucket=bucket)
+        for bucket in band_buckets(signature, _setting('BANDS', 16))
+    )
+    return stored
+
+
+def similar_documents(document, user, limit=5):
+    """
+    Other documents ``user`` can see with a version whose text is a
+    near-duplicate of ``document``'s latest version, most similar first, as
+    ``(similarity percent, matching version)`` pairs.
+    """
+    version = document.versions.order_by('-version_number').first()
+    stored = VersionSignature.objects.filter(version=version).first() if version else None
+    if stored is None:
+        return []
+
+    visible = Q(version__document__project__is_public=True) | \
+        Q(version__document__project__owner=user) | \
+        Q(version__document__project__collaborators=user)
+    candidates = (
+        VersionSignature.objects
+        .filter(visible, bands__bucket__in=band_buckets(stored.signature, _setting('BANDS', 16)))
+        .filter(version__document__project__deleted_at__isnull=True)
+        .exclude(version__document=document)
+        .select_related('version__document__project')
+        .distinct()
+    )
+    threshold = default_threshold()
+    best = {}
+    for candidate in candidates:
+        score = estimate_similarity(stored.signature, candidate.signature)
+        document_id = candidate.version.document_id
+        if score >= threshold and score > best.get(document_id, (0, None))[0]:
+            best[document_id] = (score, candidate.version)
+    ranked = sorted(best.values(), key=lambda item: item[0], reverse=True)[:limit]
+    return [(round(score * 100, 1), version) for score, version in ranked]
+
+
+class SimilarityIndexer:
+    """Indexes new versions from a background thread so uploads don't wait for extraction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similarity')
+            return self._executor
+
+    def index_later(self, version):
+        if has_text(version.document.file_type):
+            return self._get_executor().submit(self._index, version.pk)
+        return None
+
+    def _index(self, version_pk):
+        try:
+            version = Version.objects.select_related('document').filter(pk=version_pk).first()
+            if version is not None:
+                list(index_versions([version]))
+        finally:
+            connection.close()
+
+
+indexer = SimilarityIndexer()
@@ -0,0 +1,122 @@
+"""
+Fingerprinted, precompressed static files served by the app itself.
+
+``CompressedManifestStaticFilesStorage`` is the ``collectstatic`` storage:
+on top of Django's content-hashed names it writes a ``.gz`` and a ``.br``
+next to every text asset, so nothing is compressed per request (only ``.gz``
+if the ``brotli`` dependency is missing). ``StaticFileIndex`` maps the
+collected files to URLs once at startup for ``StaticFilesMiddleware``, which
+serves hashed names with a far-future immutable ``Cache-Control``.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'css', 'js', 'mjs', 'map', 'svg', 'json', 'txt', 'html', 'xml', 'ico', 'ttf', 'otf', 'eot'}
+# Compressed files smaller than this fraction of the original aren't worth a variant.
+MIN_SAVING = 0.95
+MIN_SIZE = 256
+# Encodings in order of preference, with their file suffixes.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+# ManifestStaticFilesStorage inserts a 12 character hex hash before the extension.
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+
+def compress(path):
+    """Write ``.gz`` and ``.br`` variants of ``path``; returns the paths written."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_SIZE:
+        return []
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * MIN_SAVING:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Templates referring to a file collectstatic hasn't seen get its plain
+    # name instead of a 500; the middleware gives it a short cache lifetime.
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in list(self.hashed_files.values()) + list(paths):
+            if name.rsplit('.', 1)[-1].lower() not in COMPRESSIBLE_EXTENSIONS or not self.exists(name):
+                continue
+            for written in compress(self.path(name)):
+                yield name, os.path.relpath(written, self.location), True
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.last_modified = http_date(stat.st_mtime)
+        version = f'{int(stat.st_mtime):x}-{stat.st_size:x}'
+        content_type, _ = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'image/svg+xml'):
+            self.content_type += '; charset=utf-8'
+        self.immutable = immutable
+        # encoding -> (path, size)
+        self.variants = {}
+        # encoding (None for identity) -> ETag; each encoding is its own
+        # representation, so caches never mix up their bytes.
+        self.etags = {None: f'"{version}"'}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self.variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+                self.etags[encoding] = f'"{version}-{encoding}"'
+
+
+class StaticFileIndex:
+    """URL path -> ``StaticFile`` for everything under ``STATIC_ROOT``, built once."""
+
+    def __init__(self, root=None, url=None):
+        self.root = str(root or settings.STATIC_ROOT or '')
+        self.prefix = url or settings.STATIC_URL or '/static/'
+        if not self.prefix.startswith('/'):
+            self.prefix = '/' + self.prefix
+        self.files = {}
+        if self.root and os.path.isdir(self.root):
+            self._scan()
+
+    def _scan(self):
+        variant_suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if filename.endswith(variant_suffixes) and os.path.exists(path.rsplit('.', 1)[0]):
+                    continue
+                self.files[posixpath.join(self.prefix, name)] = StaticFile(path, bool(HASHED_NAME_RE.search(name)))
+
+    def find(self, path):
+        return self.files.get(path)
@@ -0,0 +1,129 @@
+"""
+Per-process cache of authenticated users and their profiles.
+
+Without it every request loads the ``User`` by the id in the session and
+then ``user.profile`` for role checks. Entries live for
+``DOCTRACK_USER_CACHE_TTL`` seconds and are dropped as soon as the user or
+profile is saved or deleted in this process. Other processes keep serving
+their copy until it expires: a deactivated user stays logged in there for up
+to the TTL, and so do their other sessions after a password change (the
+session that changed it is re-checked at once, its hash no longer matches).
+Set the TTL to 0 where that window is unacceptable. Each hit builds fresh
+model instances, so a request that modifies its user never touches another
+request's copy.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import User
+from django.db.models.fields.files import FieldFile
+from django.utils.crypto import constant_time_compare
+
+from ..models import UserProfile
+from .metrics import record_cache_lookup
+
+
+def _setting(name, default):
+    return getattr(settings, f'DOCTRACK_USER_CACHE_{name}', default)
+
+
+def _field_names(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _values(instance):
+    values = []
+    for name in _field_names(type(instance)):
+        value = getattr(instance, name)
+        # Keep the file name, not a FieldFile bound to this instance.
+        values.append(value.name if isinstance(value, FieldFile) else value)
+    return tuple(values)
+
+
+class UserCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user id -> (expires at, user field values, profile field values or None)
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        """A fresh ``User`` with ``profile`` preloaded, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+        _, user_values, profile_values = entry
+        user = User.from_db('default', _field_names(User), user_values)
+        profile = None
+        if profile_values is not None:
+            profile = UserProfile.from_db('default', _field_names(UserProfile), profile_values)
+            profile.user = user
+        # Cached as None, ``user.profile`` raises DoesNotExist without a query.
+        user._state.fields_cache['profile'] = profile
+        return user
+
+    def put(self, user):
+        ttl = _setting('TTL', 30)
+        if not ttl:
+            return
+        try:
+            profile = user.profile
+        except UserProfile.DoesNotExist:
+            profile = None
+        profile_values = _values(profile) if profile is not None else None
+        user_values = _values(user)
+        with self._lock:
+            self._entries[user.pk] = (time.monotonic() + ttl, user_values, profile_values)
+            self._entries.move_to_end(user.pk)
+            while len(self._entries) > _setting('SIZE', 10000):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def user_saved(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver for User and UserProfile."""
+    user_cache.invalidate(instance.pk if sender is User else instance.user_id)
+
+
+def get_user(request):
+    """``django.contrib.auth.get_user`` answered from ``user_cache`` when possible."""
+    session = request.session
+    user_id = session.get(auth.SESSION_KEY)
+    backend_path = session.get(auth.BACKEND_SESSION_KEY)
+    if user_id is not None and backend_path in settings.AUTHENTICATION_BACKENDS:
+        user = user_cache.get(User._meta.pk.to_python(user_id))
+        session_hash = session.get(auth.HASH_SESSION_KEY)
+        # Anything but a plain match (rotated secret key, changed password)
+        # goes through Django's own checks below.
+        hit = user is not None and session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())
+        record_cache_lookup('user', bool(hit))
+        if hit:
+            user.backend = backend_path
+            return user
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        user_cache.put(user)
+    return user
+
+
+async def aget_user(request):
+    return await sync_to_async(get_user)(request)
+
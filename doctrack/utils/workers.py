@@ -0,0 +1,195 @@
+"""
+Bounded process pools for CPU-heavy work (text extraction and diffing) that
+async views await without blocking the event loop. The ``default`` pool runs
+diffs; the ``extract`` pool runs text extraction, split into page ranges for
+large PDFs. Jobs never submit to a pool themselves.
+
+Every job runs under a wall-clock limit of ``DOCTRACK_WORKER_TIMEOUT``
+seconds, enforced in the worker. Callers waiting with ``result_within`` give
+up shortly after that and kill the pool if the worker failed to stop itself,
+so a hung job never holds a worker or the caller's thread for good.
+"""
+import atexit
+import cProfile
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import registry, QUEUE_DEPTH
+from .profiling import offloaded_stats_path
+
+POOL_SIZE_SETTINGS = {
+    'default': ('DOCTRACK_WORKER_PROCESSES', 2),
+    'extract': ('DOCTRACK_EXTRACT_PROCESSES', 4),
+}
+
+_pools = {}
+_pool_lock = threading.Lock()
+_in_worker = False
+
+
+# Seconds a caller waits past a job's own limit before killing its pool.
+KILL_GRACE = 5
+
+
+def pool_size(name='default'):
+    setting, default = POOL_SIZE_SETTINGS[name]
+    return getattr(settings, setting, default)
+
+
+def get_process_pool(name='default'):
+    """Return the named process pool, creating it on first use."""
+    with _pool_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ProcessPoolExecutor(
+                max_workers=pool_size(name),
+                initializer=_init_worker,
+            )
+        return pool
+
+
+def job_timeout():
+    return getattr(settings, 'DOCTRACK_WORKER_TIMEOUT', 120)
+
+
+def terminate_process_pool(name='default'):
+    """Kill the named pool's workers; the next submit starts a fresh pool."""
+    with _pool_lock:
+        pool = _pools.pop(name, None)
+    if pool is None:
+        return
+    # The executor has no public way to stop a running job.
+    processes = getattr(pool, '_processes', None) or {}
+    for process in list(processes.values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool():
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+atexit.register(shutdown_process_pool)
+
+
+def _init_worker():
+    # A forked child inherits the parent's metric values; don't report them twice.
+    registry.reset()
+    global _in_worker
+    _in_worker = True
+    _pools.clear()
+
+
+def in_worker():
+    """True inside a pool worker, where work must run inline rather than be submitted."""
+    return _in_worker
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def _raise_job_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def _run_and_flush(func, args, timeout, stats_path=None):
+    """
+    Worker-side wrapper: stops the job after ``timeout`` seconds of wall-clock
+    time and makes sure metrics recorded in the child reach the shared directory.
+    With ``stats_path`` the job is profiled and its stats dumped there, unless
+    the profiled request has already given up on them and removed the file.
+    """
+    limit = timeout and hasattr(signal, 'setitimer')
+    profiler = cProfile.Profile() if stats_path else None
+    if limit:
+        signal.signal(signal.SIGALRM, _raise_job_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, *args)
+        return func(*args)
+    finally:
+        if limit:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if profiler is not None and os.path.exists(stats_path):
+            profiler.dump_stats(stats_path)
+        registry.flush(force=True)
+
+
+def submit_to_process(func, *args, queue='default', pool='default'):
+    """
+    Submit ``func(*args)`` to a process pool and return a
+    ``concurrent.futures.Future``. The job raises ``JobTimeout`` once it has
+    run for ``DOCTRACK_WORKER_TIMEOUT`` seconds.
+    """
+    if _in_worker:
+        raise RuntimeError('Pool workers cannot submit jobs to a process pool.')
+    QUEUE_DEPTH.inc(queue=queue)
+    future = get_process_pool(pool).submit(
+        _run_and_flush, func, args, job_timeout(), offloaded_stats_path(func, pool)
+    )
+    future.add_done_callback(lambda _: QUEUE_DEPTH.dec(queue=queue))
+    return future
+
+
+def result_within(future, pool='default'):
+    """
+    ``future.result()`` for a job from ``submit_to_process``, raising
+    ``JobTimeout`` when it has been running ``KILL_GRACE`` seconds past its
+    own limit. A worker that got that far is stuck where the alarm can't
+    reach it, so the pool is killed to get the worker back. Time spent queued
+    behind other jobs doesn't count.
+    """
+    timeout = job_timeout()
+    started = None
+    while True:
+        try:
+            return future.result(1 if timeout else None)
+        except TimeoutError:
+            if not future.running():
+                continue
+            started = started or time.monotonic()
+            if time.monotonic() - started > timeout + KILL_GRACE:
+                terminate_process_pool(pool)
+                raise JobTimeout() from None
+
+
+class CPUBudgetExceeded(Exception):
+    pass
+
+
+def _raise_budget_exceeded(signum, frame):
+    raise CPUBudgetExceeded()
+
+
+@contextmanager
+def cpu_time_limit(seconds):
+    """
+    Raise ``CPUBudgetExceeded`` inside the block once the process has used
+    ``seconds`` of CPU time. Only enforced on the main thread of platforms
+    with ``setitimer`` (pool workers on Unix); elsewhere it is a no-op.
+    """
+    enforce = (
+        seconds and hasattr(signal, 'setitimer')
+        and threading.current_thread() is threading.main_thread()
+    )
+    if not enforce:
+        yield
+        return
+    previous = signal.signal(signal.SIGPROF, _raise_budget_exceeded)
+    signal.setitimer(signal.ITIMER_PROF, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
@@ -1,13 +1,23 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import posixpath
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Q, Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Q, Count, OuterRef, Subquery
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
 from django.utils import timezone
+from django.utils.text import slugify
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
 
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
@@ -23,8 +33,18 @@ from .forms import (
     DocumentForm, VersionUploadForm, PullRequestForm, ReviewForm,
     WorkItemForm, CommentForm
 )
-from .utils.file_handlers import get_file_type, get_file_info, format_file_size
-from .utils.comparison import compare_documents, get_diff_stats
+from .utils.file_handlers import get_file_info, format_file_size
+from .utils.handlers import detect_file_type
+from .utils.comparison import get_diff_stats
+from .utils.comments import comment_threads
+from .utils.export import export_project, aiterate
+from .utils.scheduler import scheduler
+from .utils.similarity import indexer, similar_documents
+from .utils.renditions import renditions, rendition_sizes, content_hash, FORMATS as RENDITION_FORMATS, PREVIEW_TYPES
+from .utils.instrumentation import load_request_log, summarize_requests
+from .utils.metrics import registry
+from .utils.quotas import storage_usage
+from .utils.purge import purger
 
 
 def home(request):
@@ -151,8 +171,10 @@ def project_detail(request, pk):
         messages.error(request, 'You do not have access to this project.')
         return redirect('project_list')
     
+    latest_version = Version.objects.filter(document=OuterRef('pk')).order_by('-version_number')
     documents = project.documents.annotate(
-        version_count=Count('versions')
+        version_count=Count('versions'),
+        latest_version_id=Subquery(latest_version.values('pk')[:1]),
     ).order_by('-updated_at')
     
     open_prs = project.pull_requests.filter(status='open').order_by('-created_at')[:5]
@@ -165,10 +187,27 @@ def project_detail(request, pk):
         'open_prs': open_prs,
         'work_items': work_items,
         'activities': activities,
+        'preview_types': PREVIEW_TYPES,
     }
     return render(request, 'projects/detail.html', context)
 
 
+@login_required
+def project_export(request, pk):
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not (project.is_public or project.owner == request.user or request.user in project.collaborators.all()):
+        messages.error(request, 'You do not have access to this project.')
+        return redirect('project_list')
+    
+    content = export_project(project, include_text=request.GET.get('text') == '1')
+    if isinstance(request, ASGIRequest):
+        content = aiterate(content)
+    response = StreamingHttpResponse(content, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{slugify(project.name) or "project"}-export.zip"'
+    return response
+
+
 @login_required
 def project_settings(request, pk):
     project = get_object_or_404(Project, pk=pk, owner=request.user)
@@ -184,16 +223,30 @@ def project_settings(request, pk):
     
     collaborators = project.collaborators.all()
     all_users = User.objects.exclude(pk=request.user.pk).exclude(pk__in=collaborators)
+    storage_used, storage_quota = storage_usage(project)
     
     context = {
         'project': project,
         'form': form,
         'collaborators': collaborators,
         'all_users': all_users,
+        'storage_used': storage_used,
+        'storage_quota': storage_quota,
     }
     return render(request, 'projects/settings.html', context)
 
 
+@login_required
+@require_POST
+def project_delete(request, pk):
+    project = get_object_or_404(Project, pk=pk, owner=request.user)
+    # Hide it now; the documents, files and history go in the background.
+    if project.mark_deleted():
+        transaction.on_commit(lambda: purger.purge_later(project.pk))
+    messages.success(request, f'Project "{project.name}" deleted.')
+    return redirect('project_list')
+
+
 @login_required
 @require_POST
 def project_add_collaborator(request, pk):
@@ -227,10 +280,10 @@ def document_upload(request, project_pk):
         return redirect('project_detail', pk=project_pk)
     
     if request.method == 'POST':
-        form = DocumentForm(request.POST, request.FILES)
+        form = DocumentForm(request.POST, request.FILES, project=project)
         if form.is_valid():
             file = form.cleaned_data['file']
-            file_type = get_file_type(file.name)
+            file_type = detect_file_type(file, file.name)
             
             document = Document.objects.create(
                 name=form.cleaned_data['name'],
@@ -240,13 +293,14 @@ def document_upload(request, project_pk):
                 created_by=request.user
             )
             
-            Version.objects.create(
+            version = Version.objects.create(
                 document=document,
-                version_number=1,
                 file=file,
                 change_summary='Initial version',
                 uploaded_by=request.user
             )
+            renditions.warm(version)
+            indexer.index_later(version)
             
             Activity.objects.create(
                 user=request.user,
@@ -276,7 +330,7 @@ def document_detail(request, pk):
     
     versions = document.versions.all()
     latest_version = versions.first()
-    comments = document.comments.filter(parent__isnull=True).order_by('-created_at')
+    comments = comment_threads(document, request.GET.get('comments_page'))
     pull_requests = document.pull_requests.order_by('-created_at')[:5]
     
     file_info = None
@@ -295,6 +349,8 @@ def document_detail(request, pk):
         'pull_requests': pull_requests,
         'file_info': file_info,
         'comment_form': CommentForm(),
+        'preview_types': PREVIEW_TYPES,
+        'similar_documents': similar_documents(document, request.user),
     }
     return render(request, 'documents/detail.html', context)
 
@@ -309,23 +365,21 @@ def document_upload_version(request, pk):
         return redirect('document_detail', pk=pk)
     
     if request.method == 'POST':
-        form = VersionUploadForm(request.POST, request.FILES)
+        form = VersionUploadForm(request.POST, request.FILES, project=project)
         if form.is_valid():
             file = form.cleaned_data['file']
             
-            last_version = document.versions.order_by('-version_number').first()
-            new_version_number = (last_version.version_number + 1) if last_version else 1
-            
+            # Numbered atomically by Version.save; concurrent uploads don't collide.
             version = Version.objects.create(
                 document=document,
-                version_number=new_version_number,
                 file=file,
                 change_summary=form.cleaned_data.get('change_summary', ''),
                 uploaded_by=request.user
             )
             
-            document.updated_at = timezone.now()
-            document.save()
+            Document.objects.filter(pk=document.pk).update(updated_at=timezone.now())
+            renditions.warm(version)
+            indexer.index_later(version)
             
             Activity.objects.create(
                 user=request.user,
@@ -348,16 +402,88 @@ def document_upload_version(request, pk):
     })
 
 
+# Shown while a rendition is still being rendered; never cached.
+RENDITION_PLACEHOLDER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">'
+    '<rect width="100%" height="100%" fill="#f3f4f6"/></svg>'
+)
+
+
 @login_required
-def document_compare(request, pk):
-    document = get_object_or_404(Document, pk=pk)
+def version_rendition(request, pk, size, fmt):
+    version = get_object_or_404(
+        Version.objects.select_related('document__project'), pk=pk, document__project__deleted_at__isnull=True
+    )
+    project = version.document.project
+    if not (project.is_public or project.owner == request.user or request.user in project.collaborators.all()):
+        raise Http404
+    if size not in rendition_sizes() or fmt not in RENDITION_FORMATS or \
+            version.document.file_type not in PREVIEW_TYPES:
+        raise Http404
+
+    # A version's file never changes, so neither does its rendition.
+    etag = f'"{renditions.key(version, size)}.{fmt}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        try:
+            path = renditions.wait(version, size, fmt, getattr(settings, 'DOCTRACK_RENDITION_WAIT', 5))
+        except TimeoutError:
+            width, height = rendition_sizes()[size]
+            response = HttpResponse(RENDITION_PLACEHOLDER.format(width, height), content_type='image/svg+xml')
+            response['Cache-Control'] = 'no-store'
+            return response
+        if path is None:
+            raise Http404
+        response = FileResponse(open(path, 'rb'), content_type=RENDITION_FORMATS[fmt][1])
+    response['ETag'] = etag
+    response['Cache-Control'] = (
+        f"{'public' if project.is_public else 'private'}, max-age=31536000, immutable"
+    )
+    return response
+
+
+@login_required
+def version_heatmap(request, pk, base_pk, width, height):
+    """The image diff heatmap of version ``pk`` against ``base_pk``, stored by ``compare_images``."""
+    from .utils.image_diff import heatmap_name
+
+    version = get_object_or_404(
+        Version.objects.select_related('document__project'), pk=pk, document__project__deleted_at__isnull=True
+    )
+    project = version.document.project
+    if not (project.is_public or project.owner == request.user or request.user in project.collaborators.all()):
+        raise Http404
+    base = get_object_or_404(Version, pk=base_pk, document=version.document_id)
+    name = heatmap_name(content_hash(base), content_hash(version), (width, height))
+    if not default_storage.exists(name):
+        raise Http404
+
+    # Named after both files' contents, so it never changes either.
+    etag = f'"{posixpath.basename(name)}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(default_storage.open(name), content_type='image/png')
+    response['ETag'] = etag
+    response['Cache-Control'] = (
+        f"{'public' if project.is_public else 'private'}, max-age=31536000, immutable"
+    )
+    return response
+
+
+@login_required
+async def document_compare(request, pk):
+    user = await request.auser()
+    document = await aget_object_or_404(Document.objects.select_related('project'), pk=pk)
     project = document.project
     
-    if not (project.is_public or project.owner == request.user or request.user in project.collaborators.all()):
+    if not (project.is_public or project.owner_id == user.pk or
+            await project.collaborators.filter(pk=user.pk).aexists()):
         messages.error(request, 'You do not have access to this document.')
         return redirect('project_list')
     
-    versions = document.versions.all()
+    versions = [v async for v in document.versions.all()]
     
     v1_id = request.GET.get('v1')
     v2_id = request.GET.get('v2')
@@ -367,17 +493,24 @@ def document_compare(request, pk):
     version2 = None
     
     if v1_id and v2_id:
-        version1 = get_object_or_404(Version, pk=v1_id, document=document)
-        version2 = get_object_or_404(Version, pk=v2_id, document=document)
+        version1 = await aget_object_or_404(Version, pk=v1_id, document=document)
+        version2 = await aget_object_or_404(Version, pk=v2_id, document=document)
         
         try:
-            comparison = compare_documents(
+            comparison = await scheduler.compare(
+                (version1.pk, version2.pk),
+                user.pk,
                 version1.file.path,
                 version2.file.path,
                 document.file_type
             )
         except Exception as e:
             comparison = {'error': str(e), 'can_compare': False}
+        if comparison.get('heatmap'):
+            width, height = comparison['heatmap']
+            comparison = dict(comparison, heatmap_url=reverse(
+                'version_heatmap', args=[version2.pk, version1.pk, width, height]
+            ))
     
     context = {
         'document': document,
@@ -387,7 +520,7 @@ def document_compare(request, pk):
         'version2': version2,
         'comparison': comparison,
     }
-    return render(request, 'documents/compare.html', context)
+    return await sync_to_async(render)(request, 'documents/compare.html', context)
 
 
 @login_required
@@ -467,20 +600,26 @@ def pull_request_create(request, document_pk):
 
 
 @login_required
-def pull_request_detail(request, pk):
-    pr = get_object_or_404(PullRequest, pk=pk)
+async def pull_request_detail(request, pk):
+    user = await request.auser()
+    pr = await aget_object_or_404(
+        PullRequest.objects.select_related('project', 'document', 'source_version', 'target_version'),
+        pk=pk
+    )
     project = pr.project
     
-    if not (project.is_public or project.owner == request.user or 
-            request.user in project.collaborators.all() or
-            request.user in pr.reviewers.all()):
+    is_collaborator = await project.collaborators.filter(pk=user.pk).aexists()
+    is_reviewer = await pr.reviewers.filter(pk=user.pk).aexists()
+    if not (project.is_public or project.owner_id == user.pk or is_collaborator or is_reviewer):
         messages.error(request, 'You do not have access to this pull request.')
         return redirect('pull_request_list')
     
     comparison = None
     if pr.target_version:
         try:
-            comparison = compare_documents(
+            comparison = await scheduler.compare(
+                (pr.target_version_id, pr.source_version_id),
+                user.pk,
                 pr.target_version.file.path,
                 pr.source_version.file.path,
                 pr.document.file_type
@@ -489,17 +628,17 @@ def pull_request_detail(request, pk):
             comparison = {'error': str(e), 'can_compare': False}
     
     reviews = pr.reviews.order_by('-created_at')
-    comments = pr.comments.filter(parent__isnull=True).order_by('-created_at')
+    comments = await sync_to_async(comment_threads)(pr, request.GET.get('comments_page'))
     
     can_review = (
         pr.status == 'open' and 
-        request.user != pr.created_by and
-        (project.owner == request.user or request.user in project.collaborators.all() or request.user in pr.reviewers.all())
+        user.pk != pr.created_by_id and
+        (project.owner_id == user.pk or is_collaborator or is_reviewer)
     )
     
     can_merge = (
         pr.status == 'approved' and
-        (project.owner == request.user or request.user == pr.created_by)
+        (project.owner_id == user.pk or user.pk == pr.created_by_id)
     )
     
     context = {
@@ -513,7 +652,7 @@ def pull_request_detail(request, pk):
         'review_form': ReviewForm(),
         'comment_form': CommentForm(),
     }
-    return render(request, 'reviews/pr_detail.html', context)
+    return await sync_to_async(render)(request, 'reviews/pr_detail.html', context)
 
 
 @login_required
@@ -656,7 +795,7 @@ def work_item_detail(request, pk):
         messages.error(request, 'You do not have access to this work item.')
         return redirect('project_list')
     
-    comments = work_item.comments.filter(parent__isnull=True).order_by('-created_at')
+    comments = comment_threads(work_item, request.GET.get('comments_page'))
     
     context = {
         'work_item': work_item,
@@ -720,18 +859,24 @@ def add_comment(request):
             project = comment.work_item.project
         
         if parent_id:
-            comment.parent = get_object_or_404(Comment, pk=parent_id)
-        
-        comment.save()
+            # Replies must stay on their parent's thread.
+            comment.parent = get_object_or_404(
+                Comment, pk=parent_id, document=comment.document,
+                pull_request=comment.pull_request, work_item=comment.work_item,
+            )
         
-        Activity.objects.create(
-            user=request.user,
-            action='commented',
-            target_type='Comment',
-            target_id=comment.id,
-            target_name=comment.content[:50],
-            project=project
-        )
+        # Saving a reply also bumps its thread's reply_count.
+        with transaction.atomic():
+            comment.save()
+            
+            Activity.objects.create(
+                user=request.user,
+                action='commented',
+                target_type='Comment',
+                target_id=comment.id,
+                target_name=comment.content[:50],
+                project=project
+            )
         
         messages.success(request, 'Comment added.')
     
@@ -813,3 +958,25 @@ def search(request):
 def logout_view(request):
     logout(request)           # clears the session
     return redirect('login')  # send user to login page
+
+
+@staff_member_required
+def performance_summary(request):
+    records = load_request_log()
+    context = {
+        'title': 'Request performance',
+        'summary': summarize_requests(records),
+        'record_count': len(records),
+    }
+    return render(request, 'admin/performance_summary.html', context)
+
+
+def metrics(request):
+    token = getattr(settings, 'DOCTRACK_METRICS_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse('Unauthorized', status=401)
+    elif not request.user.is_staff:
+        # Without a token only staff may look, and nobody else learns it exists.
+        raise Http404
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
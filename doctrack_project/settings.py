@@ -28,20 +28,23 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'doctrack.middleware.StaticFilesMiddleware',
+    'doctrack.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'doctrack.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
+    'doctrack.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'doctrack_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'doctrack.utils.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -60,9 +63,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the shared in-memory database, which fails
+        # concurrent writers with "table is locked" instead of letting them
+        # wait; the concurrency tests depend on it.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every worker process on the host, so a logout or session
+    # change made by one process is seen by the others.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Finished document comparisons, likewise shared between processes.
+    'comparisons': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'comparisons',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Sessions are read from the cache and written through to the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -83,6 +113,18 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# collectstatic writes content-hashed names plus .gz/.br copies, which
+# StaticFilesMiddleware serves; unhashed names are cached this many seconds.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'doctrack.utils.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+DOCTRACK_STATIC_MAX_AGE = 60
+
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -100,3 +142,135 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800
 
 CSRF_TRUSTED_ORIGINS = ['https://*.replit.dev', 'https://*.replit.app', 'http://localhost:5000', 'http://127.0.0.1:5000']
+
+LOG_DIR = BASE_DIR / 'logs'
+os.makedirs(LOG_DIR, exist_ok=True)
+
+DOCTRACK_PERF_LOG = LOG_DIR / 'requests.jsonl'
+DOCTRACK_DUPLICATE_QUERY_THRESHOLD = 2
+
+# Shared directory for multi-process metrics; leave unset for a single process.
+# /metrics needs "Authorization: Bearer <token>" when the token is set, and a
+# staff login otherwise.
+DOCTRACK_METRICS_DIR = os.environ.get('DOCTRACK_METRICS_DIR')
+DOCTRACK_METRICS_TOKEN = os.environ.get('DOCTRACK_METRICS_TOKEN')
+
+# Allow staff to profile a request with ?profile=1 or an X-Profile header.
+DOCTRACK_PROFILING_ENABLED = True
+
+# Process pool for extraction and diffing offloaded from async views.
+DOCTRACK_WORKER_PROCESSES = int(os.environ.get('DOCTRACK_WORKER_PROCESSES', 2))
+
+# Wall-clock seconds a job may run in a worker process before it is stopped;
+# a worker that doesn't stop gets its pool killed a few seconds later.
+DOCTRACK_WORKER_TIMEOUT = 120
+
+# PDFs with at least this many pages are extracted in parallel page ranges.
+DOCTRACK_EXTRACT_PROCESSES = int(os.environ.get('DOCTRACK_EXTRACT_PROCESSES', 4))
+DOCTRACK_PDF_PARALLEL_MIN_PAGES = 40
+
+# `manage.py bench` fails when a fresh interpreter takes longer than this to
+# set up Django and import the URLconf.
+DOCTRACK_COLD_START_TARGET_MS = 500
+
+# Comparison scheduler: concurrent diffs per process and per user, CPU seconds
+# per diff, seconds a request waits before showing a "still computing" poll,
+# how long finished results are cached (partial ones, cut short by the CPU
+# budget, for less), and in which cache alias (it must be shared by all worker
+# processes).
+DOCTRACK_COMPARE_MAX_INFLIGHT = DOCTRACK_WORKER_PROCESSES
+DOCTRACK_COMPARE_MAX_PER_USER = 2
+DOCTRACK_COMPARE_CPU_BUDGET = 30
+DOCTRACK_COMPARE_WAIT = 10
+DOCTRACK_COMPARE_RESULT_TTL = 300
+DOCTRACK_COMPARE_PARTIAL_TTL = 30
+DOCTRACK_COMPARE_CACHE = 'comparisons'
+
+# Image comparison: longest side of the pixel-diff grid, per-channel change
+# tolerance, perceptual-hash distance treated as "nearly identical" (skips the
+# pixel diff), region cell size in grid pixels and most regions reported.
+DOCTRACK_IMAGE_DIFF_SIZE = 512
+DOCTRACK_IMAGE_DIFF_TOLERANCE = 32
+DOCTRACK_IMAGE_DIFF_HASH_DISTANCE = 0
+DOCTRACK_IMAGE_DIFF_REGION_CELL = 16
+DOCTRACK_IMAGE_DIFF_MAX_REGIONS = 20
+
+# Thumbnails and previews: named sizes, where rendered files are cached and
+# the cache's size limit (least recently used files are evicted first), and
+# how long a request waits for a rendition before serving a placeholder.
+DOCTRACK_RENDITION_SIZES = {
+    'small': (160, 160),
+    'medium': (480, 480),
+    'large': (1024, 1024),
+}
+DOCTRACK_RENDITION_DIR = BASE_DIR / 'renditions'
+DOCTRACK_RENDITION_CACHE_BYTES = 256 * 1024 * 1024
+DOCTRACK_RENDITION_WAIT = 5
+
+# Near-duplicate detection: words per shingle, MinHash signature length, LSH
+# bands (signature length must divide evenly), minimum distinct shingles for a
+# document to be indexed, and the estimated similarity reported as a duplicate.
+# With 16 bands of 8 rows, pairs around 70% similar start becoming candidates.
+DOCTRACK_SIMILARITY_SHINGLE_SIZE = 5
+DOCTRACK_SIMILARITY_NUM_PERM = 128
+DOCTRACK_SIMILARITY_BANDS = 16
+DOCTRACK_SIMILARITY_MIN_SHINGLES = 20
+DOCTRACK_SIMILARITY_THRESHOLD = 0.8
+
+# Top-level comment threads per page on document, PR and work item pages.
+DOCTRACK_COMMENT_THREADS_PER_PAGE = 20
+
+# Documents written per transaction by the import_documents command.
+DOCTRACK_IMPORT_BATCH_SIZE = 50
+
+# Default storage quotas in bytes (None is unlimited); a project's or team's
+# own storage_quota takes precedence. reconcile_storage checks the usage
+# counters against the files on disk this many versions at a time.
+DOCTRACK_PROJECT_QUOTA_BYTES = None
+DOCTRACK_TEAM_QUOTA_BYTES = None
+DOCTRACK_RECONCILE_BATCH_SIZE = 1000
+
+# Rows deleted per statement when purging a deleted project.
+DOCTRACK_PURGE_BATCH_SIZE = 500
+
+# Admin changelists count filtered results exactly up to this many rows and
+# estimate unfiltered tables above it; CSV exports fetch this many rows at a time.
+DOCTRACK_ADMIN_EXACT_COUNT_LIMIT = 10000
+DOCTRACK_ADMIN_CSV_CHUNK_SIZE = 2000
+
+# Seconds an authenticated user and profile stay in each process's cache, and
+# the most users cached per process. Saves only invalidate the process making
+# them, so other processes may accept a deactivated user or a session from
+# before a password change for up to the TTL; 0 disables the cache.
+DOCTRACK_USER_CACHE_TTL = 30
+DOCTRACK_USER_CACHE_SIZE = 10000
+
+# JSON API: default and largest page size, and most sub-requests per batch.
+DOCTRACK_API_PAGE_SIZE = 50
+DOCTRACK_API_MAX_PAGE_SIZE = 200
+DOCTRACK_API_BATCH_LIMIT = 50
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'raw': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'perf_log': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': DOCTRACK_PERF_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'formatter': 'raw',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'doctrack.perf': {
+            'handlers': ['perf_log'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -1,27 +1,73 @@
 // DocTrack main JavaScript
-document.addEventListener('DOMContentLoaded', function() {
-    // Initialize drag and drop zones
-    initDragDrop();
+document.querySelectorAll('.drag-drop-zone').forEach(zone => {
+    zone.addEventListener('dragover', (e) => {
+        e.preventDefault();
+        zone.classList.add('dragover');
+    });
+    zone.addEventListener('dragleave', () => {
+        zone.classList.remove('dragover');
+    });
+    zone.addEventListener('drop', (e) => {
+        e.preventDefault();
+        zone.classList.remove('dragover');
+        const input = zone.querySelector('input[type="file"]');
+        if (input && e.dataTransfer.files.length) {
+            input.files = e.dataTransfer.files;
+            const event = new Event('change', { bubbles: true });
+            input.dispatchEvent(event);
+        }
+    });
 });
 
-function initDragDrop() {
-    document.querySelectorAll('.drag-drop-zone').forEach(zone => {
-        zone.addEventListener('dragover', (e) => {
-            e.preventDefault();
-            zone.classList.add('dragover');
-        });
-        zone.addEventListener('dragleave', () => {
-            zone.classList.remove('dragover');
-        });
-        zone.addEventListener('drop', (e) => {
-            e.preventDefault();
-            zone.classList.remove('dragover');
-            const input = zone.querySelector('input[type="file"]');
-            if (input && e.dataTransfer.files.length) {
-                input.files = e.dataTransfer.files;
-                const event = new Event('change', { bubbles: true });
-                input.dispatchEvent(event);
-            }
+// Theme Toggle Logic
+var themeToggleDarkIcon = document.getElementById('theme-toggle-dark-icon');
+var themeToggleLightIcon = document.getElementById('theme-toggle-light-icon');
+
+// Change the icons inside the button based on previous settings
+if (localStorage.theme === 'dark' || (!('theme' in localStorage) && window.matchMedia('(prefers-color-scheme: dark)').matches)) {
+    themeToggleLightIcon.classList.remove('hidden');
+} else {
+    themeToggleDarkIcon.classList.remove('hidden');
+}
+
+var themeToggleBtn = document.getElementById('theme-toggle');
+
+themeToggleBtn.addEventListener('click', function() {
+    // toggle icons inside button
+    themeToggleDarkIcon.classList.toggle('hidden');
+    themeToggleLightIcon.classList.toggle('hidden');
+
+    // if set via local storage previously
+    if (localStorage.theme === 'dark') {
+        localStorage.theme = 'light';
+        document.documentElement.classList.remove('dark');
+    } else {
+        localStorage.theme = 'dark';
+        document.documentElement.classList.add('dark');
+    }
+});
+
+// Profile Dropdown Toggle
+var profileToggle = document.getElementById('profile-toggle');
+var profileMenu = document.getElementById('profile-menu');
+
+if (profileToggle && profileMenu) {
+    profileToggle.addEventListener('click', function(e) {
+        e.preventDefault();
+        profileMenu.classList.toggle('hidden');
+    });
+
+    // Close menu when clicking outside
+    document.addEventListener('click', function(e) {
+        if (!profileToggle.contains(e.target) && !profileMenu.contains(e.target)) {
+            profileMenu.classList.add('hidden');
+        }
+    });
+
+    // Close menu when clicking on profile or logout links
+    profileMenu.querySelectorAll('a').forEach(function(link) {
+        link.addEventListener('click', function() {
+            profileMenu.classList.add('hidden');
         });
     });
 }